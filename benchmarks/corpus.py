@@ -0,0 +1,122 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import math
+import random
+from pathlib import Path
+
+# Lines per module follow a log-normal distribution: many small modules, a few large ones
+DEFAULT_MEDIAN_LINES = 150
+DEFAULT_SIZE_SIGMA = 1.0
+MAX_LINES = 20000
+
+
+class CorpusSpec:
+    """
+    Shape of a synthetic source tree.
+    :param files: Number of Python modules.
+    :param median_lines: Median module length in lines.
+    :param size_sigma: Spread of the log-normal size distribution; 0 makes every module the same size.
+    :param depth: Maximum folder nesting depth.
+    :param fanout: Subfolders per folder.
+    :param seed: Random seed; the same spec always produces the same tree.
+    """
+
+    def __init__(self, files=200, median_lines=DEFAULT_MEDIAN_LINES, size_sigma=DEFAULT_SIZE_SIGMA, depth=3, fanout=4, seed=1):
+        self.files = files
+        self.median_lines = median_lines
+        self.size_sigma = size_sigma
+        self.depth = depth
+        self.fanout = fanout
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def folder_paths(depth, fanout):
+    """Every folder of a tree with the given depth and fan-out, root first."""
+    folders = [()]
+    level = [()]
+    for _ in range(depth):
+        level = [parent + (f"pkg{i}",) for parent in level for i in range(fanout)]
+        folders.extend(level)
+    return folders
+
+
+def function_source(rng, name, indent=""):
+    """One function with a docstring, a loop and a branch, about ten lines long."""
+    arg = rng.choice(["items", "values", "records", "rows"])
+    limit = rng.randint(1, 100)
+    return (
+        f"{indent}def {name}({arg}, limit={limit}):\n"
+        f'{indent}    """Process {arg} up to {limit}."""\n'
+        f"{indent}    result = []\n"
+        f"{indent}    for index, item in enumerate({arg}):\n"
+        f"{indent}        if index >= limit:\n"
+        f"{indent}            break\n"
+        f"{indent}        if item is not None and item % {rng.randint(2, 9)} == 0:\n"
+        f"{indent}            result.append(item * {rng.randint(2, 9)})\n"
+        f"{indent}    return result\n"
+    )
+
+
+def module_source(rng, lines):
+    """A module of roughly `lines` lines made of imports, functions and classes."""
+    parts = ['"""Synthetic benchmark module."""\n', "import os\nimport sys\n"]
+    written = 4
+    counter = 0
+    while written < lines:
+        counter += 1
+        if rng.random() < 0.3:
+            methods = rng.randint(2, 6)
+            body = "".join(
+                "\n" + function_source(rng, f"method_{i}", "    ").replace("(", "(self, ", 1)
+                for i in range(methods)
+            )
+            parts.append(f"\n\nclass Model{counter}:\n" f'    """Synthetic class {counter}."""\n' + body)
+            written += 4 + methods * 10
+        else:
+            parts.append("\n\n" + function_source(rng, f"function_{counter}"))
+            written += 11
+    return "".join(parts)
+
+
+def generate_corpus(root, spec):
+    """
+    Write a synthetic tree described by `spec` under `root`.
+    :return: The total size of the generated files in bytes.
+    """
+    rng = random.Random(spec.seed)
+    root = Path(root)
+    folders = folder_paths(spec.depth, spec.fanout)
+    total_bytes = 0
+    for index in range(spec.files):
+        folder = root.joinpath(*rng.choice(folders))
+        folder.mkdir(parents=True, exist_ok=True)
+        lines = spec.median_lines * math.exp(rng.gauss(0, spec.size_sigma)) if spec.size_sigma else spec.median_lines
+        source = module_source(rng, min(int(lines), MAX_LINES))
+        (folder / f"module_{index}.py").write_text(source, encoding="utf-8")
+        total_bytes += len(source)
+    return total_bytes
@@ -0,0 +1,215 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import time
+from urllib.request import urlopen
+
+# Characters per server-sent event when streaming
+STREAM_CHUNK_CHARS = 64
+
+# Characters per token, the same rough estimate the engine uses
+CHARS_PER_TOKEN = 4
+
+
+class ServerSpec:
+    """
+    Behaviour of the fake chat completions server.
+    :param latency: Mean delay in seconds before the first byte of a response.
+    :param jitter: Standard deviation of that delay, in seconds.
+    :param error_429: Fraction of requests answered with 429 Too Many Requests.
+    :param error_500: Fraction of requests answered with 500 Internal Server Error.
+    :param tokens_per_second: Output speed of a streamed response; 0 sends it at once.
+    :param retry_after: Seconds sent in the Retry-After header of a 429.
+    :param seed: Random seed for latency and error injection.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.01, error_429=0.0, error_500=0.0, tokens_per_second=0, retry_after=0.05, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_429 = error_429
+        self.error_500 = error_500
+        self.tokens_per_second = tokens_per_second
+        self.retry_after = retry_after
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class FakeChatServer:
+    """
+    aiohttp app that answers /v1/chat/completions by echoing the code it was sent.
+    Like the in-process MockBackend it continues after any assistant messages, so
+    continuation requests work, but requests go over real HTTP and pay for
+    connection handling, JSON and SSE parsing.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+        self.stats = {"calls": 0, "errors_429": 0, "errors_500": 0}
+
+    def create_app(self):
+        from aiohttp import web
+
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.complete)
+        app.router.add_get("/stats", self.get_stats)
+        return app
+
+    async def get_stats(self, request):
+        from aiohttp import web
+
+        return web.json_response(self.stats)
+
+    async def complete(self, request):
+        from aiohttp import web
+
+        self.stats["calls"] += 1
+        payload = await request.json()
+        roll = self.rng.random()
+        if roll < self.spec.error_429:
+            self.stats["errors_429"] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached"}}, status=429,
+                headers={"Retry-After": str(self.spec.retry_after)},
+            )
+        if roll < self.spec.error_429 + self.spec.error_500:
+            self.stats["errors_500"] += 1
+            return web.json_response({"error": {"message": "Injected server error"}}, status=500)
+
+        await asyncio.sleep(max(0.0, self.rng.gauss(self.spec.latency, self.spec.jitter)))
+        messages = payload["messages"]
+        text = next(message["content"] for message in messages if message["role"] == "user")
+        written = "".join(message["content"] for message in messages if message["role"] == "assistant")
+        text = text[len(written):]
+        usage = {
+            "prompt_tokens": sum(len(message["content"]) for message in messages) // CHARS_PER_TOKEN,
+            "completion_tokens": len(text) // CHARS_PER_TOKEN,
+        }
+
+        if not payload.get("stream"):
+            if self.spec.tokens_per_second:
+                await asyncio.sleep(usage["completion_tokens"] / self.spec.tokens_per_second)
+            return web.json_response({
+                "choices": [{"message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        pause = STREAM_CHUNK_CHARS / CHARS_PER_TOKEN / self.spec.tokens_per_second if self.spec.tokens_per_second else 0
+        for start in range(0, len(text), STREAM_CHUNK_CHARS):
+            event = {"choices": [{"delta": {"content": text[start:start + STREAM_CHUNK_CHARS]}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(event)}\n\n".encode())
+            if pause:
+                await asyncio.sleep(pause)
+        final = {"choices": [{"delta": {}, "finish_reason": "stop"}]}
+        await response.write(f"data: {json.dumps(final)}\n\n".encode())
+        # Like the real API, usage is only streamed on request, in an event with no choices
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+def serve(spec, port, ready=None):
+    """Run the fake server until the process is terminated."""
+    from aiohttp import web
+
+    async def main():
+        runner = web.AppRunner(FakeChatServer(spec).create_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        if ready is not None:
+            ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+class ServerProcess:
+    """
+    The fake server in a child process, so its memory and CPU use do not show up
+    in the measurements of the pipeline under test.
+    """
+
+    def __init__(self, spec, port=8765):
+        self.spec = spec
+        self.port = port
+        self.process = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def start(self, timeout=10):
+        ready = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=serve, args=(self.spec, self.port, ready), daemon=True)
+        self.process.start()
+        if not ready.wait(timeout):
+            self.stop()
+            raise RuntimeError(f"Fake server did not start on port {self.port}")
+        return self
+
+    def stats(self):
+        with urlopen(f"http://127.0.0.1:{self.port}/stats", timeout=5) as response:
+            return json.loads(response.read())
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main(argv=None):
+    """Run the fake server in the foreground, for manual testing against the GUI or CLI."""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.fake_server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-429", type=float, default=0.0)
+    parser.add_argument("--error-500", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=0)
+    args = parser.parse_args(argv)
+    spec = ServerSpec(args.latency, args.jitter, args.error_429, args.error_500, args.tokens_per_second)
+    print(f"Serving on http://127.0.0.1:{args.port}/v1 (started {time.strftime('%H:%M:%S')})")
+    serve(spec, args.port)
+
+
+if __name__ == "__main__":
+    main()
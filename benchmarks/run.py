@@ -0,0 +1,237 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.corpus import CorpusSpec, generate_corpus
+from benchmarks.fake_server import ServerProcess, ServerSpec
+
+# Results are appended here, one JSON object per line (ignored by git)
+DEFAULT_OUTPUT = "bench_output.txt"
+
+# Quotas high enough that the fake server, not the rate limiter, sets the pace
+UNLIMITED_REQUESTS_PER_MINUTE = 10 ** 6
+UNLIMITED_TOKENS_PER_MINUTE = 10 ** 9
+
+
+def git_commit():
+    """Short hash of HEAD, with '+dirty' when the tree has local changes."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return commit + ("+dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB, or None where it cannot be measured."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q * len(values) + 0.5)) - 1))]
+
+
+def run_once(input_dir, output_dir, server, max_files, max_requests, stream):
+    """Refactor `input_dir` once against the fake server and measure the run."""
+    # Imported here so a corpus can be generated without the engine's dependencies
+    from config import RefactorConfig
+    from indexer import index_python_files
+    from refactor import RefactorHandler
+
+    started = time.perf_counter()
+    indexed_files = index_python_files(input_dir)
+    index_seconds = time.perf_counter() - started
+
+    config = RefactorConfig(
+        input_path=str(input_dir),
+        output_path=str(output_dir),
+        api_key="benchmark",
+        create_output_folder=True,
+        max_concurrent_files=max_files,
+        max_concurrent_requests=max_requests,
+        requests_per_minute=UNLIMITED_REQUESTS_PER_MINUTE,
+        tokens_per_minute=UNLIMITED_TOKENS_PER_MINUTE,
+        use_cache=False,
+        skip_unchanged=False,
+        base_url=server.base_url,
+        stream=stream,
+        write_metrics=False,
+    )
+    calls_before = server.stats()["calls"]
+    handler = RefactorHandler(config)
+    result = asyncio.run(handler.run_refactoring())
+    calls = server.stats()["calls"] - calls_before
+
+    file_seconds = [stats.seconds for stats in handler.metrics.file_stats.values()]
+    files = max(result.files_total, 1)
+    return {
+        "files": result.files_total,
+        "failed": result.files_failed,
+        "chunks": result.chunks,
+        "elapsed": round(result.elapsed, 3),
+        "files_per_second": round(result.files_total / result.elapsed, 2) if result.elapsed else 0.0,
+        "file_p50": round(percentile(file_seconds, 0.5), 4),
+        "file_p99": round(percentile(file_seconds, 0.99), 4),
+        "index_seconds": round(index_seconds, 4),
+        "chunking_seconds": round(handler.metrics.chunking_seconds.sum, 4),
+        "api_calls": calls,
+        "calls_per_file": round(calls / files, 2),
+        "retries": handler.metrics.api_retries.total,
+        "indexed": len(indexed_files),
+    }
+
+
+def previous_result(output_path, params):
+    """The last recorded result with the same parameters, if any."""
+    try:
+        lines = Path(output_path).read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return None
+    for line in reversed(lines):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("params") == params:
+            return record
+    return None
+
+
+def format_change(current, previous):
+    if not previous:
+        return ""
+    return f" ({(current - previous) / previous * 100:+.1f}%)"
+
+
+def print_report(record, previous):
+    """Human-readable summary, with changes against the previous comparable run."""
+    results = record["results"]
+    before = previous["results"] if previous else {}
+    if previous:
+        print(f"Compared with {previous['commit']} from {previous['timestamp']}")
+    for name, label in (
+        ("files_per_second", "files/sec"),
+        ("file_p50", "per-file p50 (s)"),
+        ("file_p99", "per-file p99 (s)"),
+        ("index_seconds", "index (s)"),
+        ("chunking_seconds", "chunking (s)"),
+        ("calls_per_file", "API calls/file"),
+        ("peak_rss_mb", "peak RSS (MiB)"),
+    ):
+        value = results.get(name)
+        if value is None:
+            continue
+        change = format_change(value, before.get(name)) if isinstance(before.get(name), (int, float)) and before.get(name) else ""
+        print(f"  {label:<18} {value}{change}")
+    print(f"  {results['files']} files, {results['chunks']} chunks, {results['failed']} failed, "
+          f"{results['retries']} retries in {results['elapsed']}s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="End-to-end pipeline benchmark against a local fake API.")
+    corpus = parser.add_argument_group("corpus")
+    corpus.add_argument("--files", type=int, default=200, help="Number of generated modules")
+    corpus.add_argument("--median-lines", type=int, default=150, help="Median module length")
+    corpus.add_argument("--size-sigma", type=float, default=1.0, help="Spread of the log-normal module size distribution")
+    corpus.add_argument("--depth", type=int, default=3, help="Maximum folder nesting depth")
+    corpus.add_argument("--fanout", type=int, default=4, help="Subfolders per folder")
+    corpus.add_argument("--seed", type=int, default=1, help="Seed for the corpus and the server")
+    server = parser.add_argument_group("fake server")
+    server.add_argument("--latency", type=float, default=0.05, help="Mean response latency in seconds")
+    server.add_argument("--jitter", type=float, default=0.01, help="Latency standard deviation in seconds")
+    server.add_argument("--error-429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    server.add_argument("--error-500", type=float, default=0.0, help="Fraction of requests answered with 500")
+    server.add_argument("--tokens-per-second", type=float, default=0, help="Streaming output speed; 0 for instant")
+    server.add_argument("--port", type=int, default=8765)
+    pipeline = parser.add_argument_group("pipeline")
+    pipeline.add_argument("--concurrent-files", type=int, default=8)
+    pipeline.add_argument("--concurrent-requests", type=int, default=16)
+    pipeline.add_argument("--no-stream", action="store_true", help="Request whole responses instead of streams")
+    parser.add_argument("--repeat", type=int, default=1, help="Measured runs over the same corpus")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="File the JSON results are appended to")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    corpus_spec = CorpusSpec(args.files, args.median_lines, args.size_sigma, args.depth, args.fanout, args.seed)
+    server_spec = ServerSpec(args.latency, args.jitter, args.error_429, args.error_500, args.tokens_per_second, seed=args.seed)
+    params = {
+        "corpus": corpus_spec.to_dict(),
+        "server": server_spec.to_dict(),
+        "concurrent_files": args.concurrent_files,
+        "concurrent_requests": args.concurrent_requests,
+        "stream": not args.no_stream,
+    }
+
+    # The engine logs to a queue nobody reads here; drain it so it cannot grow
+    from cli import LogPrinter
+
+    printer = LogPrinter(quiet=True)
+    printer.start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="refactor-bench-") as workdir, ServerProcess(server_spec, args.port) as server:
+            input_dir = Path(workdir) / "input"
+            corpus_bytes = generate_corpus(input_dir, corpus_spec)
+            print(f"Corpus: {args.files} modules, {corpus_bytes / 1024:.0f} KiB")
+            for run in range(args.repeat):
+                results = run_once(input_dir, Path(workdir) / f"output{run}", server,
+                                   args.concurrent_files, args.concurrent_requests, not args.no_stream)
+                results["corpus_bytes"] = corpus_bytes
+                results["peak_rss_mb"] = peak_rss_mb()
+                record = {
+                    "commit": git_commit(),
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "params": params,
+                    "results": results,
+                }
+                print(f"Run {run + 1}/{args.repeat}")
+                print_report(record, previous_result(args.output, params))
+                with open(args.output, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+    finally:
+        printer.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import io
+import re
+import tokenize
+from utils import log
+
+# A leading comment block or module docstring matching any of these is a license header
+DEFAULT_LICENSE_PATTERNS = [
+    r"\bMIT License\b",
+    r"\bCopyright\b",
+    r"SPDX-License-Identifier",
+    r"\bLicensed under\b",
+    r"Permission is hereby granted",
+    r"GNU (Lesser |Affero )?General Public License",
+    r"\bApache License\b",
+]
+
+# Begin/end line patterns around blocks that must never be sent to the model
+DEFAULT_INVARIANT_MARKERS = [
+    (r"#\s*refactor:\s*off\b", r"#\s*refactor:\s*on\b"),
+]
+
+# Text of a marked block held while a file is streamed before its end marker is given up on
+MAX_OPEN_BLOCK_CHARS = 4 * 1024 * 1024
+
+
+class Segment:
+    """A run of lines that is either refactored or passed through verbatim."""
+
+    def __init__(self, text, invariant):
+        self.text = text
+        self.invariant = invariant
+
+    def __repr__(self):
+        kind = "invariant" if self.invariant else "code"
+        return f"Segment({kind}, {len(self.text)} chars)"
+
+
+class BoilerplateDetector:
+    """
+    Finds the parts of a file that stay out of the prompt.
+    These are the license header at the top of a file (shebang and encoding lines,
+    then a comment block or module docstring matching one of `license_patterns`),
+    and any block between a pair of `invariant_markers` comment lines. A block that starts or
+    ends inside a top-level statement, such as a function body, takes in that whole
+    statement, so the code around it still parses. Both are re-attached verbatim,
+    so they cost no tokens and are never altered.
+    """
+
+    def __init__(self, license_patterns=None, invariant_markers=None):
+        patterns = DEFAULT_LICENSE_PATTERNS if license_patterns is None else license_patterns
+        markers = DEFAULT_INVARIANT_MARKERS if invariant_markers is None else invariant_markers
+        self.license = re.compile("|".join(f"(?:{pattern})" for pattern in patterns)) if patterns else None
+        self.markers = [(re.compile(begin), re.compile(end)) for begin, end in markers]
+
+    def split(self, code, name=None):
+        """
+        Split source code into segments whose texts concatenate back to `code`.
+        :param name: File name for warnings about unterminated marked blocks.
+        :return: A list of Segment objects, alternating between code and invariant blocks.
+        """
+        return self.split_section(code, name=name)[0]
+
+    def iter_segments(self, sections, name=None):
+        """
+        Split a file read in sections, such as those of `chunker.iter_sections`.
+        A marked block still open at the end of a section is read again with the next
+        one, until it closes, the file ends or it grows beyond MAX_OPEN_BLOCK_CHARS;
+        then its begin marker is ignored.
+        :param sections: Iterator over the sections of one file.
+        :param name: File name for warnings about unterminated marked blocks.
+        :return: An iterator over the Segment objects of the whole file.
+        """
+        rest = ""
+        at_start = True
+        while True:
+            section = next(sections, None)
+            if section is None and not rest:
+                return
+            final = section is None or len(rest) > MAX_OPEN_BLOCK_CHARS
+            section = rest + (section or "")
+            segments, rest = self.split_section(section, at_start, final, name)
+            at_start = at_start and rest == section
+            yield from segments
+
+    def split_section(self, code, at_start=True, final=True, name=None):
+        """
+        Split one section of a file read in pieces.
+        :param at_start: Whether the section starts the file, the only place a license header can be.
+        :param final: Whether the file ends with this section. A marked block still open at the end
+            of the file is a mistake, so its begin marker is ignored with a warning; before that, the
+            block may still be closed by a later section.
+        :return: The segments, and the rest of the section from the statement where a still open
+            block begins, to be read again in front of the next section; "" if there is none.
+        """
+        lines = code.splitlines(keepends=True)
+        invariant = [False] * len(lines)
+        header = self.header_length(code, lines) if at_start else 0
+        for index in range(header):
+            invariant[index] = True
+
+        rest = ""
+        if self.markers and any(begin.search(line) for line in lines for begin, _ in self.markers):
+            spans, comments = self.scan(lines)
+            open_start = self.mark_blocks(lines, invariant, comments)
+            if open_start is not None:
+                if final:
+                    log(f"Ignoring '{lines[open_start].strip()}'{f' in {name}' if name else ''}: "
+                        f"no end marker closes the block", "WARNING")
+                else:
+                    # Cut before the statement the block starts in, so that statement stays whole
+                    cut = next((first for first, last in spans if first <= open_start <= last), open_start)
+                    rest = "".join(lines[cut:])
+                    del lines[cut:], invariant[cut:]
+                    spans = [span for span in spans if span[1] < cut]
+            self.keep_statements_whole(spans, invariant)
+
+        segments = []
+        start = 0
+        for index in range(1, len(lines) + 1):
+            if index == len(lines) or invariant[index] != invariant[start]:
+                segments.append(Segment("".join(lines[start:index]), invariant[start]))
+                start = index
+        return segments, rest
+
+    def header_length(self, code, lines):
+        """Number of leading lines that make up a license header, including the blank lines after it."""
+        if self.license is None:
+            return 0
+        index = 0
+        # Shebang and encoding cookie lines always stay at the top
+        while index < len(lines) and index < 2 and (lines[index].startswith("#!") or re.match(r"#.*coding[:=]", lines[index])):
+            index += 1
+        header_end = index
+
+        # A comment block at the top
+        block_start = index
+        while index < len(lines) and (lines[index].lstrip().startswith("#") or not lines[index].strip()):
+            index += 1
+        if self.license.search("".join(lines[block_start:index])):
+            header_end = index
+
+        # A module docstring right after it
+        docstring_end = self.docstring_end(code, lines, index)
+        if docstring_end and self.license.search("".join(lines[index:docstring_end])):
+            header_end = docstring_end
+
+        if header_end == 0:
+            return 0
+        while header_end < len(lines) and not lines[header_end].strip():
+            header_end += 1
+        return header_end
+
+    @staticmethod
+    def docstring_end(code, lines, first):
+        """Line index just past a string literal statement starting on line `first`, or None."""
+        if first >= len(lines) or not re.match(r"\s*[rRuUbBfF]*('''|\"\"\"|'|\")", lines[first]):
+            return None
+        try:
+            tokens = tokenize.generate_tokens(io.StringIO("".join(lines[first:])).readline)
+            token = next(tokens)
+            while token.type in (tokenize.NL, tokenize.COMMENT, tokenize.INDENT):
+                token = next(tokens)
+            if token.type != tokenize.STRING:
+                return None
+            following = next(tokens)
+        except (tokenize.TokenError, SyntaxError, StopIteration):
+            return None
+        # Only a statement on its own, not the start of an expression such as a concatenation
+        if following.type not in (tokenize.NEWLINE, tokenize.NL, tokenize.ENDMARKER, tokenize.COMMENT):
+            return None
+        return first + token.end[0]
+
+    def mark_blocks(self, lines, invariant, comments):
+        """
+        Flag every line from a begin marker through its end marker.
+        Markers count only on lines that hold nothing but a comment, so marker text in a
+        string or after code is ignored. A begin marker without an end is left unflagged.
+        :param comments: Indexes of the lines that hold nothing but a comment.
+        :return: The index of a begin marker with no end marker after it, or None.
+        """
+        index = 0
+        while index < len(lines):
+            if index in comments:
+                for begin, end in self.markers:
+                    if begin.search(lines[index]):
+                        stop = next((line for line in range(index + 1, len(lines))
+                                     if line in comments and end.search(lines[line])), None)
+                        if stop is None:
+                            return index
+                        for line in range(index, stop + 1):
+                            invariant[line] = True
+                        index = stop
+                        break
+            index += 1
+        return None
+
+    @staticmethod
+    def scan(lines):
+        """
+        Tokenize the lines once for the statement layout and the comment lines.
+        :return: The (first, last) line indexes of each top-level statement, with a
+            definition's decorators counted as part of it, and the set of indexes of the
+            lines that hold nothing but a comment. Source that cannot be tokenized has no
+            statements, and every line starting with "#" counts as a comment.
+        """
+        spans = []
+        comments = set()
+        depth = 0
+        at_statement_start = True
+        decorated = False
+        last_line = None
+        try:
+            for token in tokenize.generate_tokens(io.StringIO("".join(lines)).readline):
+                if token.type == tokenize.COMMENT:
+                    if not token.line[:token.start[1]].strip():
+                        comments.add(token.start[0] - 1)
+                elif token.type == tokenize.INDENT:
+                    depth += 1
+                elif token.type == tokenize.DEDENT:
+                    depth -= 1
+                elif token.type == tokenize.NEWLINE:
+                    at_statement_start = True
+                elif token.type not in (tokenize.NL, tokenize.ENDMARKER):
+                    if at_statement_start and depth == 0:
+                        if not decorated:
+                            if spans:
+                                spans[-1][1] = last_line
+                            spans.append([token.start[0] - 1, None])
+                        decorated = token.type == tokenize.OP and token.string == "@"
+                    at_statement_start = False
+                    last_line = token.end[0] - 1
+        except (tokenize.TokenError, IndentationError, SyntaxError):
+            return [], {index for index, line in enumerate(lines) if line.lstrip().startswith("#")}
+        if spans:
+            spans[-1][1] = last_line
+        return [tuple(span) for span in spans], comments
+
+    @staticmethod
+    def keep_statements_whole(spans, invariant):
+        """Flag every line of a top-level statement that has any flagged line."""
+        for first, last in spans:
+            if any(invariant[first:last + 1]):
+                for line in range(first, last + 1):
+                    invariant[line] = True
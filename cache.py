@@ -0,0 +1,168 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_CACHE_PATH = "refactor_cache.sqlite3"
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def make_cache_key(model, prompt, max_tokens, code):
+    """Content address of a request: everything that determines the model's answer."""
+    payload = json.dumps([model, prompt, max_tokens, code], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent SQLite-backed cache of refactored chunks.
+    Entries are evicted least-recently-used first once the stored responses
+    exceed `max_bytes`. Database work runs in a thread so the event loop never waits on disk.
+    A `read_only` cache never writes to the database, for callers that only look entries up.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_CACHE_MAX_BYTES, enabled=True, read_only=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = None
+        self.total_bytes = 0
+
+    def open(self):
+        """Open the database, creating the table on first use unless the cache is read only."""
+        if self.connection is None and self.read_only:
+            # Through a URI, so that SQLite neither creates nor writes to the file
+            uri = Path(self.path).resolve().as_uri() + "?mode=ro"
+            self.connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        elif self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+            self.connection.commit()
+            row = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+            self.total_bytes = row[0]
+        return self.connection
+
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def get_sync(self, key):
+        with self.lock:
+            connection = self.open()
+            row = connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                connection.commit()
+        return row[0] if row else None
+
+    def contains_sync(self, key):
+        """Check for an entry without counting a lookup or refreshing its LRU position."""
+        with self.lock:
+            connection = self.open()
+            row = connection.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone()
+        return row is not None
+
+    def put_sync(self, key, response):
+        size = len(response.encode("utf-8"))
+        with self.lock:
+            connection = self.open()
+            old = connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+            connection.commit()
+
+    def evict(self):
+        """Drop least-recently-used entries until the cache is back under 90% of its budget."""
+        target = self.max_bytes * 0.9
+        rows = self.connection.execute("SELECT key, size FROM responses ORDER BY last_access")
+        doomed = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            doomed.append((key,))
+            self.total_bytes -= size
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def clear_sync(self):
+        with self.lock:
+            connection = self.open()
+            connection.execute("DELETE FROM responses")
+            connection.commit()
+            connection.execute("VACUUM")
+            self.total_bytes = 0
+
+    async def get(self, key):
+        """
+        Look up a cached response.
+        :param key: Key from `make_cache_key`.
+        :return: The cached response, or None on a miss or when the cache is bypassed.
+        """
+        if not self.enabled:
+            return None
+        response = await asyncio.to_thread(self.get_sync, key)
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    async def put(self, key, response):
+        """Store a response unless the cache is bypassed."""
+        if self.enabled:
+            await asyncio.to_thread(self.put_sync, key, response)
+
+    async def clear(self):
+        """Remove every cached response."""
+        await asyncio.to_thread(self.clear_sync)
+
+    def summary(self):
+        """One-line hit/miss report for the log."""
+        lookups = self.hits + self.misses
+        rate = (self.hits / lookups * 100) if lookups else 0
+        return f"Response cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
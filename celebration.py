@@ -26,7 +26,6 @@ SOFTWARE.
 import tkinter as tk
 from tkinter import messagebox
 import random
-import winsound  # Only for Windows
 import platform
 
 class CelebrationPopup(tk.Toplevel):
@@ -67,6 +66,7 @@ def play_victory_sound():
     # Plays a victory sound using winsound, works on Windows
     if platform.system() == 'Windows':
         try:
+            import winsound  # Only available on Windows
             winsound.Beep(1000, 500)  # Simple beep for 500ms
         except:
             pass  # Beep only works on Windows, we can ignore if unavailable
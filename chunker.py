@@ -0,0 +1,374 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import ast
+import io
+import tokenize
+
+# Bump when chunk boundaries or reassembly change, so incremental runs redo affected outputs
+CHUNKER_VERSION = 3
+
+# Input budget per chunk; the response budget is sized from each chunk, so this
+# mostly bounds the latency of a single request
+DEFAULT_CHUNK_TOKENS = 1200
+
+# Approximate BPE tokens per lexical token. Identifiers, strings and comments
+# cost roughly one token per few characters, operators and newlines one each.
+CHARS_PER_NAME_TOKEN = 8
+CHARS_PER_TEXT_TOKEN = 4
+CHARS_PER_NUMBER_TOKEN = 3
+
+
+# Token budget of a section read from a large file before it is chunked
+DEFAULT_SECTION_TOKENS = DEFAULT_CHUNK_TOKENS * 8
+
+
+class Chunk:
+    """
+    A slice of a source file that is sent to the model as one request.
+    Methods split out of an oversized class are sent dedented; `indent` is the
+    prefix that puts them back inside the class body on reassembly. `separator`
+    restores the line break and blank lines before the chunk, and `trailer` the
+    blank lines after it.
+    """
+
+    def __init__(self, text, start_line, end_line, tokens, indent="", separator="\n", trailer=""):
+        self.text = text
+        self.start_line = start_line
+        self.end_line = end_line
+        self.tokens = tokens
+        self.indent = indent
+        self.separator = separator
+        self.trailer = trailer
+
+    def __repr__(self):
+        return f"Chunk(lines {self.start_line}-{self.end_line}, ~{self.tokens} tokens)"
+
+    def reindent(self, code):
+        """Put refactored code back at this chunk's indentation level."""
+        if not self.indent:
+            return code
+        return "\n".join(self.indent + line if line.strip() else line for line in code.splitlines())
+
+
+def token_cost(token):
+    """Approximate BPE tokens of one lexical token."""
+    if token.type == tokenize.NAME:
+        return 1 + len(token.string) // CHARS_PER_NAME_TOKEN
+    if token.type == tokenize.NUMBER:
+        return 1 + len(token.string) // CHARS_PER_NUMBER_TOKEN
+    if token.type in (tokenize.OP, tokenize.NEWLINE, tokenize.NL, tokenize.INDENT):
+        return 1
+    if token.type in (tokenize.DEDENT, tokenize.ENDMARKER):
+        return 0
+    # Strings, comments and f-string parts
+    return 1 + len(token.string) // CHARS_PER_TEXT_TOKEN
+
+
+def line_token_counts(code):
+    """
+    Estimate BPE tokens per line without calling a tokenizer service.
+    Uses Python's own tokenizer and charges each lexical token by its kind and length;
+    tokens that span lines, such as docstrings, are charged to their first line.
+    :param code: Python source code.
+    :return: A list with one token estimate per line of `code`.
+    """
+    lines = code.splitlines()
+    counts = [0] * len(lines)
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            row = token.start[0] - 1
+            if row < len(counts):
+                counts[row] += token_cost(token)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        # Unterminated or badly indented source: fall back to a per-character estimate
+        return [1 + len(line) // CHARS_PER_TEXT_TOKEN for line in lines]
+    return counts
+
+
+def estimate_tokens(code):
+    """Estimate the number of BPE tokens in a piece of Python source."""
+    return sum(line_token_counts(code))
+
+
+def make_chunk(lines, counts, first, last, indent=""):
+    """
+    Build a chunk from lines `first` to `last` (1-based, inclusive).
+    Surrounding blank lines are stripped from the text and kept as the chunk's
+    separator and trailer, so reassembly reproduces the original spacing.
+    :return: The Chunk, or None if the lines are blank.
+    """
+    chunk_lines = lines[first - 1:last]
+    if indent:
+        chunk_lines = [line[len(indent):] for line in chunk_lines]
+    leading_blank_lines = 0
+    while leading_blank_lines < len(chunk_lines) and not chunk_lines[leading_blank_lines].strip():
+        leading_blank_lines += 1
+    if leading_blank_lines == len(chunk_lines):
+        return None
+    trailing_blank_lines = 0
+    while not chunk_lines[-1 - trailing_blank_lines].strip():
+        trailing_blank_lines += 1
+    text = "\n".join(chunk_lines[leading_blank_lines:len(chunk_lines) - trailing_blank_lines])
+    separator = "\n" * (leading_blank_lines + 1)
+    return Chunk(text, first, last, sum(counts[first - 1:last]), indent, separator, "\n" * trailing_blank_lines)
+
+
+def statement_spans(body, start, end):
+    """
+    Line spans of consecutive statements, covering every line from `start` to `end`.
+    Comments and blank lines before a statement belong to that statement, and
+    anything after the last statement belongs to the last one.
+    :return: A list of (first_line, last_line, node) tuples, 1-based and inclusive.
+    """
+    spans = []
+    next_line = start
+    for node in body:
+        spans.append([next_line, node.end_lineno, node])
+        next_line = node.end_lineno + 1
+    if spans:
+        spans[-1][1] = max(spans[-1][1], end)
+    return [tuple(span) for span in spans]
+
+
+class ChunkBuilder:
+    """Packs statement spans of one file into chunks under a token budget."""
+
+    def __init__(self, code, max_tokens):
+        self.lines = code.splitlines()
+        self.counts = line_token_counts(code)
+        self.max_tokens = max_tokens
+        self.chunks = []
+
+    def span_tokens(self, first, last):
+        return sum(self.counts[first - 1:last])
+
+    def emit(self, first, last, indent=""):
+        chunk = make_chunk(self.lines, self.counts, first, last, indent)
+        if chunk:
+            self.chunks.append(chunk)
+
+    def pack(self, spans, indent=""):
+        """Greedily merge adjacent spans while they fit, splitting oversized classes by method."""
+        group_start = None
+        group_end = None
+        group_tokens = 0
+        for first, last, node in spans:
+            tokens = self.span_tokens(first, last)
+            if group_start is not None and group_tokens + tokens > self.max_tokens:
+                self.emit(group_start, group_end, indent)
+                group_start = None
+                group_tokens = 0
+
+            if tokens > self.max_tokens and isinstance(node, ast.ClassDef) and not indent:
+                self.split_class(first, last, node)
+                continue
+
+            if group_start is None:
+                group_start = first
+            group_end = last
+            group_tokens += tokens
+
+        if group_start is not None:
+            self.emit(group_start, group_end, indent)
+
+    def split_class(self, first, last, node):
+        """
+        Split an oversized class into its header plus groups of members.
+        The header (decorators, class line, docstring and attributes up to the first
+        method) travels with the first group; later groups are sent dedented.
+        Definitions themselves are never cut, so a single huge method becomes its own chunk.
+        """
+        body_start = node.body[0].lineno
+        indent = self.lines[body_start - 1][:node.body[0].col_offset]
+        member_lines = self.lines[body_start - 1:last]
+        # Continuation lines with less indentation (e.g. inside triple-quoted strings)
+        # cannot be dedented losslessly, so such classes are kept whole
+        if indent.strip() or any(line.strip() and not line.startswith(indent) for line in member_lines):
+            self.emit(first, last)
+            return
+
+        spans = statement_spans(node.body, body_start, last)
+        header_end = first
+        header_tokens = self.span_tokens(first, body_start - 1)
+        taken = 0
+        for span_first, span_last, member in spans:
+            if isinstance(member, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and taken:
+                break
+            if header_tokens + self.span_tokens(span_first, span_last) > self.max_tokens and taken:
+                break
+            header_end = span_last
+            header_tokens += self.span_tokens(span_first, span_last)
+            taken += 1
+
+        # Fill the first chunk with methods while they fit, then pack the rest dedented
+        remaining = spans[taken:]
+        while remaining:
+            span_first, span_last, _ = remaining[0]
+            span_cost = self.span_tokens(span_first, span_last)
+            if header_tokens + span_cost > self.max_tokens:
+                break
+            header_end = span_last
+            header_tokens += span_cost
+            remaining = remaining[1:]
+
+        self.emit(first, header_end)
+        self.pack(remaining, indent=indent)
+
+
+def split_by_lines(code, max_tokens):
+    """
+    Fallback for source that does not parse.
+    Cuts at the last unindented line before the budget runs out, so top-level
+    definitions stay whole whenever the file's layout allows it.
+    """
+    lines = code.splitlines()
+    counts = line_token_counts(code)
+    chunks = []
+    start = 0
+    tokens = 0
+    last_boundary = None
+    for index, line in enumerate(lines):
+        if tokens + counts[index] > max_tokens and index > start:
+            cut = last_boundary if last_boundary and last_boundary > start else index
+            # Blank lines before the cut open the next chunk, where they become its separator
+            while cut > start + 1 and not lines[cut - 1].strip():
+                cut -= 1
+            chunk = make_chunk(lines, counts, start + 1, cut)
+            # A blank-only slice stays with the code that follows it
+            if chunk:
+                chunks.append(chunk)
+                start = cut
+                tokens = sum(counts[start:index])
+                last_boundary = None
+        if index > start and line[:1] not in ("", " ", "\t", ")", "]", "}"):
+            last_boundary = index
+        tokens += counts[index]
+
+    chunk = make_chunk(lines, counts, start + 1, len(lines))
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def split_code_into_chunks(code, max_tokens=DEFAULT_CHUNK_TOKENS):
+    """
+    Split code into chunks at top-level class and function boundaries to fit within the token limit.
+    Adjacent small definitions are packed together and oversized classes are split by method.
+    :param code: The original Python code as a string.
+    :param max_tokens: Estimated token budget per chunk.
+    :return: A list of Chunk objects, in file order.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return split_by_lines(code, max_tokens)
+
+    builder = ChunkBuilder(code, max_tokens)
+    if not tree.body:
+        builder.emit(1, len(builder.lines))
+        return builder.chunks
+
+    builder.pack(statement_spans(tree.body, 1, len(builder.lines)))
+    return builder.chunks
+
+
+def join_chunks(chunks, texts):
+    """
+    Reassemble refactored chunk texts into one file, with the blank lines around
+    every chunk restored.
+    :param chunks: The chunks the texts were produced from.
+    :param texts: Refactored text for each chunk, in the same order.
+    :return: The full refactored source, ending with a newline.
+    """
+    parts = []
+    for chunk, text in zip(chunks, texts):
+        # The first chunk has no line before it to end, only blank lines
+        parts.append(chunk.separator if parts else chunk.separator[1:])
+        parts.append(chunk.reindent(text.strip("\n")))
+        parts.append(chunk.trailer)
+    if not parts:
+        return ""
+    parts.insert(-1, "\n")
+    return "".join(parts)
+
+
+def iter_sections(readline, max_tokens=DEFAULT_SECTION_TOKENS):
+    """
+    Read source code lazily and yield it in sections cut at top-level statements.
+    Only the current section is held in memory, so a file of any size is read in
+    pieces about `max_tokens` large; a single top-level statement larger than that
+    becomes a section of its own. Comment and blank lines directly above a statement
+    go with it, and a definition is never cut from its decorators. The sections concatenate back to the input exactly, and each can be
+    chunked with `split_code_into_chunks` like a file of its own.
+    :param readline: Callable returning the next line of source, or "" at the end.
+    :param max_tokens: Estimated token budget per section.
+    """
+    lines = []
+    offset = 0  # Line number, 0-based, of lines[0] in the file
+
+    def recording_readline():
+        line = readline()
+        if line:
+            lines.append(line)
+        return line
+
+    tokens = 0
+    depth = 0
+    at_statement_start = True
+    decorated = False  # The statement just finished was a decorator, so its definition follows
+    try:
+        for token in tokenize.generate_tokens(recording_readline):
+            if token.type == tokenize.INDENT:
+                depth += 1
+            elif token.type == tokenize.DEDENT:
+                depth -= 1
+            elif token.type == tokenize.NEWLINE:
+                at_statement_start = True
+            elif token.type not in (tokenize.NL, tokenize.COMMENT, tokenize.ENDMARKER):
+                if at_statement_start and depth == 0 and tokens >= max_tokens and not decorated:
+                    cut = token.start[0] - 1 - offset
+                    while cut > 0 and (not lines[cut - 1].strip() or lines[cut - 1].startswith("#")):
+                        cut -= 1
+                    if cut > 0:
+                        yield "".join(lines[:cut])
+                        del lines[:cut]
+                        offset += cut
+                        tokens = 0
+                if at_statement_start and depth == 0:
+                    decorated = token.type == tokenize.OP and token.string == "@"
+                at_statement_start = False
+            tokens += token_cost(token)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        # Source the tokenizer cannot follow is passed on in sections of whole lines
+        tokens = sum(1 + len(line) // CHARS_PER_TEXT_TOKEN for line in lines)
+        for line in iter(readline, ""):
+            if tokens >= max_tokens:
+                yield "".join(lines)
+                lines.clear()
+                tokens = 0
+            lines.append(line)
+            tokens += 1 + len(line) // CHARS_PER_TEXT_TOKEN
+    if lines:
+        yield "".join(lines)
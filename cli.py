@@ -0,0 +1,307 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import asyncio
+import os
+import queue
+import sys
+import threading
+from config import (
+    RefactorConfig,
+    DEFAULT_MAX_CONCURRENT_FILES,
+    DEFAULT_MAX_CONCURRENT_REQUESTS,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    DEFAULT_TOKENS_PER_MINUTE,
+    DEFAULT_INPUT_PRICE,
+    DEFAULT_OUTPUT_PRICE,
+    DEFAULT_LARGE_FILE_BYTES,
+)
+from cache import ResponseCache, DEFAULT_CACHE_PATH
+from transport import DEFAULT_BASE_URL, DEFAULT_REQUEST_TIMEOUT
+from validation import DEFAULT_VALIDATION_RETRIES
+from boilerplate import DEFAULT_LICENSE_PATTERNS
+from triage import DEFAULT_MIN_LINES, DEFAULT_CLEAN_COMPLEXITY, DEFAULT_CLEAN_LINES
+from progress import ProgressChannel, ProgressTracker
+from utils import load_api_key, log_queue, add_log_sink, remove_log_sink, JSONLogSink, LOG_LEVELS
+
+API_KEY_FILE = "api_key.txt"
+
+
+def parse_args(argv=None):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        prog="python -m cli",
+        description="Refactor Python files with GPT, without the GUI.",
+    )
+    parser.add_argument("input", nargs="?", help="Python file or directory to refactor")
+    parser.add_argument("output", nargs="?", help="Output directory, or output file with --mode file")
+    parser.add_argument("--api-key", help=f"OpenAI API key (default: $OPENAI_API_KEY, then {API_KEY_FILE})")
+    parser.add_argument("--mode", choices=["folder", "file"], default="folder", help="Write a mirrored folder or one bundled file")
+    parser.add_argument("--ignore", action="append", default=[], metavar="PATH_OR_PATTERN", help="Ignored path or gitignore-style pattern; may be repeated")
+    parser.add_argument("--create-output", action="store_true", help="Create the output folder if it does not exist")
+    parser.add_argument("--files", type=int, default=DEFAULT_MAX_CONCURRENT_FILES, help="Files refactored at the same time")
+    parser.add_argument("--requests", type=int, default=DEFAULT_MAX_CONCURRENT_REQUESTS, help="API requests in flight")
+    parser.add_argument("--rpm", type=int, default=DEFAULT_REQUESTS_PER_MINUTE, help="Requests per minute quota")
+    parser.add_argument("--tpm", type=int, default=DEFAULT_TOKENS_PER_MINUTE, help="Tokens per minute quota")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the response cache")
+    parser.add_argument("--clear-cache", action="store_true", help="Clear the response cache before running")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH, help="Response cache database")
+    parser.add_argument("--backend", choices=["openai", "mock"], default="openai", help="'mock' echoes code back without network calls")
+    parser.add_argument("--base-url", default=os.environ.get("OPENAI_BASE_URL", DEFAULT_BASE_URL), help="OpenAI-compatible API base URL (default: $OPENAI_BASE_URL or the OpenAI API)")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_REQUEST_TIMEOUT, help="Per-request timeout in seconds")
+    parser.add_argument("--no-stream", action="store_true", help="Wait for whole responses instead of streaming them")
+    parser.add_argument("--no-validate", action="store_true", help="Accept responses without checking that they compile and keep their definitions")
+    parser.add_argument("--validation-retries", type=int, default=DEFAULT_VALIDATION_RETRIES, help="Re-requests for a chunk whose response fails validation")
+    parser.add_argument("--no-boilerplate", action="store_true", help="Send license headers and '# refactor: off' blocks to the model too")
+    parser.add_argument("--license-pattern", action="append", default=[], metavar="REGEX", help="Extra pattern that marks a leading comment or docstring as a license header; may be repeated")
+    parser.add_argument("--no-triage", action="store_true", help="Send every file to the model, including generated, tiny and already clean ones")
+    parser.add_argument("--triage-min-lines", type=int, default=DEFAULT_MIN_LINES, help="Files with fewer lines of code are copied through")
+    parser.add_argument("--triage-clean-complexity", type=int, default=DEFAULT_CLEAN_COMPLEXITY, help="Highest function complexity of a file considered clean already")
+    parser.add_argument("--triage-clean-lines", type=int, default=DEFAULT_CLEAN_LINES, help="Most lines of code of a file considered clean already")
+    parser.add_argument("--dry-run", action="store_true", help="Estimate tokens, API calls, cost and wall time at --requests concurrency, without calling the API")
+    parser.add_argument("--input-price", type=float, default=DEFAULT_INPUT_PRICE, help="USD per million input tokens, for --dry-run")
+    parser.add_argument("--output-price", type=float, default=DEFAULT_OUTPUT_PRICE, help="USD per million output tokens, for --dry-run")
+    parser.add_argument("--queue", metavar="PATH", help="Shard the run over a SQLite work queue at PATH that workers claim files from")
+    parser.add_argument("--workers", type=int, default=0, help="Local worker processes to start for --queue")
+    parser.add_argument("--worker", metavar="QUEUE", help="Work on the files of a --queue run; settings come from the queue, input and output may point to this machine's mount")
+    parser.add_argument("--worker-id", help="Stable name of this worker (default: host name and process id)")
+    parser.add_argument("--large-file-bytes", type=int, default=DEFAULT_LARGE_FILE_BYTES, help="Stream files of at least this size through the pipeline instead of reading them whole; 0 never streams")
+    parser.add_argument("--full", action="store_true", help="Refactor every file, even if its output is current")
+    parser.add_argument("--restart", action="store_true", help="Ignore the journal of an interrupted run and start over")
+    parser.add_argument("--no-metrics", action="store_true", help="Do not write the metrics reports next to the output")
+    parser.add_argument("--quiet", action="store_true", help="Only print the final summary")
+    parser.add_argument("--log-file", help="Also append structured JSON-lines log records to this file")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="DEBUG", help="Lowest level written to --log-file")
+    args = parser.parse_args(argv)
+    if not args.worker and not (args.input and args.output):
+        parser.error("the input and output arguments are required")
+    return parser, args
+
+
+def build_config(args):
+    """Turn parsed arguments into a RefactorConfig"""
+    return RefactorConfig(
+        input_path=args.input,
+        output_path=args.output,
+        api_key=args.api_key or os.environ.get("OPENAI_API_KEY") or load_api_key(API_KEY_FILE),
+        output_mode=args.mode,
+        ignored=args.ignore,
+        create_output_folder=args.create_output,
+        max_concurrent_files=args.files,
+        max_concurrent_requests=args.requests,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        use_cache=not args.no_cache,
+        cache_path=args.cache_path,
+        skip_unchanged=not args.full,
+        backend=args.backend,
+        base_url=args.base_url,
+        request_timeout=args.timeout,
+        stream=not args.no_stream,
+        write_metrics=not args.no_metrics,
+        resume=not args.restart,
+        validate_responses=not args.no_validate,
+        validation_retries=args.validation_retries,
+        strip_boilerplate=not args.no_boilerplate,
+        license_patterns=DEFAULT_LICENSE_PATTERNS + args.license_pattern,
+        triage=not args.no_triage,
+        triage_min_lines=args.triage_min_lines,
+        triage_clean_complexity=args.triage_clean_complexity,
+        triage_clean_lines=args.triage_clean_lines,
+        large_file_bytes=args.large_file_bytes,
+    )
+
+
+class LogPrinter(threading.Thread):
+    """Prints queued log messages to stderr while a run is in progress."""
+
+    def __init__(self, quiet=False):
+        super().__init__(daemon=True)
+        self.quiet = quiet
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not (self.stopping.is_set() and log_queue.empty()):
+            try:
+                message = log_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if not self.quiet:
+                print(message, file=sys.stderr, flush=True)
+
+    def stop(self):
+        """Print what is left in the queue and stop."""
+        self.stopping.set()
+        self.join()
+
+
+class ProgressPrinter(threading.Thread):
+    """Reads progress events and prints a status line whenever the overall percentage moves."""
+
+    def __init__(self, channel, interval=0.5):
+        super().__init__(daemon=True)
+        self.channel = channel
+        self.interval = interval
+        self.tracker = ProgressTracker()
+        self.stopping = threading.Event()
+        self.last_percent = -1
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.print_status()
+        self.print_status()
+
+    def print_status(self):
+        events = self.channel.drain()
+        if not events:
+            return
+        self.tracker.apply(events)
+        if self.tracker.overall_percent != self.last_percent:
+            self.last_percent = self.tracker.overall_percent
+            print(f"[{self.last_percent:3d}%] {self.tracker.status_text()}", file=sys.stderr, flush=True)
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+def run_until_stopped(handler):
+    """
+    Run a handler in a worker thread and turn the first Ctrl+C into handler.stop(),
+    so in-flight requests are cancelled cleanly and the journal allows a resume.
+    A second Ctrl+C aborts immediately.
+    """
+    outcome = queue.Queue()
+
+    def run():
+        try:
+            outcome.put((asyncio.run(handler.run_refactoring()), None))
+        except BaseException as e:
+            outcome.put((None, e))
+
+    # A daemon thread, so that a second Ctrl+C does not wait for it at exit
+    threading.Thread(target=run, daemon=True).start()
+    stopping = False
+    while True:
+        try:
+            result, error = outcome.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        except KeyboardInterrupt:
+            if stopping:
+                raise
+            stopping = True
+            print("Stopping... (press Ctrl+C again to abort)", file=sys.stderr, flush=True)
+            handler.stop()
+            continue
+        if error is not None:
+            raise error
+        return result
+
+
+def print_plan(config, args):
+    """Print the dry-run estimate for a configuration"""
+    from planner import plan_run
+
+    plan = plan_run(config, input_price=args.input_price, output_price=args.output_price)
+    for line in plan.summary_lines():
+        print(line)
+    return 0
+
+
+def create_handler(parser, args, config, channel):
+    """The RefactorHandler, QueueWorker or Coordinator the arguments ask for"""
+    # Imported here so that --help and argument errors stay instant
+    from refactor import RefactorHandler
+
+    if args.worker:
+        from workqueue import WorkQueue
+        from coordinator import QueueWorker, load_worker_config
+
+        work_queue = WorkQueue(args.worker)
+        api_key = args.api_key or os.environ.get("OPENAI_API_KEY") or load_api_key(API_KEY_FILE)
+        try:
+            config = load_worker_config(work_queue, api_key, args.input, args.output)
+        except ValueError as e:
+            parser.error(str(e))
+        return QueueWorker(config, work_queue, args.worker_id, progress=channel)
+    if args.queue:
+        from coordinator import Coordinator
+        worker_options = ["--quiet"] if args.quiet else []
+        if args.log_file:
+            worker_options += ["--log-file", args.log_file, "--log-level", args.log_level]
+        return Coordinator(config, args.queue, args.workers, progress=channel, worker_options=worker_options)
+    return RefactorHandler(config, progress=channel)
+
+
+def main(argv=None):
+    """Command line entry point; returns the process exit code"""
+    parser, args = parse_args(argv)
+    config = build_config(args) if not args.worker else None
+    try:
+        if config:
+            config.validate()
+        if args.queue and args.mode != "folder":
+            raise ValueError("Sharded runs need folder output.")
+        if args.workers < 0:
+            raise ValueError("Workers cannot be negative.")
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.dry_run and config:
+        return print_plan(config, args)
+
+    if args.clear_cache and config:
+        cache = ResponseCache(config.cache_path)
+        try:
+            cache.clear_sync()
+        finally:
+            cache.close()
+
+    log_sink = add_log_sink(JSONLogSink(args.log_file, args.log_level)) if args.log_file else None
+    channel = ProgressChannel()
+    handler = create_handler(parser, args, config, channel)
+    printers = [LogPrinter(quiet=args.quiet)]
+    # A worker only sees the files it claims, so it has no overall progress to show
+    if not args.quiet and not args.worker:
+        printers.append(ProgressPrinter(channel))
+    for printer in printers:
+        printer.start()
+    try:
+        result = run_until_stopped(handler)
+    finally:
+        for printer in printers:
+            printer.stop()
+        if log_sink:
+            remove_log_sink(log_sink)
+
+    print(result.summary())
+    if result.cancelled:
+        return 130
+    return 1 if result.files_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
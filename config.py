@@ -0,0 +1,130 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from dataclasses import dataclass, field
+from cache import DEFAULT_CACHE_PATH
+from transport import DEFAULT_BASE_URL, DEFAULT_REQUEST_TIMEOUT
+from validation import DEFAULT_VALIDATION_RETRIES
+from boilerplate import DEFAULT_LICENSE_PATTERNS, DEFAULT_INVARIANT_MARKERS
+from triage import DEFAULT_MIN_LINES, DEFAULT_CLEAN_COMPLEXITY, DEFAULT_CLEAN_LINES
+
+# Default number of files refactored at the same time
+DEFAULT_MAX_CONCURRENT_FILES = 8
+
+# Default number of API requests in flight across all files
+DEFAULT_MAX_CONCURRENT_REQUESTS = 16
+
+# Default account quota, adjust to your OpenAI usage tier
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 200000
+
+# Files at least this large are streamed through the pipeline instead of read whole
+DEFAULT_LARGE_FILE_BYTES = 1024 * 1024
+
+# gpt-4o-mini list prices in USD per million tokens, for dry-run estimates
+DEFAULT_INPUT_PRICE = 0.15
+DEFAULT_OUTPUT_PRICE = 0.60
+
+
+@dataclass
+class RefactorConfig:
+    """Everything a refactoring run needs, independent of the GUI."""
+
+    input_path: str
+    output_path: str
+    api_key: str = ""
+    output_mode: str = "folder"  # Either 'folder' or 'file'
+    ignored: list = field(default_factory=list)
+    create_output_folder: bool = False
+    max_concurrent_files: int = DEFAULT_MAX_CONCURRENT_FILES
+    max_concurrent_requests: int = DEFAULT_MAX_CONCURRENT_REQUESTS
+    requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE
+    tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE
+    use_cache: bool = True
+    cache_path: str = DEFAULT_CACHE_PATH
+    skip_unchanged: bool = True
+    backend: str = "openai"  # 'openai' for any OpenAI-compatible server, 'mock' for the in-process fake
+    base_url: str = DEFAULT_BASE_URL
+    request_timeout: float = DEFAULT_REQUEST_TIMEOUT
+    stream: bool = True
+    write_metrics: bool = True  # JSON and Prometheus reports next to the output
+    resume: bool = True  # Reuse work from an interrupted run's journal
+    validate_responses: bool = True  # Check every response compiles and keeps its definitions
+    validation_retries: int = DEFAULT_VALIDATION_RETRIES
+    strip_boilerplate: bool = True  # Keep license headers and marked blocks out of the prompt
+    license_patterns: list = field(default_factory=lambda: list(DEFAULT_LICENSE_PATTERNS))
+    invariant_markers: list = field(default_factory=lambda: list(DEFAULT_INVARIANT_MARKERS))
+    triage: bool = True  # Copy generated, tiny and already clean files through without an API call
+    triage_min_lines: int = DEFAULT_MIN_LINES
+    triage_clean_complexity: int = DEFAULT_CLEAN_COMPLEXITY
+    triage_clean_lines: int = DEFAULT_CLEAN_LINES
+    large_file_bytes: int = DEFAULT_LARGE_FILE_BYTES  # 0 reads every file whole
+
+    def validate(self):
+        """
+        Check the settings before a run starts.
+        :raises ValueError: With a message suitable for the user.
+        """
+        if not self.input_path or not self.output_path:
+            raise ValueError("Both an input and an output path are required.")
+        if self.output_mode not in ("folder", "file"):
+            raise ValueError(f"Unknown output mode: {self.output_mode}")
+        if self.backend not in ("openai", "mock"):
+            raise ValueError(f"Unknown backend: {self.backend}")
+        if self.validation_retries < 0:
+            raise ValueError("Validation retries cannot be negative.")
+        if self.triage_min_lines < 0 or self.triage_clean_complexity < 0 or self.triage_clean_lines < 0:
+            raise ValueError("Triage thresholds cannot be negative.")
+        if self.large_file_bytes < 0:
+            raise ValueError("Large file size cannot be negative.")
+        if self.request_timeout <= 0:
+            raise ValueError("Request timeout must be positive.")
+        for name in ("max_concurrent_files", "max_concurrent_requests", "requests_per_minute", "tokens_per_minute"):
+            if getattr(self, name) < 1:
+                raise ValueError(f"{name.replace('_', ' ').capitalize()} must be at least 1.")
+
+
+@dataclass
+class RefactorResult:
+    """Summary of a finished run."""
+
+    files_total: int = 0
+    files_processed: int = 0
+    files_skipped: int = 0
+    files_failed: int = 0
+    files_triaged: int = 0
+    chunks: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    elapsed: float = 0.0
+    cancelled: bool = False
+
+    def summary(self):
+        """One-line report for logs and the command line."""
+        return (
+            f"{self.files_processed}/{self.files_total} files refactored, "
+            f"{self.files_skipped} unchanged, {self.files_triaged} copied through, {self.files_failed} failed, "
+            f"{self.chunks} chunks, {self.cache_hits} cache hits in {self.elapsed:.1f}s"
+            + (" (stopped)" if self.cancelled else "")
+        )
@@ -0,0 +1,300 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import dataclasses
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from config import RefactorConfig, RefactorResult
+from indexer import IndexedFile, index_python_files
+from manifest import RunManifest, make_entry, manifest_path_for
+from progress import ProgressChannel, RUN_STARTED, FILE_DONE
+from refactor import RefactorHandler, get_output_version
+from utils import log
+from workqueue import (
+    WorkQueue, SharedRateLimiter, DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS, DEFAULT_CLAIM_BATCH,
+    PENDING, LEASED, DONE, COPIED, FAILED,
+)
+
+# Seconds between queue polls, for idle workers and for the coordinator's progress
+POLL_SECONDS = 1.0
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class QueueWorker(RefactorHandler):
+    """
+    A RefactorHandler that takes its files from a shared WorkQueue instead of indexing.
+    Files are claimed in small batches as the local workers need them and
+    acknowledged once their output is on disk; a heartbeat keeps the leases alive.
+    The journal and metrics reports are kept per worker, next to the queue.
+    """
+
+    def __init__(self, config, work_queue, worker_id=None, progress=None, backend=None,
+                 lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS, claim_batch=DEFAULT_CLAIM_BATCH):
+        super().__init__(config, progress, backend)
+        self.work_queue = work_queue
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.claim_batch = claim_batch
+
+    async def run_refactoring(self):
+        heartbeat = asyncio.create_task(self.heartbeat())
+        try:
+            return await super().run_refactoring()
+        finally:
+            heartbeat.cancel()
+            # Files claimed but not finished go straight back to the other workers
+            await asyncio.to_thread(self.work_queue.release, self.worker_id)
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await asyncio.to_thread(self.work_queue.renew, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                log(f"Cannot renew leases: {e}", "WARNING")
+
+    def state_path(self):
+        return f"{self.work_queue.path}.{self.worker_id}"
+
+    def create_rate_limiter(self):
+        return SharedRateLimiter(
+            self.work_queue,
+            requests_per_minute=self.config.requests_per_minute,
+            tokens_per_minute=self.config.tokens_per_minute,
+            max_concurrent_requests=self.config.max_concurrent_requests,
+        )
+
+    async def index_files(self, input_path):
+        # The coordinator indexed the tree; files arrive through the queue
+        return []
+
+    async def feed_files(self, file_queue, indexed_files):
+        """Claim files until the queue has nothing left that this worker could take."""
+        input_path = Path(self.config.input_path)
+        # One process pool triages every batch this worker claims
+        triage = self.create_triage().open() if self.config.triage else None
+        try:
+            while self.is_running:
+                claimed = await asyncio.to_thread(
+                    self.work_queue.claim, self.worker_id, self.claim_batch, self.lease_seconds, self.max_attempts
+                )
+                if not claimed:
+                    # Files leased by this worker are already on the local queue
+                    if not await asyncio.to_thread(self.work_queue.has_work, self.worker_id):
+                        return
+                    # Leases held by others may still expire and come back
+                    await asyncio.sleep(POLL_SECONDS)
+                    continue
+
+                claimed_files = []
+                for key, _, size in claimed:
+                    path = input_path / key
+                    claimed_files.append(IndexedFile(path, key, str(path.parent), size))
+                self.result.files_total += len(claimed_files)
+                log(f"Claimed {len(claimed_files)} files")
+                if triage:
+                    self.triaged.update(await self.triage_files(claimed_files, triage))
+                for indexed_file in claimed_files:
+                    await file_queue.put(indexed_file)
+        finally:
+            if triage:
+                triage.close(wait=False)
+
+    async def process_file(self, indexed_file):
+        succeeded = await super().process_file(indexed_file)
+        if not succeeded:
+            await asyncio.to_thread(self.work_queue.ack, indexed_file.relative_path, self.worker_id, FAILED)
+        return succeeded
+
+    def record_written_file(self, key, file_path):
+        # Recorded as the output is written, as a single-process run does; the coordinator saves the manifest
+        entry = make_entry(file_path, self.get_output_path(key), get_output_version())
+        self.journal.record_file(key, entry)
+        self.work_queue.ack(key, self.worker_id, DONE, entry)
+
+    def record_copied_file(self, key):
+        super().record_copied_file(key)
+        # Kept apart from refactored files, so the coordinator never records a copy in the manifest
+        self.work_queue.ack(key, self.worker_id, COPIED)
+
+
+def load_worker_config(work_queue, api_key="", input_path=None, output_path=None):
+    """
+    The RefactorConfig a coordinator stored in the queue.
+    :param input_path: Where this machine sees the input tree, if not where the coordinator does.
+    :param output_path: Likewise for the output folder.
+    """
+    settings = work_queue.settings()
+    if settings is None:
+        raise ValueError(f"Work queue {work_queue.path} is empty; start a coordinator first.")
+    fields = {field.name for field in dataclasses.fields(RefactorConfig)}
+    config = RefactorConfig(**{name: value for name, value in settings.items() if name in fields})
+    config.api_key = api_key
+    config.input_path = input_path or config.input_path
+    config.output_path = output_path or config.output_path
+    # The coordinator already skipped unchanged files and owns the manifest
+    config.skip_unchanged = False
+    config.create_output_folder = True
+    return config
+
+
+class Coordinator:
+    """
+    Fills a WorkQueue from the input tree, optionally starts local worker processes,
+    and follows the queue until every file is finished.
+    More workers, on this machine or others sharing the queue's filesystem, can join
+    at any time with `python -m cli --worker QUEUE`. Offers the same run_refactoring
+    and stop interface as RefactorHandler.
+    """
+
+    def __init__(self, config, queue_path, workers=0, progress=None, worker_options=()):
+        """
+        :param workers: Local worker processes to start.
+        :param worker_options: Extra command line options for the local workers, such as --quiet.
+        """
+        self.config = config
+        self.work_queue = WorkQueue(queue_path)
+        self.workers = workers
+        self.worker_options = list(worker_options)
+        self.progress = progress or ProgressChannel()
+        self.processes = []
+        self.is_running = True
+        self.result = RefactorResult()
+
+    def stop(self):
+        """Stop from any thread: local workers finish what they are writing and release their leases."""
+        self.is_running = False
+        for process in self.processes:
+            if process.poll() is None:
+                if os.name == "posix":
+                    process.send_signal(signal.SIGINT)
+                else:
+                    process.terminate()
+
+    async def run_refactoring(self):
+        started = time.monotonic()
+        self.result = RefactorResult()
+        input_path = Path(self.config.input_path)
+        if not input_path.is_dir() or self.config.output_mode != "folder":
+            raise ValueError("Sharded runs need an input folder and folder output.")
+        if self.config.create_output_folder:
+            Path(self.config.output_path).mkdir(parents=True, exist_ok=True)
+
+        indexed_files = await asyncio.to_thread(index_python_files, input_path, self.config.ignored)
+        self.result.files_total = len(indexed_files)
+        manifest = None
+        if self.config.skip_unchanged:
+            manifest = RunManifest(manifest_path_for(self.config.output_path), get_output_version()).load()
+            output_path = Path(self.config.output_path)
+            current = await asyncio.to_thread(lambda: {
+                indexed_file.relative_path for indexed_file in indexed_files
+                if manifest.is_current(indexed_file.relative_path, indexed_file.path, output_path / indexed_file.relative_path)
+            })
+            self.result.files_skipped = len(current)
+            indexed_files = [indexed_file for indexed_file in indexed_files if indexed_file.relative_path not in current]
+
+        settings = dataclasses.asdict(self.config)
+        settings["api_key"] = ""  # Workers bring their own key
+        settings["input_path"] = str(input_path.resolve())
+        settings["output_path"] = str(Path(self.config.output_path).resolve())
+        resumed = await asyncio.to_thread(
+            self.work_queue.populate,
+            settings,
+            [(indexed_file.relative_path, indexed_file.path, indexed_file.size) for indexed_file in indexed_files],
+            self.config.resume,
+        )
+        if any(resumed.values()):
+            log(f"Resuming: {sum(resumed.values())} files were finished by an earlier run of this queue.")
+        log(f"Queued {len(indexed_files)} files in {self.work_queue.path}")
+        self.progress.post(RUN_STARTED, files=len(indexed_files), bytes=sum(indexed_file.size for indexed_file in indexed_files))
+
+        try:
+            self.start_workers()
+            await self.follow_queue()
+        finally:
+            await asyncio.to_thread(self.wait_for_workers)
+            counts = await asyncio.to_thread(self.work_queue.counts)
+            self.result.files_processed = counts[DONE][0] - resumed[DONE]
+            self.result.files_triaged = counts[COPIED][0] - resumed[COPIED]
+            self.result.files_failed = counts[FAILED][0]
+            self.result.cancelled = not self.is_running
+            if manifest:
+                await asyncio.to_thread(self.record_manifest, manifest)
+            self.work_queue.close()
+            self.result.elapsed = time.monotonic() - started
+
+        log(self.result.summary())
+        return self.result
+
+    def start_workers(self):
+        """Start the local worker processes, each in its own session so Ctrl+C reaches them only through stop()."""
+        environment = dict(os.environ)
+        if self.config.api_key:
+            environment["OPENAI_API_KEY"] = self.config.api_key
+        command = [sys.executable, str(Path(__file__).with_name("cli.py")), "--worker", self.work_queue.path] + self.worker_options
+        for index in range(self.workers):
+            worker_id = f"{socket.gethostname()}-{index}"
+            self.processes.append(subprocess.Popen(
+                command + ["--worker-id", worker_id], env=environment, start_new_session=os.name == "posix",
+            ))
+        if self.workers:
+            log(f"Started {self.workers} worker processes")
+
+    async def follow_queue(self):
+        """Turn queue counts into progress events until the queue is finished or the run stops."""
+        finished = finished_bytes = 0
+        while True:
+            counts = await asyncio.to_thread(self.work_queue.counts)
+            files = counts[DONE][0] + counts[COPIED][0] + counts[FAILED][0]
+            size = counts[DONE][1] + counts[COPIED][1] + counts[FAILED][1]
+            if files > finished:
+                self.progress.post(FILE_DONE, files=files - finished, bytes=size - finished_bytes)
+                finished, finished_bytes = files, size
+            if not counts[PENDING][0] and not counts[LEASED][0]:
+                return
+            if not self.is_running:
+                return
+            if self.processes and all(process.poll() is not None for process in self.processes):
+                log("Every local worker exited before the queue was finished", "ERROR")
+                return
+            await asyncio.sleep(POLL_SECONDS)
+
+    def wait_for_workers(self):
+        for process in self.processes:
+            process.wait()
+
+    def record_manifest(self, manifest):
+        """Record the files refactored in this run, so the next run skips them; copied files are left out."""
+        manifest.merge(self.work_queue.manifest_entries())
+        manifest.save()
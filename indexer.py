@@ -0,0 +1,159 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import fnmatch
+import os
+import re
+from pathlib import Path
+from utils import log
+
+# Version-control and cache folders never contain sources worth refactoring
+DEFAULT_IGNORE_PATTERNS = [".git/", ".hg/", ".svn/", "__pycache__/"]
+
+
+class IndexedFile:
+    """A Python file found by the indexer."""
+
+    def __init__(self, path, relative_path, folder, size):
+        self.path = path
+        self.relative_path = relative_path
+        self.folder = folder
+        self.size = size
+
+    def __repr__(self):
+        return f"IndexedFile({self.relative_path}, {self.size} bytes)"
+
+
+class IgnoreRules:
+    """
+    Compiled ignore entries from the GUI or command line.
+    Absolute entries, and relative entries that exist under the input root, are
+    treated as paths; relative ones are always taken from the root, never from the
+    current directory, so the same list works wherever the tool is started. Everything
+    else is a gitignore-style glob: a pattern without a slash matches a name at any
+    depth, a pattern with a slash matches the path relative to the input root, and
+    a trailing slash restricts the pattern to directories.
+    """
+
+    def __init__(self, entries, root="."):
+        """
+        :param entries: Ignored paths or patterns.
+        :param root: The resolved input root, which relative paths are taken from.
+        """
+        self.paths = set()
+        name_patterns = {False: [], True: []}
+        relative_patterns = {False: [], True: []}
+
+        for entry in list(entries) + DEFAULT_IGNORE_PATTERNS:
+            entry = entry.strip()
+            if not entry:
+                continue
+            is_glob = any(char in entry for char in "*?[")
+            if not is_glob:
+                if os.path.isabs(entry):
+                    self.paths.add(str(Path(entry).resolve()))
+                    continue
+                # Joined without resolving, to match the walk's own paths under the root
+                path = os.path.normpath(os.path.join(root, entry))
+                if os.path.lexists(path):
+                    self.paths.add(path)
+                    continue
+
+            dirs_only = entry.endswith("/")
+            entry = entry.strip("/")
+            if "/" in entry:
+                relative_patterns[dirs_only].append(fnmatch.translate(entry))
+            else:
+                name_patterns[dirs_only].append(fnmatch.translate(entry))
+
+        # One alternation per kind, so each entry costs a single regex match
+        # whatever the number of patterns
+        self.name_any = self.compile(name_patterns[False])
+        self.name_dirs = self.compile(name_patterns[True])
+        self.relative_any = self.compile(relative_patterns[False])
+        self.relative_dirs = self.compile(relative_patterns[True])
+
+    @staticmethod
+    def compile(patterns):
+        return re.compile("|".join(patterns)) if patterns else None
+
+    def is_ignored(self, path, name, relative_path, is_dir):
+        """Check one directory entry against the rules."""
+        if path in self.paths:
+            return True
+        for regex, dirs_only, subject in (
+            (self.name_any, False, name),
+            (self.name_dirs, True, name),
+            (self.relative_any, False, relative_path),
+            (self.relative_dirs, True, relative_path),
+        ):
+            if regex is not None and (is_dir or not dirs_only) and regex.match(subject):
+                return True
+        return False
+
+
+def index_python_files(directory, ignored=()):
+    """
+    Walk a directory tree once and list the Python files to refactor.
+    Ignored directories are pruned as soon as they are seen, so their subtrees are
+    never read. Paths are resolved once for the root only.
+    :param directory: Root directory to index.
+    :param ignored: Ignored paths or gitignore-style patterns.
+    :return: A list of IndexedFile objects, in walk order.
+    """
+    root = str(Path(directory).resolve())
+    rules = IgnoreRules(ignored, root)
+    files = []
+    pending = [(root, "")]
+
+    while pending:
+        folder, relative_folder = pending.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except OSError as e:
+            log(f"Cannot read folder {folder}: {e}", "WARNING")
+            continue
+
+        subfolders = []
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            relative_path = f"{relative_folder}/{entry.name}" if relative_folder else entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if not is_dir and not entry.name.endswith('.py'):
+                    continue
+                if rules.is_ignored(entry.path, entry.name, relative_path, is_dir):
+                    if is_dir:
+                        log(f"Skipping ignored folder: {entry.path}")
+                    continue
+                if is_dir:
+                    subfolders.append((entry.path, relative_path))
+                elif entry.is_file():
+                    files.append(IndexedFile(Path(entry.path), relative_path, folder, entry.stat().st_size))
+            except OSError as e:
+                log(f"Cannot read {entry.path}: {e}", "WARNING")
+
+        # Reversed so the stack visits subfolders in name order
+        pending.extend(reversed(subfolders))
+
+    return files
@@ -0,0 +1,139 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from utils import log
+
+
+def journal_path_for(output_path):
+    """The journal lives next to the output, like the manifest."""
+    output_path = Path(output_path).resolve()
+    return output_path.with_name(output_path.name + ".refactor-journal.jsonl")
+
+
+class RunJournal:
+    """
+    Append-only record of finished work, so a stopped or crashed run can resume.
+    The first line names the output version; each later line is a finished chunk
+    (its cache key and refactored text) or a finished file (its key and manifest
+    entry, if any). Lines are flushed as they are written, so at most the line
+    being written when the process died is lost, and a torn last line is ignored.
+    A journal written for another output version is discarded.
+    """
+
+    def __init__(self, path, version):
+        self.path = Path(path)
+        self.version = version
+        self.chunks = {}
+        self.files = {}
+        self.valid_bytes = 0
+        self.file = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Read what an earlier, unfinished run completed."""
+        self.chunks = {}
+        self.files = {}
+        self.valid_bytes = 0
+        try:
+            with open(self.path, 'rb') as f:
+                lines = f.read().splitlines(keepends=True)
+        except FileNotFoundError:
+            return self
+        except OSError as e:
+            log(f"Ignoring unreadable journal {self.path}: {e}", "WARNING")
+            return self
+
+        records = []
+        valid_bytes = 0
+        for line in lines:
+            if not line.endswith(b"\n"):
+                break  # Torn write at the moment of the crash
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+            valid_bytes += len(line)
+        if not records or records[0].get("type") != "run" or records[0].get("version") != self.version:
+            return self
+
+        for record in records[1:]:
+            if record.get("type") == "chunk":
+                self.chunks[record["key"]] = record["text"]
+            elif record.get("type") == "file":
+                self.files[record["file"]] = record.get("entry")
+        self.valid_bytes = valid_bytes
+        return self
+
+    def open(self):
+        """
+        Start appending; a journal with nothing to resume is started afresh.
+        A resumed journal is first cut back to its last complete line, so new
+        records are not appended onto a torn one.
+        """
+        if self.chunks or self.files:
+            os.truncate(self.path, self.valid_bytes)
+            self.file = open(self.path, 'a', encoding='utf-8')
+        else:
+            self.file = open(self.path, 'w', encoding='utf-8')
+            self.append({"type": "run", "version": self.version})
+        return self
+
+    def append(self, record):
+        with self.lock:
+            if self.file is None or self.file.closed:
+                return
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+
+    def get_chunk(self, key):
+        """Refactored text of a chunk finished by an earlier run, or None."""
+        return self.chunks.get(key)
+
+    def record_chunk(self, key, text):
+        """Append a finished chunk; only chunks loaded from an earlier run are kept in memory."""
+        self.append({"type": "chunk", "key": key, "text": text})
+
+    def record_file(self, file_key, entry=None):
+        """
+        Mark a file as written.
+        :param file_key: The file's output key.
+        :param entry: Its manifest entry, so a resumed run can skip it even if the manifest was never saved.
+        """
+        self.files[file_key] = entry
+        self.append({"type": "file", "file": file_key, "entry": entry})
+
+    def close(self, completed=False):
+        """Stop appending; a completed run has nothing to resume, so its journal is removed."""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+        if completed:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
@@ -28,14 +28,47 @@ from tkinter.ttk import Progressbar, Style
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 from refactor import RefactorHandler
-from utils import save_api_key, load_api_key, log_queue
-import os
-import queue
+from config import (
+    RefactorConfig,
+    DEFAULT_MAX_CONCURRENT_FILES,
+    DEFAULT_MAX_CONCURRENT_REQUESTS,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    DEFAULT_TOKENS_PER_MINUTE,
+)
+from utils import (
+    save_api_key,
+    load_api_key,
+    log,
+    drain_log_queue,
+    add_log_sink,
+    remove_log_sink,
+    JSONLogSink,
+    DEFAULT_LOG_FILE,
+)
+from cache import ResponseCache, DEFAULT_CACHE_PATH
+from celebration import refactoring_completed_callback
+from progress import ProgressChannel, ProgressTracker
+
+# Lines kept in the log area; older lines are dropped as new ones arrive
+DEFAULT_LOG_LINES = 1000
+
+# Milliseconds between log area refreshes
+LOG_REFRESH_INTERVAL = 100
+
+# Progress bars and the status line are redrawn this many times per second at most
+PROGRESS_FRAME_RATE = 10
 
 class RefactorApp:
-    def __init__(self, root):
-        """Initialize the GUI and set up the layout"""
+    def __init__(self, root, max_log_lines=DEFAULT_LOG_LINES, log_file=DEFAULT_LOG_FILE):
+        """
+        Initialize the GUI and set up the layout
+        :param root: The Tk root window.
+        :param max_log_lines: Number of lines the log area keeps.
+        :param log_file: Structured log file written alongside the log area, or None.
+        """
         self.root = root
+        self.max_log_lines = max_log_lines
+        self.log_sink = add_log_sink(JSONLogSink(log_file)) if log_file else None
         self.root.title("Python Refactor Tool")
         self.api_key_file = "api_key.txt"
         self.api_key = tk.StringVar(value=load_api_key(self.api_key_file))
@@ -71,48 +104,86 @@ class RefactorApp:
         tk.Radiobutton(frame, text="Folder", variable=self.output_mode, value="folder", bg="#f0f0f5").grid(row=3, column=1)
         tk.Radiobutton(frame, text="Single File", variable=self.output_mode, value="file", bg="#f0f0f5").grid(row=3, column=2)
 
+        # Incremental mode: skip files whose output is already up to date
+        self.skip_unchanged = tk.BooleanVar(value=True)
+        tk.Checkbutton(frame, text="Skip Unchanged Files", variable=self.skip_unchanged, bg="#f0f0f5").grid(row=3, column=3, sticky=tk.W)
+
         # Checkbox to allow output folder creation
         self.create_output_folder = tk.BooleanVar(value=False)
         tk.Checkbutton(frame, text="Create Output Folder if it Doesn't Exist", variable=self.create_output_folder, bg="#f0f0f5").grid(row=4, column=0, columnspan=2, sticky=tk.W)
 
+        # Response cache toggle; unchecking it bypasses the cache for the next run
+        self.use_cache = tk.BooleanVar(value=True)
+        tk.Checkbutton(frame, text="Use Response Cache", variable=self.use_cache, bg="#f0f0f5").grid(row=4, column=2, sticky=tk.W)
+        tk.Button(frame, text="Clear Cache", command=self.clear_cache, bg="#87CEFA", fg="black", activebackground="#4682B4", bd=0, highlightthickness=0).grid(row=4, column=3, padx=5)
+
         # Ignored folders/files input
         self.ignored_folders = tk.StringVar()
-        self.create_label_entry(frame, "Ignored Folders/Files (comma-separated):", self.ignored_folders, row=5)
+        self.create_label_entry(frame, "Ignored Paths/Patterns (comma-separated):", self.ignored_folders, row=5)
         tk.Button(frame, text="Select Ignored Folders/Files", command=self.select_ignored_folders_files, bg="#87CEFA", fg="black", activebackground="#4682B4", bd=0, highlightthickness=0).grid(row=5, column=2, padx=5)
 
+        # Number of files refactored at the same time
+        self.max_concurrent_files = tk.IntVar(value=DEFAULT_MAX_CONCURRENT_FILES)
+        self.create_label_entry(frame, "Concurrent Files:", self.max_concurrent_files, row=6)
+        self.max_concurrent_requests = tk.IntVar(value=DEFAULT_MAX_CONCURRENT_REQUESTS)
+        tk.Label(frame, text="Concurrent Requests:", font=("Arial", 10), bg="#f0f0f5").grid(row=6, column=2, sticky=tk.W)
+        tk.Entry(frame, textvariable=self.max_concurrent_requests, width=6, bd=2, relief="flat").grid(row=6, column=3, pady=5)
+
+        # Account quota used by the rate limiter
+        self.requests_per_minute = tk.IntVar(value=DEFAULT_REQUESTS_PER_MINUTE)
+        self.create_label_entry(frame, "Requests per Minute:", self.requests_per_minute, row=7)
+        self.tokens_per_minute = tk.IntVar(value=DEFAULT_TOKENS_PER_MINUTE)
+        tk.Label(frame, text="Tokens per Minute:", font=("Arial", 10), bg="#f0f0f5").grid(row=7, column=2, sticky=tk.W)
+        tk.Entry(frame, textvariable=self.tokens_per_minute, width=10, bd=2, relief="flat").grid(row=7, column=3, pady=5)
+
+        # Work done before and after the API calls; the run's defaults are all on
+        self.triage = tk.BooleanVar(value=True)
+        tk.Checkbutton(frame, text="Copy Generated, Tiny and Clean Files Through", variable=self.triage, bg="#f0f0f5").grid(row=8, column=0, columnspan=2, sticky=tk.W)
+        self.strip_boilerplate = tk.BooleanVar(value=True)
+        tk.Checkbutton(frame, text="Leave License Headers and Marked Blocks Out of Prompts", variable=self.strip_boilerplate, bg="#f0f0f5").grid(row=8, column=2, sticky=tk.W)
+        self.validate_responses = tk.BooleanVar(value=True)
+        tk.Checkbutton(frame, text="Validate Responses", variable=self.validate_responses, bg="#f0f0f5").grid(row=8, column=3, sticky=tk.W)
+
         # Buttons for actions
         self.start_button = tk.Button(frame, text="Start Refactoring", command=self.start_refactoring, bg="#32CD32", fg="white", activebackground="#228B22", bd=0, highlightthickness=0)
-        self.start_button.grid(row=6, column=0, pady=10)
+        self.start_button.grid(row=9, column=0, pady=10)
 
         self.stop_button = tk.Button(frame, text="Stop Refactoring", command=self.stop_refactoring, bg="#FFA500", fg="white", activebackground="#FF8C00", bd=0, highlightthickness=0)
-        self.stop_button.grid(row=6, column=1, pady=10)
+        self.stop_button.grid(row=9, column=1, pady=10)
 
         self.quit_button = tk.Button(frame, text="Quit", command=self.on_closing, bg="#DC143C", fg="white", activebackground="#B22222", bd=0, highlightthickness=0)
-        self.quit_button.grid(row=6, column=2, pady=10)
+        self.quit_button.grid(row=9, column=2, pady=10)
 
         # Progress bars
-        tk.Label(frame, text="Overall Progress:", font=("Arial", 10), bg="#f0f0f5").grid(row=7, column=0, sticky=tk.W)
+        tk.Label(frame, text="Overall Progress:", font=("Arial", 10), bg="#f0f0f5").grid(row=10, column=0, sticky=tk.W)
         self.total_progress_var = tk.IntVar()
         self.total_progress_bar = Progressbar(frame, variable=self.total_progress_var, maximum=100, style="TProgressbar")
-        self.total_progress_bar.grid(row=7, column=1, columnspan=3, pady=5)
+        self.total_progress_bar.grid(row=10, column=1, columnspan=3, pady=5)
 
-        tk.Label(frame, text="Folder Progress:", font=("Arial", 10), bg="#f0f0f5").grid(row=8, column=0, sticky=tk.W)
+        tk.Label(frame, text="Folder Progress:", font=("Arial", 10), bg="#f0f0f5").grid(row=11, column=0, sticky=tk.W)
         self.folder_progress_var = tk.IntVar()
         self.folder_progress_bar = Progressbar(frame, variable=self.folder_progress_var, maximum=100, style="TProgressbar")
-        self.folder_progress_bar.grid(row=8, column=1, columnspan=3, pady=5)
+        self.folder_progress_bar.grid(row=11, column=1, columnspan=3, pady=5)
+
+        # Live throughput and ETA
+        self.status_var = tk.StringVar()
+        tk.Label(frame, textvariable=self.status_var, font=("Arial", 10), bg="#f0f0f5").grid(row=12, column=0, columnspan=4, sticky=tk.W)
 
         # Log area for displaying progress
         self.log_area = tk.Text(root, height=10, state=tk.DISABLED, wrap="word", font=("Arial", 10), bg="#E6E6FA", fg="black")
         self.log_area.pack(fill=tk.BOTH, expand=True, pady=10)
 
-        # Periodic log updates
+        # Periodic log and progress updates, both applied on the Tk thread
+        self.progress_channel = ProgressChannel()
+        self.progress_tracker = ProgressTracker()
         self.update_log_area()
+        self.update_progress()
 
         # Graceful shutdown on window close
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
-        # Initialize refactor handler and thread executor
-        self.refactor_handler = RefactorHandler(self)
+        # Refactor handler is created per run; the executor runs it off the Tk thread
+        self.refactor_handler = None
         self.executor = ThreadPoolExecutor(max_workers=1)
         self.refactoring_task = None
 
@@ -121,22 +192,28 @@ class RefactorApp:
         tk.Label(parent, text=label_text, font=("Arial", 10), bg="#f0f0f5").grid(row=row, column=0, sticky=tk.W)
         tk.Entry(parent, textvariable=variable, width=50, bd=2, relief="flat").grid(row=row, column=1, pady=5)
 
-    def log(self, message):
+    def log(self, message, level="INFO"):
         """Thread-safe logging function"""
-        log_queue.put(message)
+        log(message, level)
 
     def update_log_area(self):
-        """Periodically update the log area with queued log messages"""
-        try:
-            while not log_queue.empty():
-                message = log_queue.get_nowait()
-                self.log_area.config(state=tk.NORMAL)
-                self.log_area.insert(tk.END, message + "\n")
-                self.log_area.config(state=tk.DISABLED)
-                self.log_area.yview(tk.END)
-        except queue.Empty:
-            pass
-        self.root.after(100, self.update_log_area)
+        """
+        Periodically update the log area with queued log messages.
+        Everything queued since the last tick goes in with a single insert, and the
+        oldest lines are trimmed so the widget never holds more than `max_log_lines`.
+        """
+        messages = drain_log_queue()
+        if messages:
+            # Lines past the cap would be trimmed right away, so they are never inserted
+            messages = messages[-self.max_log_lines:]
+            self.log_area.config(state=tk.NORMAL)
+            self.log_area.insert(tk.END, "\n".join(messages) + "\n")
+            line_count = int(self.log_area.index("end-1c").split(".")[0]) - 1
+            if line_count > self.max_log_lines:
+                self.log_area.delete("1.0", f"{line_count - self.max_log_lines + 1}.0")
+            self.log_area.config(state=tk.DISABLED)
+            self.log_area.yview(tk.END)
+        self.root.after(LOG_REFRESH_INTERVAL, self.update_log_area)
 
     def select_input_directory(self):
         """Select an input directory"""
@@ -169,43 +246,110 @@ class RefactorApp:
         save_api_key(self.api_key.get(), self.api_key_file)
         messagebox.showinfo("Success", "API key saved successfully!")
 
+    def clear_cache(self):
+        """Remove every cached API response"""
+        cache = ResponseCache(DEFAULT_CACHE_PATH)
+        try:
+            cache.clear_sync()
+        finally:
+            cache.close()
+        messagebox.showinfo("Success", "Response cache cleared!")
+
     def start_refactoring(self):
         """Start the refactoring process in a separate thread"""
         if not self.api_key.get() or not self.input_dir.get() or not self.output_dir.get():
             messagebox.showerror("Error", "Please provide the API key and select both input/output directories.")
             return
 
+        try:
+            config = self.build_config()
+            config.validate()
+        except (tk.TclError, ValueError) as e:
+            messagebox.showerror("Error", f"Invalid settings: {e}")
+            return
+
         self.log("Starting refactoring process...")
         save_api_key(self.api_key.get(), self.api_key_file)  # Save API key
 
-        # Create output directory if requested
-        if self.create_output_folder.get() and not os.path.exists(self.output_dir.get()):
-            os.makedirs(self.output_dir.get())
-
-        # Convert ignored folders/files to a list
-        ignored_folders_list = [folder.strip() for folder in self.ignored_folders.get().split(",")]
-
-        # Reset the progress bars
+        # Reset the progress bars; a fresh channel drops events from an earlier run
+        self.progress_channel = ProgressChannel()
+        self.progress_tracker = ProgressTracker()
         self.total_progress_var.set(0)
         self.folder_progress_var.set(0)
+        self.status_var.set("")
 
         # Start refactoring in a separate thread
-        async def start_refactoring_task():
-            await self.refactor_handler.run_refactoring(self.input_dir.get(), ignored_folders_list)
-
-        self.refactoring_task = self.executor.submit(asyncio.run, start_refactoring_task())
+        self.refactor_handler = RefactorHandler(config, progress=self.progress_channel)
+
+        handler = self.refactor_handler
+
+        def run_refactoring_task():
+            return asyncio.run(handler.run_refactoring())
+
+        # update_progress picks up the outcome on the Tk thread once the task is done
+        self.refactoring_task = self.executor.submit(run_refactoring_task)
+
+    def build_config(self):
+        """Collect the GUI settings into a RefactorConfig"""
+        return RefactorConfig(
+            input_path=self.input_dir.get(),
+            output_path=self.output_dir.get(),
+            api_key=self.api_key.get(),
+            output_mode=self.output_mode.get(),
+            ignored=[folder.strip() for folder in self.ignored_folders.get().split(",") if folder.strip()],
+            create_output_folder=self.create_output_folder.get(),
+            max_concurrent_files=self.max_concurrent_files.get(),
+            max_concurrent_requests=self.max_concurrent_requests.get(),
+            requests_per_minute=self.requests_per_minute.get(),
+            tokens_per_minute=self.tokens_per_minute.get(),
+            use_cache=self.use_cache.get(),
+            skip_unchanged=self.skip_unchanged.get(),
+            triage=self.triage.get(),
+            strip_boilerplate=self.strip_boilerplate.get(),
+            validate_responses=self.validate_responses.get(),
+        )
+
+    def update_progress(self):
+        """
+        Apply queued progress events at a fixed frame rate.
+        The refactoring thread only posts events; Tk variables are set here, on the
+        Tk thread, once per frame no matter how many files finished in between.
+        The end of a run is noticed here too, so the thread never touches Tk.
+        """
+        events = self.progress_channel.drain()
+        if events:
+            tracker = self.progress_tracker
+            tracker.apply(events)
+            self.total_progress_var.set(tracker.overall_percent)
+            self.folder_progress_var.set(tracker.folder_percent)
+            self.status_var.set(tracker.status_text())
+        if self.refactoring_task is not None and self.refactoring_task.done():
+            self.finish_refactoring(self.refactoring_task)
+            self.refactoring_task = None
+        self.root.after(1000 // PROGRESS_FRAME_RATE, self.update_progress)
+
+    def finish_refactoring(self, task):
+        """Report a finished run: celebrate a completed one, log and show an error from a failed one."""
+        error = task.exception()
+        if error is not None:
+            self.log(f"Refactoring failed: {type(error).__name__}: {error}", "ERROR")
+            messagebox.showerror("Error", f"Refactoring failed: {error}")
+        elif not task.result().cancelled:
+            refactoring_completed_callback(self.root)
 
     def stop_refactoring(self):
         """Stop the refactoring process"""
-        if self.refactoring_task:
-            self.refactoring_task.cancel()
-            self.log("Refactoring process stopped.")
+        if self.refactor_handler and self.refactoring_task and not self.refactoring_task.done():
+            self.refactor_handler.stop()
+            self.log("Stopping refactoring...")
 
     def on_closing(self):
         """Handle graceful shutdown on window close"""
-        if self.refactoring_task:
-            self.refactoring_task.cancel()  # Stop the refactoring if running
+        if self.refactor_handler:
+            self.refactor_handler.stop()  # Stop the refactoring if running
         self.executor.shutdown(wait=False)
+        if self.log_sink:
+            remove_log_sink(self.log_sink)
         self.root.destroy()
 
 if __name__ == "__main__":
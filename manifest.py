@@ -0,0 +1,138 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from utils import log
+
+
+def manifest_path_for(output_dir):
+    """The manifest lives next to the output directory, not inside it."""
+    output_dir = Path(output_dir).resolve()
+    return output_dir.with_name(output_dir.name + ".refactor-manifest.json")
+
+
+def hash_file(path):
+    """SHA-256 of a file's bytes, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_entry(input_path, output_path, version):
+    """
+    The manifest entry for an output produced from the current contents of an input file.
+    :param version: Version of the prompt/model that produced the output.
+    """
+    input_stat = os.stat(input_path)
+    output_stat = os.stat(output_path)
+    return {
+        "size": input_stat.st_size,
+        "mtime_ns": input_stat.st_mtime_ns,
+        "sha256": hash_file(input_path),
+        "version": version,
+        "output_size": output_stat.st_size,
+        "output_mtime_ns": output_stat.st_mtime_ns,
+    }
+
+
+class RunManifest:
+    """
+    Record of which input files produced which outputs, used to skip unchanged files.
+    Each entry holds the input's size, mtime and content hash, the version of the
+    prompt/model that produced the output, and the output's size and mtime.
+    """
+
+    def __init__(self, path, version):
+        self.path = Path(path)
+        self.version = version
+        self.entries = {}
+
+    def load(self):
+        """Load a previous run's manifest; a missing or unreadable file just means a full run."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get("files", {})
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, ValueError) as e:
+            log(f"Ignoring unreadable manifest {self.path}: {e}", "WARNING")
+            self.entries = {}
+        return self
+
+    def save(self):
+        """Write the manifest atomically so a crash never leaves it half-written."""
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"files": self.entries}, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    def is_current(self, key, input_path, output_path):
+        """
+        Check whether the output for an input file is already up to date.
+        Stats first and only hashes the input when its size or mtime changed.
+        :param key: Stable key for the file, its path relative to the input directory.
+        :param input_path: Path to the input file.
+        :param output_path: Path the refactored file is written to.
+        :return: True if the file can be skipped.
+        """
+        entry = self.entries.get(key)
+        if not entry or entry.get("version") != self.version:
+            return False
+
+        try:
+            input_stat = os.stat(input_path)
+            output_stat = os.stat(output_path)
+        except OSError:
+            return False
+
+        # An output that was deleted or edited by hand is regenerated
+        if output_stat.st_size != entry.get("output_size") or output_stat.st_mtime_ns != entry.get("output_mtime_ns"):
+            return False
+
+        if input_stat.st_size == entry.get("size") and input_stat.st_mtime_ns == entry.get("mtime_ns"):
+            return True
+        if input_stat.st_size != entry.get("size"):
+            return False
+
+        # Same size but touched: only the content hash can tell
+        if hash_file(input_path) != entry.get("sha256"):
+            return False
+        entry["mtime_ns"] = input_stat.st_mtime_ns
+        return True
+
+    def record(self, key, input_path, output_path):
+        """Remember that `output_path` was produced from the current contents of `input_path`."""
+        entry = self.entries[key] = make_entry(input_path, output_path, self.version)
+        return entry
+
+    def merge(self, entries):
+        """Adopt entries recorded elsewhere, such as an interrupted run's journal."""
+        for key, entry in entries.items():
+            if entry and entry.get("version") == self.version:
+                self.entries[key] = entry
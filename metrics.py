@@ -0,0 +1,283 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Upper bounds in seconds, from fast local work up to slow API calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Files listed in each "slowest" and "most expensive" section of the JSON report
+TOP_FILES = 20
+
+METRIC_PREFIX = "refactor_"
+
+
+def report_paths_for(output_path):
+    """The JSON and Prometheus reports live next to the output, like the manifest."""
+    output_path = Path(output_path).resolve()
+    return (
+        output_path.with_name(output_path.name + ".refactor-metrics.json"),
+        output_path.with_name(output_path.name + ".refactor-metrics.prom"),
+    )
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by one label."""
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, label_value=""):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    @property
+    def total(self):
+        return sum(self.values.values())
+
+    def to_dict(self):
+        if self.label is None:
+            return self.total
+        return dict(self.values)
+
+    def prometheus_lines(self):
+        name = METRIC_PREFIX + self.name + "_total"
+        lines = [f"# HELP {name} {self.help}", f"# TYPE {name} counter"]
+        if self.label is None:
+            lines.append(f"{name} {self.total}")
+        for label_value, value in sorted(self.values.items()):
+            if self.label is not None:
+                lines.append(f'{name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+
+class Histogram:
+    """
+    Latency distribution in fixed buckets.
+    Only bucket counts are kept, so memory stays constant however many
+    observations a run makes; quantiles are interpolated within a bucket.
+    """
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            index = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    index = i
+                    break
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    @contextmanager
+    def time(self):
+        """Observe the duration of a `with` block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def quantile(self, q):
+        """Estimate the q-quantile (0 to 1) from the bucket counts."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": round(self.quantile(0.5), 6),
+            "p90": round(self.quantile(0.9), 6),
+            "p99": round(self.quantile(0.99), 6),
+            "max": round(self.max, 6),
+        }
+
+    def prometheus_lines(self):
+        name = METRIC_PREFIX + self.name
+        lines = [f"# HELP {name} {self.help}", f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum {self.sum}")
+        lines.append(f"{name}_count {self.count}")
+        return lines
+
+
+class FileStats:
+    """Time, chunks and tokens spent on one input file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.seconds = 0.0
+        self.chunks = 0
+        self.requests = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "seconds": round(self.seconds, 4),
+            "chunks": self.chunks,
+            "requests": self.requests,
+            "retries": self.retries,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+
+class RunMetrics:
+    """
+    Counters, latency histograms and per-file statistics for one run.
+    Everything here is cheap to update from the hot path; `write_reports`
+    turns it into a JSON report and a Prometheus text-format file.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.file_seconds = Histogram("file_seconds", "Time to refactor one file, from read to hand-off to the writer.")
+        self.chunking_seconds = Histogram("chunking_seconds", "Time to split one file into chunks.")
+        self.api_seconds = Histogram("api_request_seconds", "Duration of one completion request, excluding rate limiter waits.")
+        self.api_first_byte_seconds = Histogram("api_first_byte_seconds", "Time to the first streamed token of a completion.")
+        self.read_seconds = Histogram("read_seconds", "Time to read one input file.")
+        self.write_seconds = Histogram("write_seconds", "Time to write one output file.")
+
+        self.files = Counter("files", "Files handled, by outcome.", label="outcome")
+        self.chunks = Counter("chunks", "Chunks sent through the pipeline.")
+        self.api_requests = Counter("api_requests", "Completion requests that returned a response.")
+        self.api_retries = Counter("api_retries", "Completion attempts that were retried.")
+        self.api_errors = Counter("api_errors", "Failed completion attempts, by kind.", label="kind")
+        self.continuations = Counter("continuations", "Follow-up requests for truncated responses.")
+        self.tokens = Counter("tokens", "Tokens reported by the API, by direction.", label="direction")
+        self.cache = Counter("cache_lookups", "Response cache lookups, by result.", label="result")
+        self.triaged_files = Counter("triaged_files", "Files copied through without an API call, by reason.", label="reason")
+        self.deduplicated_chunks = Counter("deduplicated_chunks", "Chunks answered by an identical chunk's request in the same run.")
+        self.validation_failures = Counter("validation_failures", "Responses rejected by validation, by scope.", label="scope")
+
+        self.file_stats = {}
+        self.elapsed = 0.0
+
+    def file(self, path):
+        """Per-file statistics for `path`, created on first use."""
+        key = str(path)
+        stats = self.file_stats.get(key)
+        if stats is None:
+            stats = self.file_stats[key] = FileStats(key)
+        return stats
+
+    def record_completion(self, completion, path=None):
+        self.api_requests.inc()
+        self.tokens.inc(completion.prompt_tokens, "prompt")
+        self.tokens.inc(completion.completion_tokens, "completion")
+        if completion.first_byte_latency is not None:
+            self.api_first_byte_seconds.observe(completion.first_byte_latency)
+        if path is not None:
+            stats = self.file(path)
+            stats.requests += 1
+            stats.prompt_tokens += completion.prompt_tokens
+            stats.completion_tokens += completion.completion_tokens
+
+    def record_result(self, result):
+        """Copy the final file counts and cache statistics from a RefactorResult."""
+        self.files.values = {
+            "refactored": result.files_processed,
+            "unchanged": result.files_skipped,
+            "failed": result.files_failed,
+            "triaged": result.files_triaged,
+        }
+        self.cache.values = {"hit": result.cache_hits, "miss": result.cache_misses}
+        self.elapsed = result.elapsed
+
+    @property
+    def cache_hit_rate(self):
+        lookups = self.cache.total
+        return self.cache.values.get("hit", 0) / lookups if lookups else 0.0
+
+    def histograms(self):
+        return [self.file_seconds, self.chunking_seconds, self.api_seconds,
+                self.api_first_byte_seconds, self.read_seconds, self.write_seconds]
+
+    def counters(self):
+        return [self.files, self.chunks, self.api_requests, self.api_retries, self.api_errors,
+                self.continuations, self.tokens, self.cache, self.triaged_files, self.deduplicated_chunks, self.validation_failures]
+
+    def to_dict(self):
+        files = [stats.to_dict() for stats in self.file_stats.values()]
+        return {
+            "started": self.started,
+            "elapsed": round(self.elapsed, 3),
+            "counters": {counter.name: counter.to_dict() for counter in self.counters()},
+            "cache_hit_rate": round(self.cache_hit_rate, 4),
+            "latency": {histogram.name: histogram.to_dict() for histogram in self.histograms()},
+            "slowest_files": sorted(files, key=lambda stats: stats["seconds"], reverse=True)[:TOP_FILES],
+            "most_expensive_files": sorted(
+                files, key=lambda stats: stats["prompt_tokens"] + stats["completion_tokens"], reverse=True
+            )[:TOP_FILES],
+        }
+
+    def prometheus_text(self):
+        lines = []
+        for metric in self.counters() + self.histograms():
+            lines.extend(metric.prometheus_lines())
+        name = METRIC_PREFIX + "run_seconds"
+        lines.extend([f"# HELP {name} Wall time of the run.", f"# TYPE {name} gauge", f"{name} {self.elapsed}"])
+        return "\n".join(lines) + "\n"
+
+    def write_reports(self, json_path, prometheus_path):
+        """Write both reports; called once at the end of a run."""
+        Path(json_path).write_text(json.dumps(self.to_dict(), indent=2), encoding="utf-8")
+        Path(prometheus_path).write_text(self.prometheus_text(), encoding="utf-8")
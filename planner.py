@@ -0,0 +1,258 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import heapq
+import os
+import sqlite3
+from pathlib import Path
+from boilerplate import BoilerplateDetector, Segment
+from cache import ResponseCache, make_cache_key
+from config import DEFAULT_INPUT_PRICE, DEFAULT_OUTPUT_PRICE
+from chunker import iter_sections, split_code_into_chunks
+from indexer import index_python_files
+from journal import RunJournal, journal_path_for
+from manifest import RunManifest, manifest_path_for
+from refactor import (
+    REFACTOR_MODEL, REFACTOR_PROMPT, CHARS_PER_TOKEN, estimate_prompt_tokens, response_token_budget,
+    normalized_chunk_hash, get_output_version,
+)
+from triage import Triage
+from utils import log
+
+# Responses run a little longer than their input, mostly from added docstrings
+EXPECTED_OUTPUT_RATIO = 1.1
+
+# Latency model for one request: a fixed round trip plus generation time
+REQUEST_OVERHEAD_SECONDS = 0.5
+OUTPUT_TOKENS_PER_SECOND = 80
+
+
+class RunPlan:
+    """Estimated size, cost and duration of a run, computed without any network call."""
+
+    def __init__(self):
+        self.files = 0
+        self.files_unchanged = 0
+        self.files_triaged = 0
+        self.chunks = 0
+        self.duplicate_chunks = 0
+        self.cached_chunks = 0
+        self.requests = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.reserved_tokens = 0
+        self.cost = 0.0
+        self.wall_seconds = 0.0
+        self.concurrency = 0
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    def summary_lines(self):
+        """Human-readable report for the command line."""
+        return [
+            f"Files: {self.files} ({self.files_unchanged} unchanged, {self.files_triaged} copied through by triage)",
+            f"Chunks: {self.chunks} ({self.duplicate_chunks} duplicates, {self.cached_chunks} cached or journaled)",
+            f"API calls: {self.requests}",
+            f"Tokens: ~{self.input_tokens:,} input, ~{self.output_tokens:,} output, "
+            f"{self.reserved_tokens:,} reserved against the tokens-per-minute quota",
+            f"Cost: ~${self.cost:.2f}",
+            f"Wall time: ~{format_seconds(self.wall_seconds)} at {self.concurrency} requests in flight",
+        ]
+
+
+def format_seconds(seconds):
+    """Format seconds as 1h 02m, 3m 05s or 12s."""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+
+def request_seconds(output_tokens):
+    """Expected duration of one request producing `output_tokens`."""
+    return REQUEST_OVERHEAD_SECONDS + output_tokens / OUTPUT_TOKENS_PER_SECOND
+
+
+def schedule_seconds(durations, concurrency):
+    """
+    Wall time to run requests of the given durations with at most `concurrency`
+    in flight, longest first, each starting as soon as a slot frees up.
+    """
+    slots = [0.0] * max(1, min(concurrency, len(durations)))
+    for duration in sorted(durations, reverse=True):
+        heapq.heapreplace(slots, slots[0] + duration)
+    return max(slots) if durations else 0.0
+
+
+class RunPlanner:
+    """
+    Dry run of a RefactorConfig: indexes, triages and chunks the input exactly as
+    a real run would, then estimates tokens, calls, cost and wall time. Nothing is
+    sent over the network and nothing is written.
+    """
+
+    def __init__(self, config, concurrency=None, input_price=DEFAULT_INPUT_PRICE, output_price=DEFAULT_OUTPUT_PRICE):
+        self.config = config
+        self.concurrency = concurrency or config.max_concurrent_requests
+        self.input_price = input_price
+        self.output_price = output_price
+
+    def list_files(self):
+        """Pairs of (path, output key) for every file a run would consider."""
+        input_path = Path(self.config.input_path)
+        if input_path.is_file():
+            return [(input_path, input_path.name)]
+        return [(indexed_file.path, indexed_file.relative_path)
+                for indexed_file in index_python_files(input_path, self.config.ignored)]
+
+    def open_manifest(self):
+        if self.config.output_mode != "folder" or not self.config.skip_unchanged:
+            return None
+        return RunManifest(manifest_path_for(self.config.output_path), get_output_version()).load()
+
+    def open_cache(self):
+        """The response cache, read only; None if it is disabled or does not exist yet, as for an empty cache."""
+        if not self.config.use_cache or not os.path.exists(self.config.cache_path):
+            return None
+        cache = ResponseCache(self.config.cache_path, read_only=True)
+        try:
+            cache.contains_sync("")
+        except sqlite3.Error as e:
+            # Such as a file no run has written to yet, which a read-only cache leaves without its table
+            log(f"Ignoring unreadable cache {self.config.cache_path}: {e}", "WARNING")
+            cache.close()
+            return None
+        return cache
+
+    def load_journaled_chunks(self):
+        """Keys of the chunks an interrupted run already finished, which a resumed run reuses."""
+        if not self.config.resume:
+            return set()
+        return set(RunJournal(journal_path_for(self.config.output_path), get_output_version()).load().chunks)
+
+    async def plan(self):
+        """
+        Build the plan.
+        :return: A RunPlan.
+        """
+        plan = RunPlan()
+        plan.concurrency = self.concurrency
+        files = await asyncio.to_thread(self.list_files)
+        plan.files = len(files)
+
+        manifest = self.open_manifest()
+        if manifest:
+            current = [(path, key) for path, key in files
+                       if manifest.is_current(key, path, Path(self.config.output_path) / key)]
+            plan.files_unchanged = len(current)
+            files = [entry for entry in files if entry not in current]
+
+        if self.config.triage and not Path(self.config.input_path).is_file():
+            triaged = await Triage(
+                min_lines=self.config.triage_min_lines,
+                clean_complexity=self.config.triage_clean_complexity,
+                clean_lines=self.config.triage_clean_lines,
+            ).triage(path for path, _ in files)
+            plan.files_triaged = len(triaged)
+            files = [(path, key) for path, key in files if path not in triaged]
+
+        cache = self.open_cache()
+        journaled = await asyncio.to_thread(self.load_journaled_chunks)
+        try:
+            durations = await asyncio.to_thread(self.estimate_chunks, plan, files, cache, journaled)
+        finally:
+            if cache:
+                cache.close()
+
+        plan.cost = (plan.input_tokens * self.input_price + plan.output_tokens * self.output_price) / 1_000_000
+        # The run takes as long as the slowest of its concurrency limit and its quotas
+        plan.wall_seconds = max(
+            schedule_seconds(durations, self.concurrency),
+            plan.requests / self.config.requests_per_minute * 60,
+            plan.reserved_tokens / self.config.tokens_per_minute * 60,
+        )
+        return plan
+
+    def estimate_chunks(self, plan, files, cache, journaled):
+        """Chunk every file and add up the requests a run would make; returns their expected durations."""
+        detector = None
+        if self.config.strip_boilerplate:
+            detector = BoilerplateDetector(self.config.license_patterns, self.config.invariant_markers)
+        seen = set()
+        durations = []
+        for path, _ in files:
+            for segment in self.read_segments(path, detector):
+                if segment.invariant:
+                    continue
+                for chunk in split_code_into_chunks(segment.text):
+                    plan.chunks += 1
+                    dedup_key = normalized_chunk_hash(chunk.text)
+                    if dedup_key in seen:
+                        plan.duplicate_chunks += 1
+                        continue
+                    seen.add(dedup_key)
+                    max_tokens = response_token_budget(chunk.text)
+                    cache_key = make_cache_key(REFACTOR_MODEL, REFACTOR_PROMPT, max_tokens, chunk.text)
+                    if cache_key in journaled or (cache and cache.contains_sync(cache_key)):
+                        plan.cached_chunks += 1
+                        continue
+                    input_tokens = estimate_prompt_tokens(chunk.text)
+                    output_tokens = min(int(len(chunk.text) / CHARS_PER_TOKEN * EXPECTED_OUTPUT_RATIO), max_tokens)
+                    plan.requests += 1
+                    plan.input_tokens += input_tokens
+                    plan.output_tokens += output_tokens
+                    plan.reserved_tokens += input_tokens + max_tokens
+                    durations.append(request_seconds(output_tokens))
+        return durations
+
+    def read_segments(self, path, detector):
+        """The segments of a file, read whole or in sections as a run would read it."""
+        large_file_bytes = self.config.large_file_bytes
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            if large_file_bytes and os.path.getsize(path) >= large_file_bytes:
+                sections = iter_sections(f.readline)
+                if detector:
+                    yield from detector.iter_segments(sections, str(path))
+                else:
+                    yield from (Segment(section, False) for section in sections)
+                return
+            code = f.read()
+        yield from detector.split(code, str(path)) if detector else [Segment(code, False)]
+
+
+def plan_run(config, concurrency=None, input_price=DEFAULT_INPUT_PRICE, output_price=DEFAULT_OUTPUT_PRICE):
+    """
+    Library entry point for a dry run.
+    :param config: A RefactorConfig.
+    :param concurrency: Requests in flight to assume; defaults to `config.max_concurrent_requests`.
+    :return: A RunPlan.
+    """
+    config.validate()
+    return asyncio.run(RunPlanner(config, concurrency, input_price, output_price).plan())
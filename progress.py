@@ -0,0 +1,182 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import queue
+import time
+from collections import deque
+
+# Event kinds posted by the refactor handler
+RUN_STARTED = "run_started"
+FILE_DONE = "file_done"
+CHUNK_DONE = "chunk_done"
+TOKENS_USED = "tokens_used"
+
+# Seconds of history behind the live rates
+RATE_WINDOW = 10.0
+
+
+class ProgressEvent:
+    """One progress update from the refactoring engine."""
+
+    def __init__(self, kind, folder=None, files=0, chunks=0, tokens=0, bytes=0, folder_totals=None):
+        self.kind = kind
+        self.folder = folder
+        self.files = files
+        self.chunks = chunks
+        self.tokens = tokens
+        self.bytes = bytes
+        self.folder_totals = folder_totals
+        self.time = time.monotonic()
+
+    def __repr__(self):
+        return f"ProgressEvent({self.kind}, files={self.files}, chunks={self.chunks}, tokens={self.tokens}, bytes={self.bytes})"
+
+
+class ProgressChannel:
+    """
+    Thread-safe queue of progress events.
+    The engine posts from its event loop thread without touching any UI; the GUI or
+    the command line drains the queue on its own schedule.
+    """
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+
+    def post(self, kind, **values):
+        """Queue one event; never blocks."""
+        self.queue.put(ProgressEvent(kind, **values))
+
+    def drain(self):
+        """Take every event posted so far."""
+        events = []
+        try:
+            while True:
+                events.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return events
+
+
+class ProgressTracker:
+    """
+    Folds progress events into totals, percentages and live rates.
+    Rates cover the last `window` seconds, so they follow the current pace rather
+    than the average since the start. The ETA divides the remaining input bytes by
+    the current byte rate, since file sizes vary too much for a per-file estimate.
+    """
+
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self.started = time.monotonic()
+        self.files_total = 0
+        self.bytes_total = 0
+        self.files_done = 0
+        self.chunks_done = 0
+        self.tokens = 0
+        self.bytes_done = 0
+        self.folder_totals = {}
+        self.folder_done = {}
+        self.current_folder = None
+        self.samples = deque([(self.started, 0, 0, 0)])
+
+    def apply(self, events):
+        """Apply a batch of events, then record one rate sample."""
+        for event in events:
+            if event.kind == RUN_STARTED:
+                self.files_total = event.files
+                self.bytes_total = event.bytes
+                self.folder_totals = dict(event.folder_totals or {})
+                self.folder_done = {folder: 0 for folder in self.folder_totals}
+            elif event.kind == FILE_DONE:
+                self.files_done += event.files
+                self.bytes_done += event.bytes
+                if event.folder is not None:
+                    self.folder_done[event.folder] = self.folder_done.get(event.folder, 0) + event.files
+                    self.current_folder = event.folder
+            elif event.kind == CHUNK_DONE:
+                self.chunks_done += event.chunks
+            elif event.kind == TOKENS_USED:
+                self.tokens += event.tokens
+
+        now = time.monotonic()
+        self.samples.append((now, self.files_done, self.tokens, self.bytes_done))
+        while len(self.samples) > 2 and now - self.samples[1][0] >= self.window:
+            self.samples.popleft()
+
+    @property
+    def overall_percent(self):
+        if not self.files_total:
+            return 0
+        return int(self.files_done / self.files_total * 100)
+
+    @property
+    def folder_percent(self):
+        total = self.folder_totals.get(self.current_folder)
+        if not total:
+            return 0
+        return int(self.folder_done.get(self.current_folder, 0) / total * 100)
+
+    def rate(self, index):
+        first, last = self.samples[0], self.samples[-1]
+        elapsed = last[0] - first[0]
+        if elapsed <= 0:
+            return 0.0
+        return (last[index] - first[index]) / elapsed
+
+    @property
+    def files_per_second(self):
+        return self.rate(1)
+
+    @property
+    def tokens_per_second(self):
+        return self.rate(2)
+
+    @property
+    def eta(self):
+        """Seconds until the run should finish, or None while there is no rate yet."""
+        if self.files_total and self.files_done >= self.files_total:
+            return 0.0
+        bytes_per_second = self.rate(3)
+        if bytes_per_second <= 0:
+            return None
+        return max(self.bytes_total - self.bytes_done, 0) / bytes_per_second
+
+    def status_text(self):
+        """One-line summary of counts, rates and ETA."""
+        eta = self.eta
+        return (
+            f"{self.files_done}/{self.files_total} files, {self.chunks_done} chunks | "
+            f"{self.files_per_second:.1f} files/s, {self.tokens_per_second:,.0f} tokens/s | "
+            f"ETA {format_duration(eta) if eta is not None else '--'}"
+        )
+
+
+def format_duration(seconds):
+    """Format seconds as M:SS, or H:MM:SS for an hour or more."""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
@@ -0,0 +1,197 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+
+def backoff_delay(attempt, base=2, cap=60):
+    """
+    Exponential backoff with full jitter.
+    :param attempt: Zero-based attempt number that just failed.
+    :param base: Delay of the first retry in seconds.
+    :param cap: Upper bound for any single delay in seconds.
+    :return: Seconds to wait before the next attempt.
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def parse_retry_after(headers):
+    """
+    Read the server's requested wait time from response headers.
+    Understands `retry-after-ms`, `Retry-After` in seconds and `Retry-After` as an HTTP date.
+    :param headers: Mapping of response headers, may be None.
+    :return: Seconds to wait, or None if the server did not say.
+    """
+    if not headers:
+        return None
+    headers = {str(key).lower(): value for key, value in dict(headers).items()}
+
+    if "retry-after-ms" in headers:
+        try:
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        except (TypeError, ValueError):
+            pass
+
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """A token bucket refilled continuously at a per-minute rate."""
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        """Add the tokens earned since the last update."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        """
+        Wait until `amount` tokens are available and take them.
+        Requests larger than the bucket are clamped to its capacity so they can still proceed.
+        """
+        amount = min(amount, self.capacity)
+        # The lock makes waiters queue up in order instead of racing for each refill
+        async with self.lock:
+            while True:
+                self.refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Concurrency limit that adapts to the API's health (AIMD).
+    The limit halves when the API answers with a rate-limit error and grows by one
+    after a full window of consecutive successes.
+    """
+
+    def __init__(self, maximum, minimum=1, initial=None, cooldown=5.0):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = initial or self.maximum
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.successes = 0
+        self.last_decrease = 0.0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        """Additive increase once a full window of requests succeeded."""
+        self.successes += 1
+        if self.successes >= self.limit and self.limit < self.maximum:
+            self.limit += 1
+            self.successes = 0
+            self.wake_waiters()
+
+    def on_rate_limited(self):
+        """
+        Multiplicative decrease.
+        Requests already in flight when the limit dropped will often fail too,
+        so further decreases are ignored for a short cooldown.
+        """
+        self.successes = 0
+        now = time.monotonic()
+        if now - self.last_decrease < self.cooldown:
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit // 2)
+
+    def wake_waiters(self):
+        """Let waiting requests re-check the raised limit."""
+        async def notify():
+            async with self.condition:
+                self.condition.notify_all()
+        asyncio.ensure_future(notify())
+
+
+class RateLimiter:
+    """
+    Keeps requests under the account's quota.
+    Combines requests-per-minute and tokens-per-minute buckets with an adaptive
+    concurrency limit, and pauses everyone when the server asks for a Retry-After.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, max_concurrent_requests):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrencyLimiter(max_concurrent_requests)
+        self.paused_until = 0.0
+
+    async def acquire(self, estimated_tokens):
+        """
+        Wait for quota before sending a request.
+        :param estimated_tokens: Prompt tokens plus the response budget, as counted by the API.
+        """
+        pause = self.paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        await self.request_bucket.acquire(1)
+        await self.token_bucket.acquire(estimated_tokens)
+
+    def pause(self, seconds):
+        """Hold back all new requests for `seconds`, as asked by the server."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def on_success(self):
+        """Report a successful request."""
+        self.concurrency.on_success()
+
+    def on_rate_limited(self, retry_after=None):
+        """Report a rate-limit error, with the server's Retry-After if it sent one."""
+        self.concurrency.on_rate_limited()
+        if retry_after:
+            self.pause(retry_after)
@@ -22,208 +22,876 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 import asyncio
-import aiofiles
-import openai
+import hashlib
+import os
+import re
 import time
+import aiofiles
+from collections import OrderedDict, deque
+from functools import partial
 from pathlib import Path
 from utils import log
-from celebration import refactoring_completed_callback
-import os
+from config import RefactorResult
+from ratelimit import RateLimiter, backoff_delay
+from transport import RateLimitError, TransportError, create_backend
+from cache import ResponseCache, make_cache_key
+from manifest import RunManifest, manifest_path_for
+from journal import RunJournal, journal_path_for
+from chunker import split_code_into_chunks, join_chunks, iter_sections, CHUNKER_VERSION
+from indexer import index_python_files
+from validation import Validator
+from boilerplate import BoilerplateDetector, Segment
+from triage import Triage
+from writer import FolderWriter, BundleWriter, StreamedOutput
+from metrics import RunMetrics, report_paths_for
+from progress import ProgressChannel, RUN_STARTED, FILE_DONE, CHUNK_DONE, TOKENS_USED
+
+REFACTOR_MODEL = "gpt-4o-mini"  # Use GPT-4o mini
+
+# Rough size of a token in characters, for estimates made before a request
+CHARS_PER_TOKEN = 4
+
+# Response budget per chunk: the chunk's own size scaled up for added docstrings,
+# plus a fixed margin, within the model's limits. Truncated responses still
+# get continuation requests, so the budget only has to fit the usual case.
+RESPONSE_TOKEN_RATIO = 1.5
+RESPONSE_TOKEN_MARGIN = 200
+MIN_RESPONSE_TOKENS = 256
+MAX_RESPONSE_TOKENS = 16384
+
+REFACTOR_PROMPT = (
+    "You are an expert Python programmer. Refactor the following Python code while ensuring it adheres to the following instructions:"
+    "1. Maintain the full functionality of the code."
+    "2. Improve the code's efficiency, ensuring it follows PEP 8 standards."
+    "3. Do **not** remove or replace any non-empty class or function bodies with 'pass'. Ensure that all classes and functions contain meaningful, functional code."
+    "4. Preserve all existing docstrings. Add missing docstrings where necessary, and update them if needed to reflect the current behavior of the code."
+    "5. Refactor the entire code file, identifying areas where optimizations can be made."
+    "6. Implement optimizations based on your findings, ensuring that no errors are introduced during the refactoring process."
+    "7. Proofread the code for potential errors or issues that might arise after refactoring."
+    "8. Lastly, ensure the code is clean, readable, and aesthetically pleasing according to Python best practices."
+
+    "Additionally, if the code is lengthy or exceeds token limits, split it into smaller chunks, process those chunks individually, and recombine them after refactoring."
+
+    "Provide only the refactored code, without any comments or explanations unless they are part of docstrings."
+)
+
+# Follow-up instruction sent when a response was cut off at max_tokens
+CONTINUE_PROMPT = (
+    "Your previous answer was cut off. Continue exactly where it stopped, "
+    "without repeating anything and without any introduction or code fences."
+)
+
+# Upper bound on follow-up requests for a single chunk
+MAX_CONTINUATIONS = 3
+
+# Finished chunk results kept for deduplication; older ones fall back to the cache
+DEDUP_RESULTS = 1024
+
+
+def estimate_prompt_tokens(code):
+    """Tokens of the system prompt plus `code`, at roughly 4 characters per token."""
+    return (len(REFACTOR_PROMPT) + len(code)) // CHARS_PER_TOKEN
+
+
+def response_token_budget(code):
+    """
+    The `max_tokens` for refactoring `code`, sized from the code itself so that small
+    chunks do not reserve a large share of the tokens-per-minute quota.
+    """
+    budget = int(len(code) / CHARS_PER_TOKEN * RESPONSE_TOKEN_RATIO) + RESPONSE_TOKEN_MARGIN
+    return max(MIN_RESPONSE_TOKENS, min(budget, MAX_RESPONSE_TOKENS))
 
 
-def split_code_into_chunks(code, max_tokens=1500):
+def estimate_request_tokens(code, max_tokens):
     """
-    Split code into smaller chunks by functions or classes to fit within the token limit.
-    :param code: The original Python code as a string.
-    :param max_tokens: Maximum number of tokens per chunk.
-    :return: A list of code chunks.
+    Estimate the tokens a request counts against the tokens-per-minute quota.
+    The API reserves the prompt plus the full response budget.
     """
-    chunks = []
-    current_chunk = []
-    token_count = 0
+    return estimate_prompt_tokens(code) + max_tokens
 
-    # Split code by lines
-    for line in code.splitlines():
-        token_count += len(line.split())  # Rough approximation of tokens
-        if token_count > max_tokens:
-            # Add the current chunk and reset
-            chunks.append("\n".join(current_chunk))
-            current_chunk = []
-            token_count = len(line.split())  # Start with the new line's token count
-        current_chunk.append(line)
 
-    # Add any remaining chunk
-    if current_chunk:
-        chunks.append("\n".join(current_chunk))
+def normalized_chunk_hash(text):
+    """Hash of a chunk that ignores line endings, trailing whitespace and surrounding blank lines."""
+    normalized = "\n".join(line.rstrip() for line in text.strip("\n").splitlines())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
 
-    return chunks
 
+def strip_blank_lines(text):
+    """Remove the blank lines and trailing whitespace around a response, but not the indentation of its first line."""
+    return re.sub(r"\A(?:[ \t]*\r?\n)+", "", text).rstrip()
 
-class RefactorHandler:
-    def __init__(self, app):
-        self.app = app
-        self.api_key = app.api_key.get()
-        self.is_running = True
-        self.output_mode = app.output_mode.get()
 
-    def set_openai_api_key(self):
-        """Set the OpenAI API key globally before making requests"""
-        if self.api_key:
-            openai.api_key = self.api_key
-            log("OpenAI API key set.")
-        else:
-            log("OpenAI API key is missing. Please enter a valid key.")
+def get_output_version():
+    """Identify the model, prompt, response budget and chunker that produce an output file."""
+    response_budget = f"{RESPONSE_TOKEN_RATIO}x+{RESPONSE_TOKEN_MARGIN} in {MIN_RESPONSE_TOKENS}-{MAX_RESPONSE_TOKENS}"
+    return make_cache_key(REFACTOR_MODEL, REFACTOR_PROMPT, response_budget, f"chunker v{CHUNKER_VERSION}")[:16]
 
-    async def run_refactoring(self, input_path, ignored_folders=[]):
-        """Run the refactoring process on a folder or a single file"""
-        self.set_openai_api_key()
 
-        # Convert ignored folders to paths for better handling
-        ignored_paths = [Path(folder).resolve() for folder in ignored_folders]
+class RefactorHandler:
+    """
+    Runs the refactoring pipeline for one RefactorConfig.
+    The handler knows nothing about the GUI: progress events are posted to a
+    ProgressChannel that the caller drains, and the run returns a RefactorResult.
+    """
 
-        if Path(input_path).is_file():
-            # Single file refactoring
-            await self.refactor_file(Path(input_path))
+    def __init__(self, config, progress=None, backend=None):
+        self.config = config
+        self.api_key = config.api_key
+        self.is_running = True
+        self.output_mode = config.output_mode
+        self.progress = progress or ProgressChannel()
+        self.backend = backend
+        self.owns_backend = backend is None
+        self.rate_limiter = None
+        self.cache = None
+        self.manifest = None
+        self.journal = None
+        self.validator = None
+        self.boilerplate = None
+        self.chunk_results = OrderedDict()
+        self.triaged = {}
+        self.unchanged_keys = set()
+        self.copied_keys = set()
+        self.writer = None
+        self.loop = None
+        self.task = None
+        self.incomplete_files = set()
+        self.incomplete_keys = set()
+        self.result = RefactorResult()
+        self.metrics = RunMetrics()
+
+    def stop(self):
+        """
+        Stop the run from any thread.
+        The running task is cancelled inside its own event loop, which aborts
+        in-flight HTTP requests and backoff waits right away; finished files are
+        still written and everything done so far stays in the journal.
+        """
+        self.is_running = False
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.cancel_task)
+
+    def cancel_task(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def check_api_key(self):
+        """Warn early when the backend needs an API key and none was given"""
+        if not self.backend.requires_api_key:
+            return
+        if self.api_key:
+            log("OpenAI API key set.")
         else:
-            # Count all the Python files to initialize the total progress bar
-            total_python_files = self.count_python_files(input_path, ignored_paths)
-            self.app.total_progress_var.set(0)  # Reset total progress
-
-            # Directory refactoring with recursive traversal, ignoring specified folders/files
-            await self.refactor_directory(Path(input_path), ignored_paths, total_python_files)
-
-        self.trigger_celebration()
-
-    def count_python_files(self, directory, ignored_paths):
-        """Count total Python files recursively for progress tracking."""
-        file_count = 0
-        for root, dirs, files in os.walk(directory):
-            root_path = Path(root).resolve()
-
-            if any(ignored_path in root_path.parents or root_path == ignored_path for ignored_path in ignored_paths):
-                continue
-
-            file_count += sum(1 for file in files if file.endswith('.py'))
-        return file_count
+            log("OpenAI API key is missing. Please enter a valid key.", "WARNING")
 
-    async def refactor_directory(self, directory, ignored_paths, total_python_files):
-        """Recursively refactor all Python files in a directory, ignoring specified paths."""
-        processed_files = 0
-
-        for root, dirs, files in os.walk(directory):
-            root_path = Path(root).resolve()
-
-            if any(ignored_path in root_path.parents or root_path == ignored_path for ignored_path in ignored_paths):
-                log(f"Skipping ignored folder: {root_path}")
-                continue
+    async def run_refactoring(self):
+        """
+        Run the refactoring process on a folder or a single file.
+        :return: A RefactorResult summarising the run.
+        """
+        started = time.monotonic()
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        self.result = RefactorResult()
+        if not self.is_running:
+            # Stopped before it started
+            self.result.cancelled = True
+            return self.result
+        if self.backend is None:
+            self.backend = create_backend(self.config)
+        self.check_api_key()
+        self.prepare_output()
+
+        # Shared quota and in-flight budget for every chunk of every file in this run
+        self.rate_limiter = self.create_rate_limiter()
+        self.cache = ResponseCache(self.config.cache_path, enabled=self.config.use_cache)
+        self.incomplete_files = set()
+        self.incomplete_keys = set()
+        self.copied_keys = set()
+        self.metrics = RunMetrics()
+        self.journal = self.open_journal()
+        self.validator = Validator() if self.config.validate_responses else None
+        self.boilerplate = self.create_boilerplate_detector()
+        self.chunk_results = OrderedDict()
+
+        input_path = Path(self.config.input_path)
+        try:
+            if input_path.is_file():
+                # Single file refactoring
+                self.result.files_total = 1
+                size = input_path.stat().st_size
+                self.progress.post(RUN_STARTED, files=1, bytes=size)
+                self.writer = self.create_writer([input_path.name]).start()
+                await self.refactor_file(input_path, input_path.name)
+                self.progress.post(FILE_DONE, files=1, bytes=size)
+            else:
+                # One indexing pass drives both the progress total and the work queue
+                indexed_files = await self.index_files(input_path)
+
+                # Directory refactoring over the indexed files
+                self.writer = self.create_writer([indexed_file.relative_path for indexed_file in indexed_files]).start()
+                await self.refactor_directory(input_path, indexed_files)
+            await self.finish_output()
+        except asyncio.CancelledError:
+            if self.writer:
+                await self.writer.abort()
+            if self.is_running:
+                raise  # Cancelled by the caller, not through stop()
+            self.result.cancelled = True
+            log("Refactoring stopped; the next run resumes where this one left off.", "WARNING")
+        except BaseException:
+            if self.writer:
+                await self.writer.abort()
+            raise
+        finally:
+            # From here on a late stop() has nothing left to cancel
+            self.task = None
+            await self.cancel_shared_chunks()
+            self.journal.close(completed=not self.result.cancelled and self.writer is None)
+            if self.validator:
+                # Do not wait for validations of cancelled chunks
+                self.validator.close(wait=False)
+            if self.manifest:
+                # Saved even after a failure so that files already written are not redone
+                self.manifest.save()
+            if self.cache.enabled:
+                log(self.cache.summary())
+            self.cache.close()
+            if self.owns_backend:
+                await self.backend.close()
+                self.backend = None
+
+            self.result.cache_hits = self.cache.hits
+            self.result.cache_misses = self.cache.misses
+            self.result.elapsed = time.monotonic() - started
+            if self.config.write_metrics:
+                await asyncio.to_thread(self.write_metrics)
+
+        log(self.result.summary())
+        return self.result
+
+    def state_path(self):
+        """Path the journal and metrics reports are named after: the output, by default."""
+        return self.config.output_path
+
+    async def index_files(self, input_path):
+        """List the files of a directory run."""
+        return await asyncio.to_thread(index_python_files, input_path, self.config.ignored)
+
+    def open_journal(self):
+        """Open the resume journal, picking up an interrupted run's work if resuming is enabled."""
+        journal = RunJournal(journal_path_for(self.state_path()), get_output_version())
+        if self.config.resume:
+            journal.load()
+            if journal.chunks or journal.files:
+                log(f"Resuming an interrupted run: {len(journal.chunks)} chunks and {len(journal.files)} files already done.")
+        return journal.open()
+
+    def create_boilerplate_detector(self):
+        """Detector for license headers and marked blocks, or None when everything is sent."""
+        if not self.config.strip_boilerplate:
+            return None
+        return BoilerplateDetector(self.config.license_patterns, self.config.invariant_markers)
 
-            python_files = [Path(root) / file for file in files if file.endswith('.py')]
-            total_files_in_folder = len(python_files)
+    def write_metrics(self):
+        """Write the run's JSON and Prometheus reports next to the output."""
+        self.metrics.record_result(self.result)
+        json_path, prometheus_path = report_paths_for(self.state_path())
+        try:
+            self.metrics.write_reports(json_path, prometheus_path)
+            log(f"Metrics written to {json_path}")
+        except OSError as e:
+            log(f"Cannot write metrics report: {e}", "WARNING")
+
+    def prepare_output(self):
+        """Create the output folder (or the bundle's parent folder) if requested."""
+        if not self.config.create_output_folder:
+            return
+        output_path = Path(self.config.output_path)
+        folder = output_path if self.output_mode == "folder" else output_path.parent
+        folder.mkdir(parents=True, exist_ok=True)
+
+    def create_writer(self, keys):
+        """
+        Create the output stage for this run.
+        :param keys: Output keys of every file the run may write.
+        """
+        if self.output_mode == "file":
+            return BundleWriter(self.config.output_path, keys, write_seconds=self.metrics.write_seconds)
+        return FolderWriter(self.config.output_path, write_seconds=self.metrics.write_seconds)
+
+    async def finish_output(self):
+        """Wait for the writer to drain and count files it could not write as failed."""
+        writer, self.writer = self.writer, None
+        await writer.close()
+        for key in writer.failed - self.incomplete_keys:
+            if key in self.copied_keys:
+                self.result.files_triaged -= 1
+            else:
+                self.result.files_processed -= 1
+            self.result.files_failed += 1
 
-            if total_files_in_folder == 0:
-                continue
+    async def refactor_directory(self, directory, indexed_files):
+        """
+        Refactor all indexed Python files in a directory.
+        The files feed a shared queue that a bounded pool of workers drains,
+        so at most `max_concurrent_files` files are in flight at any time.
+        :param directory: Root directory being refactored.
+        :param indexed_files: IndexedFile list from `index_python_files`.
+        """
+        max_workers = self.config.max_concurrent_files
+        self.result.files_total = len(indexed_files)
+        folder_totals = {}
+        for indexed_file in indexed_files:
+            folder_totals[indexed_file.folder] = folder_totals.get(indexed_file.folder, 0) + 1
+        self.progress.post(
+            RUN_STARTED,
+            files=len(indexed_files),
+            bytes=sum(indexed_file.size for indexed_file in indexed_files),
+            folder_totals=folder_totals,
+        )
+
+        # Incremental mode skips files whose output is already current
+        self.manifest = None
+        self.unchanged_keys = set()
+        if self.output_mode == "folder" and self.config.skip_unchanged:
+            manifest_path = manifest_path_for(self.config.output_path)
+            self.manifest = RunManifest(manifest_path, get_output_version()).load()
+            # Files written by an interrupted run whose manifest was never saved
+            self.manifest.merge(self.journal.files)
+            self.unchanged_keys = await asyncio.to_thread(self.find_unchanged_files, indexed_files)
+
+        # Files not worth an API call are found before any request goes out
+        changed_files = [
+            indexed_file for indexed_file in indexed_files if indexed_file.relative_path not in self.unchanged_keys
+        ]
+        self.triaged = await self.triage_files(changed_files) if self.config.triage and changed_files else {}
+
+        # Keep the queue short so workers pick up files in schedule order
+        file_queue = asyncio.Queue(maxsize=max_workers * 2)
+        workers = [asyncio.create_task(self.file_worker(file_queue)) for _ in range(max_workers)]
 
-            # Reset folder progress bar
-            self.app.folder_progress_var.set(0)
+        try:
+            await self.feed_files(file_queue, indexed_files)
+            # One sentinel per worker signals the end of the work
+            for _ in workers:
+                await file_queue.put(None)
+            await asyncio.gather(*workers)
+        except BaseException:
+            # Stopped or failed: cancel files in flight instead of waiting for them
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+
+    async def feed_files(self, file_queue, indexed_files):
+        """Put the files on the work queue, stopping early when the run is stopped."""
+        # Largest files first, so a big module does not start last and stretch the run
+        for indexed_file in sorted(indexed_files, key=lambda indexed_file: indexed_file.size, reverse=True):
+            if not self.is_running:
+                break
+            await file_queue.put(indexed_file)
+
+    async def file_worker(self, file_queue):
+        """Take files off the shared queue and refactor them until a sentinel arrives."""
+        while True:
+            indexed_file = await file_queue.get()
+            if indexed_file is None:
+                return
+            await self.process_file(indexed_file)
+            # Files finish out of order; the consumer keeps per-folder counts
+            self.progress.post(FILE_DONE, folder=indexed_file.folder, files=1, bytes=indexed_file.size)
+
+    async def process_file(self, indexed_file):
+        """
+        Copy, skip or refactor one indexed file.
+        :return: False if the file failed; its output may still be written with original code.
+        """
+        file_path, key = indexed_file.path, indexed_file.relative_path
+        if key in self.unchanged_keys:
+            return await self.skip_unchanged_file(file_path, key)
+        reason = self.triaged.get(file_path)
+        if reason is not None:
+            return await self.copy_file_through(file_path, key, reason)
+        return await self.refactor_file(file_path, key)
+
+    def find_unchanged_files(self, indexed_files):
+        """
+        Check the indexed files against the manifest; runs in a thread.
+        :return: The keys of the files whose output is already current.
+        """
+        return {
+            indexed_file.relative_path for indexed_file in indexed_files
+            if self.manifest.is_current(indexed_file.relative_path, indexed_file.path,
+                                        self.get_output_path(indexed_file.relative_path))
+        }
+
+    def create_triage(self):
+        """The triage pass configured for this run."""
+        return Triage(
+            min_lines=self.config.triage_min_lines,
+            clean_complexity=self.config.triage_clean_complexity,
+            clean_lines=self.config.triage_clean_lines,
+        )
+
+    async def triage_files(self, indexed_files, triage=None):
+        """
+        Run the local triage pass over the indexed files.
+        :param triage: A Triage to reuse, such as one whose process pool is already open.
+        :return: A dict mapping the path of each file to copy through to the reason.
+        """
+        started = time.monotonic()
+        triage = triage or self.create_triage()
+        triaged = await triage.triage(indexed_file.path for indexed_file in indexed_files)
+        reasons = {}
+        for reason in triaged.values():
+            reasons[reason] = reasons.get(reason, 0) + 1
+        details = ", ".join(f"{count} {reason}" for reason, count in sorted(reasons.items()))
+        log(f"Triage: {len(triaged)} of {len(indexed_files)} files need no refactoring"
+            + (f" ({details})" if details else "") + f", in {time.monotonic() - started:.1f}s")
+        return triaged
+
+    async def copy_file_through(self, file_path, key, reason):
+        """Write a file the triage pass skipped to the output unchanged."""
+        try:
+            async with aiofiles.open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                code = await f.read()
+            await self.writer.submit(key, code, partial(self.record_copied_file, key))
+            self.copied_keys.add(key)
+            log(f"Copied {file_path} unchanged ({reason})", "DEBUG")
+            self.result.files_triaged += 1
+            self.metrics.triaged_files.inc(label_value=reason)
+            return True
+        except Exception as e:
+            log(f"Error copying {file_path}: {e}", "ERROR")
+            self.result.files_failed += 1
+            await self.writer.skip(key)
+            return False
+
+    async def skip_unchanged_file(self, file_path, key):
+        """Leave a file alone whose output the manifest shows is already current."""
+        log(f"Skipping unchanged file: {file_path}")
+        self.result.files_skipped += 1
+        await self.writer.skip(key)
+        return True
+
+    def record_written_file(self, key, file_path):
+        """
+        Remember a fully refactored file once its output is on disk.
+        Runs in the writer thread; the journal copy of the manifest entry lets an
+        interrupted run skip the file even though the manifest was never saved.
+        """
+        entry = None
+        if self.manifest:
+            entry = self.manifest.record(key, file_path, self.get_output_path(key))
+        self.journal.record_file(key, entry)
 
-            for idx, file_path in enumerate(python_files, start=1):
-                await self.refactor_file(file_path, idx, total_files_in_folder)
+    def record_copied_file(self, key):
+        """Runs in the writer thread once a file the triage pass skipped is on disk."""
+        self.journal.record_file(key)
 
-                processed_files += 1
-                overall_progress = int((processed_files / total_python_files) * 100)
-                self.app.total_progress_var.set(overall_progress)
+    def get_output_path(self, key):
+        """
+        Determine where the refactored version of a file is written.
+        :param key: The file's output key: its POSIX path relative to the input directory,
+            as the indexer found it, so a symlinked file keeps the name of the link.
+        """
+        if self.output_mode == "file":
+            return Path(self.config.output_path)
+        return Path(self.config.output_path) / key
 
-    async def refactor_file(self, file_path, idx=None, total_files=None):
+    async def refactor_file(self, file_path, key):
         """
         Refactor a single Python file, splitting it into chunks if needed.
+        The result is handed to the writer stage; this coroutine does not wait for the disk.
+        Files of at least `large_file_bytes` are streamed instead of read whole.
         :param file_path: Path to the Python file to be refactored.
-        :param idx: Index of the current file for progress tracking.
-        :param total_files: Total number of files to process.
+        :param key: The file's output key.
+        :return: True if every chunk was refactored and the output was queued for writing.
         """
+        stats = self.metrics.file(file_path)
+        started = time.perf_counter()
+        refactored_code = None
         try:
+            large_file_bytes = self.config.large_file_bytes
+            if large_file_bytes and os.path.getsize(file_path) >= large_file_bytes:
+                refactored_code = await self.refactor_streamed(file_path, key, stats)
+            else:
+                refactored_code = await self.refactor_in_memory(file_path, stats)
+
+            log(f"Processed {file_path}")
+            # Incomplete files are written so the output is complete, but never recorded as current
+            complete = file_path not in self.incomplete_files
+            await self.writer.submit(key, refactored_code, partial(self.record_written_file, key, file_path) if complete else None)
+            refactored_code = None  # Owned by the writer from here on
+            if not complete:
+                self.incomplete_keys.add(key)
+                self.result.files_failed += 1
+                return False
+            self.result.files_processed += 1
+            return True
+        except Exception as e:
+            log(f"Error processing {file_path}: {e}", "ERROR")
+            self.result.files_failed += 1
+            await self.writer.skip(key)
+            return False
+        finally:
+            if isinstance(refactored_code, StreamedOutput):
+                refactored_code.discard()
+            stats.seconds = time.perf_counter() - started
+            self.metrics.file_seconds.observe(stats.seconds)
+
+    async def refactor_in_memory(self, file_path, stats):
+        """
+        Read a file whole, refactor all of its chunks at once and validate the result.
+        :return: The refactored source; the original where validation failed.
+        """
+        with self.metrics.read_seconds.time():
             async with aiofiles.open(file_path, 'r', encoding='utf-8', errors='replace') as f:
                 code = await f.read()
 
-            # Split code into smaller chunks if necessary
-            code_chunks = split_code_into_chunks(code)
-
-            refactored_chunks = []
-            for chunk in code_chunks:
-                refactored_chunk = await self.gpt_refactor_code_with_retry(chunk)
-                if refactored_chunk:
-                    # Remove backtick formatting from the response
-                    refactored_chunk = refactored_chunk.replace("```python", "").replace("```", "").strip()
-                    refactored_chunks.append(refactored_chunk)
-                else:
-                    log(f"Failed to refactor chunk in {file_path}")
-            
-            # Recombine the refactored chunks
-            refactored_code = "\n".join(refactored_chunks)
-
-            # Determine the output path
-            if self.output_mode == "file":
-                output_file_path = Path(self.app.output_dir.get())
+        # License headers and marked blocks skip the model and are re-attached verbatim;
+        # the code in between is split into chunks at definition boundaries
+        with self.metrics.chunking_seconds.time():
+            segments = self.boilerplate.split(code, str(file_path)) if self.boilerplate else [Segment(code, False)]
+            segment_chunks = [[] if segment.invariant else split_code_into_chunks(segment.text) for segment in segments]
+        chunk_count = sum(len(chunks) for chunks in segment_chunks)
+        self.result.chunks += chunk_count
+        self.metrics.chunks.inc(chunk_count)
+        stats.chunks = chunk_count
+
+        # Refactor all chunks concurrently; gather keeps them in their original order
+        refactored_chunks = await asyncio.gather(
+            *(self.refactor_chunk(chunk, file_path) for chunks in segment_chunks for chunk in chunks)
+        )
+
+        # Recombine the refactored chunks, restoring the indentation of split-out methods
+        refactored_code = self.join_segments(segments, segment_chunks, refactored_chunks)
+
+        # Chunks that pass on their own can still clash once joined
+        if self.validator and refactored_code != code:
+            problems = await self.validator.validate(code, refactored_code, str(file_path))
+            if problems:
+                log(f"Refactored {file_path} failed validation ({problems[0]}), keeping the original code", "WARNING")
+                self.metrics.validation_failures.inc(label_value="file")
+                self.incomplete_files.add(file_path)
+                refactored_code = code
+        return refactored_code
+
+    async def refactor_streamed(self, file_path, key, stats):
+        """
+        Refactor a large file without ever holding it whole.
+        Sections cut at top-level statements are read lazily and chunked one at a time;
+        at most `max_concurrent_requests` chunks of the file are in flight, and results
+        are appended to a StreamedOutput in file order as soon as the oldest one is done.
+        Reading waits while the window is full, so memory stays bounded by the chunk size
+        times the window. Chunks are validated on their own; the whole file is not.
+        :return: The closed StreamedOutput.
+        """
+        output = await asyncio.to_thread(self.writer.open_output, key)
+        source = open(file_path, 'r', encoding='utf-8', errors='replace')
+        window = deque()
+        tail = None  # After a refactored chunk, its trailer; the line break that ends the chunk goes before it
+
+        async def write_oldest():
+            nonlocal tail
+            item, task = window.popleft()
+            if task is None:
+                # A segment passed through as it is, as in join_segments
+                text = ("" if tail is None else "\n" + tail) + item.text
+                tail = None
             else:
-                output_file_path = Path(self.app.output_dir.get()) / file_path.relative_to(self.app.input_dir.get())
-                output_file_path.parent.mkdir(parents=True, exist_ok=True)
-
-            # Write the refactored code back to the file
-            async with aiofiles.open(output_file_path, 'w', encoding='utf-8') as f:
-                await f.write(refactored_code)
+                # Blank lines only at the start of the file or after an invariant segment, as in join_chunks
+                separator = item.separator[1:] if tail is None else tail + item.separator
+                text = separator + item.reindent((await task).strip("\n"))
+                tail = item.trailer
+            await asyncio.to_thread(output.write, text)
 
-            # Update folder-specific progress bar
-            if total_files:
-                folder_progress = int((idx / total_files) * 100)
-                self.app.folder_progress_var.set(folder_progress)
+        try:
+            sections = iter_sections(source.readline)
+            if self.boilerplate:
+                segments = self.boilerplate.iter_segments(sections, str(file_path))
+            else:
+                segments = (Segment(section, False) for section in sections)
+            while True:
+                with self.metrics.read_seconds.time():
+                    segment = await asyncio.to_thread(next, segments, None)
+                if segment is None:
+                    break
+                with self.metrics.chunking_seconds.time():
+                    chunks = [] if segment.invariant else split_code_into_chunks(segment.text)
+                # Segments without chunks, such as blank lines between marked blocks, are written as they are
+                for item in chunks or [segment]:
+                    task = None
+                    if not isinstance(item, Segment):
+                        self.result.chunks += 1
+                        self.metrics.chunks.inc()
+                        stats.chunks += 1
+                        task = asyncio.create_task(self.refactor_chunk(item, file_path))
+                    window.append((item, task))
+                    while len(window) >= self.config.max_concurrent_requests:
+                        await write_oldest()
+
+            while window:
+                await write_oldest()
+            if tail is not None:
+                await asyncio.to_thread(output.write, "\n" + tail)
+            await asyncio.to_thread(output.close)
+            return output
+        except BaseException:
+            for _, task in window:
+                if task is not None:
+                    task.cancel()
+            await asyncio.gather(*(task for _, task in window if task is not None), return_exceptions=True)
+            output.discard()
+            raise
+        finally:
+            source.close()
+
+    @staticmethod
+    def join_segments(segments, segment_chunks, refactored_chunks):
+        """Reassemble a file from its invariant segments and refactored chunks."""
+        parts = []
+        position = 0
+        for segment, chunks in zip(segments, segment_chunks):
+            if segment.invariant or not chunks:
+                # Blank lines between invariant blocks have no chunks and are kept as they are
+                parts.append(segment.text)
+                continue
+            # Ends with a line break and the blank lines that followed the code
+            parts.append(join_chunks(chunks, refactored_chunks[position:position + len(chunks)]))
+            position += len(chunks)
+        return "".join(parts)
 
-            log(f"Processed {file_path}")
+    async def refactor_chunk(self, chunk, file_path):
+        """
+        Refactor one chunk of a file, falling back to the original text on failure.
+        Chunks that are identical up to trailing whitespace are requested once while
+        in flight or among the last DEDUP_RESULTS results: the first one does the
+        work and every copy in other files awaits its result.
+        :param chunk: The Chunk to refactor.
+        :param file_path: Path of the file the chunk belongs to, used for logging.
+        :return: The refactored text, or the original text if every attempt failed.
+        """
+        dedup_key = normalized_chunk_hash(chunk.text)
+        shared = self.chunk_results.get(dedup_key)
+        if shared is not None:
+            self.metrics.deduplicated_chunks.inc()
+            self.chunk_results.move_to_end(dedup_key)
+        else:
+            # A task of its own, so no single file owns the request that its copies await
+            shared = self.chunk_results[dedup_key] = asyncio.create_task(self.refactor_shared_chunk(chunk, file_path))
+            shared.add_done_callback(lambda task: self.forget_old_chunk_results())
+        # Shielded so that cancelling one copy does not cancel the shared request
+        refactored_chunk = await asyncio.shield(shared)
+
+        self.progress.post(CHUNK_DONE, chunks=1)
+        if refactored_chunk is None:
+            log(f"Failed to refactor chunk in {file_path}, keeping the original code", "WARNING")
+            self.incomplete_files.add(file_path)
+            return chunk.text
+        return refactored_chunk
+
+    def forget_old_chunk_results(self):
+        """Drop the least recently used finished results beyond DEDUP_RESULTS; requests in flight stay shared."""
+        excess = len(self.chunk_results) - DEDUP_RESULTS
+        for dedup_key, shared in list(self.chunk_results.items()):
+            if excess <= 0:
+                break
+            if shared.done():
+                del self.chunk_results[dedup_key]
+                excess -= 1
+
+    async def refactor_shared_chunk(self, chunk, file_path):
+        """
+        Run the request every copy of a chunk awaits; errors are logged and become a failed chunk.
+        :return: The refactored text, or None if every attempt failed.
+        """
+        try:
+            return await self.refactor_unique_chunk(chunk, file_path)
         except Exception as e:
-            log(f"Error processing {file_path}: {e}")
+            log(f"Error refactoring chunk in {file_path}: {e}", "ERROR")
+            return None
+
+    async def cancel_shared_chunks(self):
+        """Cancel the shared requests no file awaits anymore once the run is over."""
+        pending = [shared for shared in self.chunk_results.values() if not shared.done()]
+        for shared in pending:
+            shared.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self.chunk_results.clear()
+
+    async def refactor_unique_chunk(self, chunk, file_path):
+        """
+        Refactor a chunk the run has not seen yet: from the journal, the cache, or the API.
+        :return: The refactored text, or None if every attempt failed.
+        """
+        cache_key = make_cache_key(REFACTOR_MODEL, REFACTOR_PROMPT, response_token_budget(chunk.text), chunk.text)
+        # Work an interrupted run already paid for
+        journaled_chunk = self.journal.get_chunk(cache_key) if self.journal else None
+        if journaled_chunk is not None:
+            return journaled_chunk
+        if self.cache:
+            cached_chunk = await self.cache.get(cache_key)
+            if cached_chunk is not None:
+                return cached_chunk
+
+        refactored_chunk = await self.request_valid_chunk(chunk, file_path)
+        if refactored_chunk is None:
+            return None
+
+        # Only validated responses are kept for later runs
+        if self.journal:
+            self.journal.record_chunk(cache_key, refactored_chunk)
+        if self.cache:
+            await self.cache.put(cache_key, refactored_chunk)
+        return refactored_chunk
 
-    def trigger_celebration(self):
-        """Trigger a celebration after refactoring is complete"""
-        refactoring_completed_callback(self.app.root)
+    async def request_valid_chunk(self, chunk, file_path):
+        """
+        Request a refactored chunk, re-requesting it while the response fails validation.
+        :return: The refactored text, or None when every attempt failed or was rejected.
+        """
+        retries = self.config.validation_retries if self.validator else 0
+        for attempt in range(retries + 1):
+            refactored_chunk = await self.gpt_refactor_code_with_retry(chunk.text, file_path=file_path)
+            if not refactored_chunk:
+                return None
+            # Remove backtick formatting from the response
+            refactored_chunk = strip_blank_lines(refactored_chunk.replace("```python", "").replace("```", ""))
+            if not self.validator:
+                return refactored_chunk
+
+            problems = await self.validator.validate(chunk.text, refactored_chunk)
+            if not problems:
+                return refactored_chunk
+            self.metrics.validation_failures.inc(label_value="chunk")
+            log(
+                f"Refactored lines {chunk.start_line}-{chunk.end_line} of {file_path} failed validation "
+                f"(attempt {attempt + 1}/{retries + 1}): {'; '.join(problems)}",
+                "WARNING",
+            )
+        return None
 
-    async def gpt_refactor_code_with_retry(self, code, retries=3, delay=2):
+    def get_backend(self):
+        """Return the LLM backend, creating it for calls made outside run_refactoring."""
+        if self.backend is None:
+            self.backend = create_backend(self.config)
+        return self.backend
+
+    def create_rate_limiter(self):
+        """Create the rate limiter from the configured quota."""
+        return RateLimiter(
+            requests_per_minute=self.config.requests_per_minute,
+            tokens_per_minute=self.config.tokens_per_minute,
+            max_concurrent_requests=self.config.max_concurrent_requests,
+        )
+
+    async def gpt_refactor_code_with_retry(self, code, retries=5, delay=2, file_path=None):
         """
-        Send the code to GPT-4 mini and get the refactored code with retry logic.
+        Send the code to GPT-4 mini through the configured backend, with retry logic.
+        When the response is cut off at the token limit, continuation requests pick up
+        where the output stopped instead of redoing the whole chunk.
         :param code: The code to be refactored.
         :param retries: Number of retry attempts in case of failure.
-        :param delay: Delay between retries.
-        :return: Refactored code.
+        :param delay: Base delay between retries.
+        :param file_path: File the code comes from, for per-file metrics.
+        :return: Refactored code, or None if the request failed or stayed truncated.
         """
-        if not openai.api_key:
-            log("OpenAI API key is not set. Aborting API call.")
+        backend = self.get_backend()
+        if backend.requires_api_key and not self.api_key:
+            log("OpenAI API key is not set. Aborting API call.", "ERROR")
             return None
 
+        messages = [
+            {"role": "system", "content": REFACTOR_PROMPT},
+            {"role": "user", "content": code}
+        ]
+        max_tokens = response_token_budget(code)
+        parts = []
+        for continuation in range(MAX_CONTINUATIONS + 1):
+            if continuation:
+                self.metrics.continuations.inc()
+            completion = await self.request_completion(messages, retries, delay, file_path, max_tokens)
+            if completion is None:
+                return None
+            parts.append(completion.text)
+            if not completion.truncated:
+                return strip_blank_lines("".join(parts))  # Extract the refactored code
+
+            # Send back everything written so far and ask for the rest
+            messages = messages[:2] + [
+                {"role": "assistant", "content": "".join(parts)},
+                {"role": "user", "content": CONTINUE_PROMPT}
+            ]
+
+        log(f"Response still truncated after {MAX_CONTINUATIONS} continuations, keeping the original code", "WARNING")
+        return None
+
+    async def request_completion(self, messages, retries, delay, file_path=None, max_tokens=MAX_RESPONSE_TOKENS):
+        """
+        Run one completion request with retries.
+        Waits are non-blocking: backoff uses jittered exponential delays and honours
+        the server's Retry-After, and every attempt goes through the shared rate limiter.
+        :return: A CompletionResult, or None if every attempt failed.
+        """
+        if self.rate_limiter is None:
+            self.rate_limiter = self.create_rate_limiter()
+        estimated_tokens = estimate_request_tokens("".join(message["content"] for message in messages[1:]), max_tokens)
+
         for attempt in range(retries):
+            wait = backoff_delay(attempt, delay)
             try:
-                prompt = (
-                    "You are an expert Python programmer. Refactor the following Python code while ensuring it adheres to the following instructions:"
-                    "1. Maintain the full functionality of the code."
-                    "2. Improve the code's efficiency, ensuring it follows PEP 8 standards."
-                    "3. Do **not** remove or replace any non-empty class or function bodies with 'pass'. Ensure that all classes and functions contain meaningful, functional code."
-                    "4. Preserve all existing docstrings. Add missing docstrings where necessary, and update them if needed to reflect the current behavior of the code."
-                    "5. Refactor the entire code file, identifying areas where optimizations can be made."
-                    "6. Implement optimizations based on your findings, ensuring that no errors are introduced during the refactoring process."
-                    "7. Proofread the code for potential errors or issues that might arise after refactoring."
-                    "8. Lastly, ensure the code is clean, readable, and aesthetically pleasing according to Python best practices."
-
-                    "Additionally, if the code is lengthy or exceeds token limits, split it into smaller chunks, process those chunks individually, and recombine them after refactoring."
-
-                    "Provide only the refactored code, without any comments or explanations unless they are part of docstrings."
-                )
-                response = await openai.ChatCompletion.acreate(
-                    model="gpt-4o-mini",  # Use GPT-4o mini
-                    messages=[
-                        {"role": "system", "content": prompt},
-                        {"role": "user", "content": code}
-                    ],
-                    max_tokens=1500  # Set a lower token limit if needed
-                )
-                return response['choices'][0]['message']['content'].strip()  # Extract the refactored code
-            except Exception as e:
-                log(f"OpenAI API error (attempt {attempt+1}/{retries}): {e}")
-                if attempt < retries - 1:
-                    time.sleep(delay ** (attempt + 1))  # Exponential backoff
+                await self.rate_limiter.acquire(estimated_tokens)
+                async with self.rate_limiter.concurrency:
+                    with self.metrics.api_seconds.time():
+                        completion = await self.backend.complete(messages, REFACTOR_MODEL, max_tokens)
+                self.rate_limiter.on_success()
+                self.metrics.record_completion(completion, file_path)
+                self.progress.post(TOKENS_USED, tokens=completion.prompt_tokens + completion.completion_tokens)
+                return completion
+            except RateLimitError as e:
+                self.metrics.api_errors.inc(label_value="rate_limited")
+                self.rate_limiter.on_rate_limited(e.retry_after)
+                if e.retry_after is not None:
+                    wait = e.retry_after
+                log(f"OpenAI rate limit hit (attempt {attempt+1}/{retries}): {e}", "WARNING")
+            except TransportError as e:
+                if not e.retryable:
+                    # Retrying will not fix bad keys or bad requests
+                    self.metrics.api_errors.inc(label_value="fatal")
+                    log(f"OpenAI API error: {e}", "ERROR")
+                    return None
+                if e.retry_after is not None:
+                    wait = e.retry_after
+                self.metrics.api_errors.inc(label_value="transient")
+                log(f"OpenAI API error (attempt {attempt+1}/{retries}): {e}", "WARNING")
+            if attempt < retries - 1:
+                self.metrics.api_retries.inc()
+                if file_path is not None:
+                    self.metrics.file(file_path).retries += 1
+                await asyncio.sleep(wait)
         return None
+
+
+async def run_refactor_async(config, progress=None, backend=None):
+    """
+    Library entry point for callers that already run an event loop.
+    :param config: A RefactorConfig.
+    :param progress: Optional ProgressChannel that receives progress events.
+    :param backend: Optional LLMBackend, overriding the one selected in the config.
+    :return: A RefactorResult.
+    """
+    config.validate()
+    return await RefactorHandler(config, progress, backend).run_refactoring()
+
+
+def run_refactor(config, progress=None, backend=None):
+    """
+    Library entry point: refactor `config.input_path` into `config.output_path`.
+    :param config: A RefactorConfig.
+    :param progress: Optional ProgressChannel that receives progress events.
+    :param backend: Optional LLMBackend, overriding the one selected in the config.
+    :return: A RefactorResult.
+    """
+    return asyncio.run(run_refactor_async(config, progress, backend))
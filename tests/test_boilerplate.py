@@ -0,0 +1,65 @@
+import ast
+
+from boilerplate import BoilerplateDetector
+
+CODE = '''import os
+
+
+@cached
+def load(path):
+    data = open(path).read()
+    # refactor: off
+    data = data.replace("\\r",  "")
+    # refactor: on
+    return data
+
+
+# refactor: off
+KEEP = [1,  2]
+# refactor: on
+x = 3
+'''
+
+
+def test_marked_block_inside_a_function_keeps_the_function_whole():
+    segments = BoilerplateDetector().split(CODE)
+
+    assert "".join(segment.text for segment in segments) == CODE
+    assert [segment.invariant for segment in segments] == [False, True, False, True, False]
+    assert segments[1].text.startswith("@cached\ndef load(path):")
+    assert segments[1].text.endswith("    return data\n")
+    assert segments[3].text == "# refactor: off\nKEEP = [1,  2]\n# refactor: on\n"
+    for segment in segments:
+        if not segment.invariant:
+            ast.parse(segment.text)
+
+
+def test_markers_count_only_as_whole_line_comments():
+    code = 'HELP = "# refactor: off"\ny = 1  # refactor: off\nz = 2\n# refactor: off\nKEEP = [1,  2]\n# refactor: on\n'
+    segments = BoilerplateDetector().split(code)
+
+    assert [(segment.invariant, segment.text) for segment in segments] == [
+        (False, 'HELP = "# refactor: off"\ny = 1  # refactor: off\nz = 2\n'),
+        (True, "# refactor: off\nKEEP = [1,  2]\n# refactor: on\n"),
+    ]
+
+
+def test_unterminated_block_is_ignored():
+    code = "# refactor: off\nx = 1\n\n\ndef f():\n    return 2\n"
+    segments = BoilerplateDetector().split(code)
+
+    assert [(segment.invariant, segment.text) for segment in segments] == [(False, code)]
+
+
+def test_open_block_is_carried_into_the_next_section():
+    detector = BoilerplateDetector()
+    segments, rest = detector.split_section("a = 1\n\ndef f():\n    # refactor: off\n    return [1,  2]\n", final=False)
+    assert [segment.text for segment in segments] == ["a = 1\n\n"]
+    assert rest == "def f():\n    # refactor: off\n    return [1,  2]\n"
+
+    segments, rest = detector.split_section(rest + "# refactor: on\nb = 2\n", at_start=False, final=False)
+    assert [(segment.invariant, segment.text) for segment in segments] == [
+        (True, "def f():\n    # refactor: off\n    return [1,  2]\n# refactor: on\n"),
+        (False, "b = 2\n"),
+    ]
+    assert rest == ""
@@ -0,0 +1,62 @@
+import asyncio
+
+from cache import ResponseCache, make_cache_key
+from config import RefactorConfig
+from refactor import RefactorHandler
+from transport import MockBackend
+
+
+def test_lookups_count_hits_and_misses(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+
+    async def main():
+        await cache.put("a", "refactored a")
+        return await cache.get("a"), await cache.get("b")
+
+    assert asyncio.run(main()) == ("refactored a", None)
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+    # Entries outlive the process; a bypassed cache neither reads nor writes
+    bypassed = ResponseCache(str(tmp_path / "cache.sqlite3"), enabled=False)
+    assert asyncio.run(bypassed.get("a")) is None
+    assert ResponseCache(str(tmp_path / "cache.sqlite3")).get_sync("a") == "refactored a"
+
+
+def test_keys_change_with_everything_that_shapes_the_answer():
+    key = make_cache_key("model", "prompt", 100, "code")
+    assert key == make_cache_key("model", "prompt", 100, "code")
+    assert len({key, make_cache_key("model-2", "prompt", 100, "code"), make_cache_key("model", "prompt 2", 100, "code"),
+                make_cache_key("model", "prompt", 200, "code"), make_cache_key("model", "prompt", 100, "code ")}) == 5
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr("cache.time.time", lambda: next(clock))
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), max_bytes=250)
+    cache.put_sync("a", "a" * 100)
+    cache.put_sync("b", "b" * 100)
+    cache.get_sync("a")
+    cache.put_sync("c", "c" * 100)
+
+    assert [cache.contains_sync(name) for name in "abc"] == [True, False, True]
+    cache.close()
+
+
+def test_runs_hit_the_cache_until_the_prompt_changes(tmp_path, monkeypatch):
+    (tmp_path / "input").mkdir()
+    (tmp_path / "input" / "module.py").write_text("".join(f"def f{i}(a=[]):\n    return a\n\n\n" for i in range(20)))
+
+    def run():
+        config = RefactorConfig(str(tmp_path / "input"), str(tmp_path / "output"), backend="mock",
+                                cache_path=str(tmp_path / "cache.sqlite3"), skip_unchanged=False, triage=False,
+                                resume=False, create_output_folder=True, write_metrics=False)
+        backend = MockBackend()
+        result = asyncio.run(RefactorHandler(config, backend=backend).run_refactoring())
+        return result.cache_hits, result.cache_misses, backend.calls
+
+    first = run()
+    assert first[0] == 0 and first[1] == first[2] > 0
+    assert run() == (first[1], 0, 0)
+    monkeypatch.setattr("refactor.REFACTOR_PROMPT", "A different prompt")
+    assert run() == first
@@ -0,0 +1,62 @@
+import ast
+import io
+
+import pytest
+
+from chunker import iter_sections, join_chunks, split_code_into_chunks
+
+
+def test_sections_never_cut_between_decorator_and_definition():
+    source = "app = object()\n\n" + "".join(
+        f"@app.route('/r{i}')\n@login_required\ndef r{i}(x=1):\n    return 'x' * {i}\n\n" for i in range(500)
+    )
+    sections = list(iter_sections(io.StringIO(source).readline, max_tokens=50))
+
+    assert len(sections) > 1
+    assert "".join(sections) == source
+    for section in sections:
+        ast.parse(section)
+
+
+def big_class(methods):
+    members = []
+    for i in range(methods):
+        comment = f"    # Method {i} comes with a comment\n" if i % 2 else ""
+        members.append(f"{comment}    def method_{i}(self, value):\n        return value * {i}\n")
+    return "class Big:\n    \"\"\"A class too large for one chunk.\"\"\"\n\n" + "\n".join(members)
+
+
+ROUND_TRIP_SOURCES = {
+    "leading and trailing blank lines": "\n\nimport os\n\n\ndef f():\n    return os.sep\n\n\n",
+    "split class with comment-led methods": "import os\n\n\n" + big_class(60) + "\n\nx = 1\n",
+    "does not parse": "".join(f"    indented_{i} = (\n\n" for i in range(300)),
+}
+
+
+@pytest.mark.parametrize("source", ROUND_TRIP_SOURCES.values(), ids=ROUND_TRIP_SOURCES.keys())
+def test_identity_round_trip(source):
+    chunks = split_code_into_chunks(source, max_tokens=200)
+
+    assert join_chunks(chunks, [chunk.text for chunk in chunks]) == source
+
+
+def test_split_class_members_are_dedented_and_put_back():
+    source = big_class(60)
+    chunks = split_code_into_chunks(source, max_tokens=200)
+
+    dedented = [chunk for chunk in chunks if chunk.indent]
+    assert dedented and all(not chunk.text.startswith(" ") for chunk in dedented)
+    assert any(chunk.text.startswith("# Method") for chunk in dedented)
+    assert join_chunks(chunks, [chunk.text for chunk in chunks]) == source
+
+
+def test_chunks_stay_within_the_budget_and_parse():
+    source = "".join(f"def f{i}(a, b):\n    total = a + b * {i}\n    return total\n\n\n" for i in range(100))
+    chunks = split_code_into_chunks(source, max_tokens=150)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.tokens <= 150
+        ast.parse(chunk.text)
+    # Statements are never cut, and every line belongs to exactly one chunk
+    assert [chunk.start_line for chunk in chunks[1:]] == [chunk.end_line + 1 for chunk in chunks[:-1]]
@@ -0,0 +1,42 @@
+import os
+
+from indexer import index_python_files
+
+
+def make_tree(root, paths):
+    for path in paths:
+        file = root / path
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text("x = 1\n")
+
+
+def keys(files):
+    return sorted(indexed_file.relative_path for indexed_file in files)
+
+
+def test_ignore_rules(tmp_path):
+    make_tree(tmp_path, ["a.py", "notes.txt", "pkg/build/gen.py", "pkg/build.py", "pkg/test_a.py",
+                         "pkg/sub/b.py", "__pycache__/c.py", "docs/conf.py", "lib/build/keep.py"])
+    # An existing relative entry is a path from the root; other entries are patterns
+    files = index_python_files(tmp_path, ["lib/build", "build/", "test_*.py", "pkg/sub/*", str(tmp_path / "docs")])
+
+    assert keys(files) == ["a.py", "pkg/build.py"]
+
+
+def test_relative_ignore_paths_are_taken_from_the_input_root(tmp_path, monkeypatch):
+    make_tree(tmp_path / "input", ["vendor/lib.py", "main.py"])
+    make_tree(tmp_path, ["vendor/other.py"])
+
+    for cwd in (tmp_path, tmp_path / "input", tmp_path / "input" / "vendor"):
+        monkeypatch.chdir(cwd)
+        assert keys(index_python_files(tmp_path / "input", ["vendor"])) == ["main.py"]
+        assert keys(index_python_files(tmp_path / "input", ["main.py"])) == ["vendor/lib.py"]
+
+
+def test_symlinked_files_keep_the_name_of_the_link(tmp_path):
+    make_tree(tmp_path / "input", ["real.py"])
+    make_tree(tmp_path, ["outside.py"])
+    os.symlink(tmp_path / "input" / "real.py", tmp_path / "input" / "alias.py")
+    os.symlink(tmp_path / "outside.py", tmp_path / "input" / "linked.py")
+
+    assert keys(index_python_files(tmp_path / "input")) == ["alias.py", "linked.py", "real.py"]
@@ -0,0 +1,31 @@
+from journal import RunJournal
+
+
+def test_resume_after_torn_line_keeps_new_records(tmp_path):
+    path = tmp_path / "out.refactor-journal"
+    journal = RunJournal(path, "v1").load().open()
+    journal.record_chunk("a", "A")
+    journal.record_chunk("b", "B")
+    journal.close()
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"type": "chunk", "key": "c", "te')  # Crash halfway through a line
+
+    journal = RunJournal(path, "v1").load()
+    assert sorted(journal.chunks) == ["a", "b"]
+    journal.open()
+    journal.record_chunk("d", "D")
+    journal.record_chunk("e", "E")
+    journal.close()
+
+    journal = RunJournal(path, "v1").load()
+    assert sorted(journal.chunks) == ["a", "b", "d", "e"]
+    assert journal.get_chunk("d") == "D"
+
+
+def test_other_version_is_started_afresh(tmp_path):
+    path = tmp_path / "out.refactor-journal"
+    journal = RunJournal(path, "v1").load().open()
+    journal.record_chunk("a", "A")
+    journal.close()
+
+    assert RunJournal(path, "v2").load().chunks == {}
@@ -0,0 +1,54 @@
+import os
+
+from manifest import RunManifest, manifest_path_for
+
+
+def write_pair(tmp_path, code="x = 1\n"):
+    (tmp_path / "in.py").write_text(code)
+    (tmp_path / "out.py").write_text("refactored\n")
+    return tmp_path / "in.py", tmp_path / "out.py"
+
+
+def test_recorded_files_are_current_until_they_change(tmp_path):
+    input_path, output_path = write_pair(tmp_path)
+    manifest = RunManifest(tmp_path / "manifest.json", "v1")
+    assert not manifest.is_current("in.py", input_path, output_path)
+    manifest.record("in.py", input_path, output_path)
+    assert manifest.is_current("in.py", input_path, output_path)
+
+    # Touched but unchanged inputs are recognised by their hash
+    os.utime(input_path, ns=(1, 1))
+    assert manifest.is_current("in.py", input_path, output_path)
+    input_path.write_text("x = 2\n")
+    assert not manifest.is_current("in.py", input_path, output_path)
+
+
+def test_edited_or_deleted_outputs_are_redone(tmp_path):
+    input_path, output_path = write_pair(tmp_path)
+    manifest = RunManifest(tmp_path / "manifest.json", "v1")
+    manifest.record("in.py", input_path, output_path)
+
+    output_path.write_text("edited by hand\n")
+    assert not manifest.is_current("in.py", input_path, output_path)
+    output_path.unlink()
+    assert not manifest.is_current("in.py", input_path, output_path)
+
+
+def test_saved_entries_only_count_for_the_same_version(tmp_path):
+    input_path, output_path = write_pair(tmp_path)
+    manifest = RunManifest(tmp_path / "manifest.json", "v1")
+    manifest.record("in.py", input_path, output_path)
+    manifest.save()
+
+    assert RunManifest(tmp_path / "manifest.json", "v1").load().is_current("in.py", input_path, output_path)
+    assert not RunManifest(tmp_path / "manifest.json", "v2").load().is_current("in.py", input_path, output_path)
+
+
+def test_unreadable_manifests_mean_a_full_run(tmp_path):
+    (tmp_path / "manifest.json").write_text("{not json")
+    assert RunManifest(tmp_path / "manifest.json", "v1").load().entries == {}
+    assert RunManifest(tmp_path / "missing.json", "v1").load().entries == {}
+
+
+def test_manifest_lives_next_to_the_output(tmp_path):
+    assert manifest_path_for(tmp_path / "output") == tmp_path / "output.refactor-manifest.json"
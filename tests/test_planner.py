@@ -0,0 +1,57 @@
+import asyncio
+import os
+
+from cache import ResponseCache
+from config import RefactorConfig
+from planner import RunPlanner
+from refactor import RefactorHandler
+from transport import MockBackend
+
+MODULE = "".join(
+    f"def function_{i}(value):\n    # Step {i}\n    if value > {i}:\n        return value - {i}\n    return {i}\n\n\n"
+    for i in range(400)
+)
+
+
+def make_config(tmp_path, **settings):
+    settings.setdefault("triage", False)
+    return RefactorConfig(str(tmp_path / "input"), str(tmp_path / "output"), backend="mock",
+                          cache_path=str(tmp_path / "cache.sqlite3"), create_output_folder=True,
+                          write_metrics=False, **settings)
+
+
+def test_plan_chunks_large_files_as_the_run_streams_them(tmp_path):
+    (tmp_path / "input").mkdir()
+    (tmp_path / "input" / "large.py").write_text(MODULE)
+    config = make_config(tmp_path, use_cache=False, large_file_bytes=1024)
+
+    plan = asyncio.run(RunPlanner(config).plan())
+    result = asyncio.run(RefactorHandler(config, backend=MockBackend()).run_refactoring())
+
+    assert plan.chunks == result.chunks
+
+
+def test_plan_reads_the_cache_without_writing_to_it(tmp_path):
+    (tmp_path / "input").mkdir()
+    (tmp_path / "input" / "module.py").write_text(MODULE)
+    config = make_config(tmp_path)
+    # No cache yet, or an empty file, counts as an empty cache
+    assert asyncio.run(RunPlanner(config).plan()).cached_chunks == 0
+    assert not os.path.exists(config.cache_path)
+    open(config.cache_path, "w").close()
+    assert asyncio.run(RunPlanner(config).plan()).cached_chunks == 0
+    assert os.path.getsize(config.cache_path) == 0
+    os.remove(config.cache_path)
+
+    asyncio.run(RefactorHandler(config, backend=MockBackend()).run_refactoring())
+    written = os.stat(config.cache_path).st_mtime_ns
+    os.remove(tmp_path / "output.refactor-manifest.json")
+
+    plan = asyncio.run(RunPlanner(config).plan())
+
+    assert plan.cached_chunks == plan.chunks > 0
+    assert plan.requests == 0
+    assert os.stat(config.cache_path).st_mtime_ns == written
+    cache = ResponseCache(config.cache_path)
+    assert cache.open().execute("SELECT COUNT(*) FROM responses").fetchone()[0] == plan.chunks
+    cache.close()
@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from ratelimit import AdaptiveConcurrencyLimiter, TokenBucket, parse_retry_after
+
+
+def test_token_bucket_waits_for_the_refill(monkeypatch):
+    clock = [100.0]
+    sleeps = []
+    monkeypatch.setattr("ratelimit.time.monotonic", lambda: clock[0])
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+        clock[0] += seconds
+
+    async def main():
+        monkeypatch.setattr("ratelimit.asyncio.sleep", fake_sleep)
+        bucket = TokenBucket(60)
+        await bucket.acquire(50)
+        await bucket.acquire(20)
+        # Larger than the bucket: clamped, so it still goes through once the bucket is full
+        await bucket.acquire(1000)
+        return bucket.tokens
+
+    assert asyncio.run(main()) == pytest.approx(0)
+    assert sleeps == [pytest.approx(10), pytest.approx(60)]
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after-ms": "1500"}, 1.5),
+    ({"Retry-After": "7"}, 7.0),
+    ({"Retry-After": "soon"}, None),
+    ({}, None),
+    (None, None),
+])
+def test_parse_retry_after(headers, expected):
+    assert parse_retry_after(headers) == expected
+
+
+def test_parse_retry_after_as_a_date():
+    later = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < parse_retry_after({"Retry-After": format_datetime(later, usegmt=True)}) <= 30
+
+
+def test_concurrency_halves_once_per_cooldown_and_grows_back(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr("ratelimit.time.monotonic", lambda: clock[0])
+    limiter = AdaptiveConcurrencyLimiter(8, cooldown=5.0)
+    limiter.wake_waiters = lambda: None
+
+    clock[0] = 10.0
+    limiter.on_rate_limited()
+    limiter.on_rate_limited()
+    assert limiter.limit == 4
+    clock[0] = 20.0
+    limiter.on_rate_limited()
+    assert limiter.limit == 2
+
+    for _ in range(2):
+        limiter.on_success()
+    assert limiter.limit == 3
@@ -0,0 +1,139 @@
+import asyncio
+import os
+
+from chunker import Chunk
+from config import RefactorConfig
+from refactor import RefactorHandler
+from transport import MockBackend
+from triage import Triage
+
+
+def run(input_path, output_path, backend=None, **settings):
+    settings.setdefault("triage", False)
+    config = RefactorConfig(str(input_path), str(output_path), backend="mock", use_cache=False,
+                            create_output_folder=True, write_metrics=False, **settings)
+    return asyncio.run(RefactorHandler(config, backend=backend or MockBackend()).run_refactoring())
+
+
+def test_symlinked_files_are_written_under_the_name_of_the_link(tmp_path):
+    (tmp_path / "input").mkdir()
+    (tmp_path / "input" / "real.py").write_text("def real():\n    return 1\n")
+    (tmp_path / "outside.py").write_text("def outside():\n    return 2\n")
+    os.symlink(tmp_path / "input" / "real.py", tmp_path / "input" / "alias.py")
+    os.symlink(tmp_path / "outside.py", tmp_path / "input" / "linked.py")
+
+    result = run(tmp_path / "input", tmp_path / "output")
+
+    assert (result.files_processed, result.files_failed) == (3, 0)
+    output = tmp_path / "output"
+    assert sorted(os.listdir(output)) == ["alias.py", "linked.py", "real.py"]
+    assert (output / "linked.py").read_text() == "def outside():\n    return 2\n"
+    assert (output / "alias.py").read_text() == (output / "real.py").read_text()
+
+
+def test_identity_backend_reproduces_files_byte_for_byte(tmp_path):
+    methods = "".join(
+        (f"    # Comment before method {i}\n" if i % 2 else "") + f"    def method_{i}(self):\n        return {i}\n\n"
+        for i in range(150)
+    )
+    sources = {
+        "blank_lines.py": "\n\nimport os\n\n\ndef f():\n    return os.sep\n\n\n",
+        "big_class.py": "import os\n\n\nclass Big:\n    \"\"\"Too large for one chunk.\"\"\"\n\n" + methods + "\nx = 1\n",
+        "broken.py": "".join(f"    indented_{i} = (\n\n" for i in range(400)),
+    }
+    (tmp_path / "input").mkdir()
+    for name, source in sources.items():
+        (tmp_path / "input" / name).write_text(source)
+    # Fenced responses with blank lines around them, as models often send
+    backend = MockBackend(transform=lambda code: "```python\n\n" + code + "\n```\n")
+
+    for large_file_bytes in (0, 1):
+        output = tmp_path / f"output-{large_file_bytes}"
+        result = run(tmp_path / "input", output, backend, large_file_bytes=large_file_bytes)
+
+        assert result.files_processed == 3
+        for name, source in sources.items():
+            assert (output / name).read_text() == source, (name, large_file_bytes)
+
+
+def test_blank_lines_around_marked_blocks_are_kept(tmp_path):
+    source = (
+        "# Copyright 2024 Example\n\n\n"
+        "import os\n\n\n"
+        "# refactor: off\nKEEP = [1,  2]\n# refactor: on\n\n\n"
+        "# refactor: off\nALSO = {'a':1}\n# refactor: on\n\n\n"
+        "def f():\n    return os.sep\n\n"
+    )
+    (tmp_path / "input").mkdir()
+    (tmp_path / "input" / "marked.py").write_text(source)
+
+    for large_file_bytes in (0, 1):
+        output = tmp_path / f"output-{large_file_bytes}"
+        run(tmp_path / "input", output, MockBackend(transform=str.strip), large_file_bytes=large_file_bytes)
+
+        assert (output / "marked.py").read_text() == source, large_file_bytes
+
+
+def test_cancelling_one_copy_of_a_chunk_does_not_fail_the_others(tmp_path):
+    config = RefactorConfig(str(tmp_path / "input"), str(tmp_path / "output"), backend="mock")
+    handler = RefactorHandler(config, backend=MockBackend())
+    requests = []
+
+    async def slow_request(chunk, file_path):
+        requests.append(file_path)
+        await asyncio.sleep(0.05)
+        return "refactored"
+
+    handler.refactor_unique_chunk = slow_request
+    chunk = Chunk("x = 1\n", 1, 1, 4)
+
+    async def main():
+        owner = asyncio.create_task(handler.refactor_chunk(chunk, "a.py"))
+        copy = asyncio.create_task(handler.refactor_chunk(chunk, "b.py"))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        result = await copy
+        await handler.cancel_shared_chunks()
+        return owner.cancelled(), result
+
+    assert asyncio.run(main()) == (True, "refactored")
+    assert requests == ["a.py"]
+    assert handler.incomplete_files == set()
+
+
+# Mutable defaults keep the triage pass from calling the file clean
+NEEDS_WORK = "".join(f"def f{i}(a=[]):\n    if a:\n        return {i}\n\n\n" for i in range(20))
+
+
+def test_unchanged_files_are_not_triaged_again(tmp_path, monkeypatch):
+    (tmp_path / "input").mkdir()
+    (tmp_path / "input" / "tiny.py").write_text("x = 1\n")
+    (tmp_path / "input" / "big.py").write_text(NEEDS_WORK)
+    first = run(tmp_path / "input", tmp_path / "output", triage=True)
+    assert (first.files_processed, first.files_triaged) == (1, 1)
+
+    triaged = []
+    triage = Triage.triage
+
+    async def recording_triage(self, paths):
+        paths = list(paths)
+        triaged.extend(os.path.basename(path) for path in paths)
+        return await triage(self, paths)
+
+    monkeypatch.setattr(Triage, "triage", recording_triage)
+    second = run(tmp_path / "input", tmp_path / "output", triage=True)
+
+    assert (second.files_skipped, second.files_triaged) == (1, 1)
+    assert triaged == ["tiny.py"]
+
+
+def test_failed_copies_are_not_counted_as_refactored(tmp_path):
+    (tmp_path / "input").mkdir()
+    (tmp_path / "input" / "tiny.py").write_text("x = 1\n")
+    (tmp_path / "input" / "big.py").write_text(NEEDS_WORK)
+    # A folder in the way of the copy's output
+    (tmp_path / "output" / "tiny.py").mkdir(parents=True)
+
+    result = run(tmp_path / "input", tmp_path / "output", triage=True)
+
+    assert (result.files_processed, result.files_triaged, result.files_failed) == (1, 0, 1)
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from transport import OpenAIHTTPBackend, TransportError
+
+
+def complete_against(handler, stream):
+    """Run one completion against a local server answering with `handler`."""
+    async def run():
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        backend = OpenAIHTTPBackend("", base_url=f"http://127.0.0.1:{port}/v1", stream=stream)
+        try:
+            return await backend.complete([{"role": "user", "content": "x = 1"}], "model", 100)
+        finally:
+            await backend.close()
+            await runner.cleanup()
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("body", ['{"choices": [{"message": {"content": "x', '{"choices": []}', '{"error": "?"}'])
+def test_malformed_body_is_a_retryable_transport_error(body):
+    async def handler(request):
+        return web.Response(text=body, content_type="application/json")
+
+    with pytest.raises(TransportError) as error:
+        complete_against(handler, stream=False)
+    assert error.value.retryable
+
+
+def test_malformed_stream_event_is_a_retryable_transport_error():
+    async def handler(request):
+        return web.Response(text='data: {"choi\n\n', content_type="text/event-stream")
+
+    with pytest.raises(TransportError) as error:
+        complete_against(handler, stream=True)
+    assert error.value.retryable
+
+
+def test_streamed_request_asks_for_usage():
+    async def handler(request):
+        payload = await request.json()
+        assert payload["stream_options"] == {"include_usage": True}
+        return web.Response(
+            text='data: {"choices": [{"delta": {"content": "y = 2"}, "finish_reason": "stop"}]}\n\n'
+                 'data: {"choices": [], "usage": {"prompt_tokens": 7, "completion_tokens": 3}}\n\n'
+                 'data: [DONE]\n\n',
+            content_type="text/event-stream",
+        )
+
+    result = complete_against(handler, stream=True)
+    assert (result.text, result.prompt_tokens, result.completion_tokens) == ("y = 2", 7, 3)
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from triage import GENERATED, TINY, Triage, analyze_file
+
+BODY = "".join(f"def function_{i}(value):\n    if value:\n        return {i}\n    return None\n\n\n" for i in range(5))
+
+GENERATED_SOURCES = {
+    "banner.py": "# This file is generated by mkstringprep.py. DO NOT EDIT.\n" + BODY,
+    "marker.py": "#!/usr/bin/env python\n# @generated\n\n" + BODY,
+    "docstring.py": '"""Code generated by protoc-gen-foo. DO NOT EDIT."""\n' + BODY,
+    "messages_pb2.py": BODY,
+}
+
+HANDWRITTEN_SOURCES = {
+    # The docstring of the stdlib's ast.py
+    "ast_like.py": '"""\n    ast\n    ~~~\n\n    An abstract syntax tree can be generated by passing `ast.PyCF_ONLY_AST`\n    as a flag to the `compile()` builtin function.\n"""\n' + BODY,
+    # A comment further down, as in stack_data/__init__.py
+    "indented_comment.py": "import os\n\ntry:\n    # version.py is auto-generated by setup.py\n    from version import version\nexcept ImportError:\n    version = None\n" + BODY,
+    "string.py": 'HEADER = "# Auto-generated by the exporter. Do not edit."\n' + BODY,
+    "wrapped_comment.py": "# Maps old names so that pickles\n# generated with Python 2 still load.\n" + BODY,
+}
+
+
+@pytest.mark.parametrize("name", sorted(GENERATED_SOURCES))
+def test_generated_banners_are_recognised(tmp_path, name):
+    path = tmp_path / name
+    path.write_text(GENERATED_SOURCES[name])
+    assert analyze_file(str(path)).generated
+
+
+@pytest.mark.parametrize("name", sorted(HANDWRITTEN_SOURCES))
+def test_mentions_of_generated_code_are_not_banners(tmp_path, name):
+    path = tmp_path / name
+    path.write_text(HANDWRITTEN_SOURCES[name])
+    report = analyze_file(str(path))
+    assert not report.generated
+    assert Triage().skip_reason(report) != GENERATED
+
+
+def test_triage_reports_skipped_files_only(tmp_path):
+    (tmp_path / "tiny.py").write_text("x = 1\n")
+    (tmp_path / "generated.py").write_text(GENERATED_SOURCES["banner.py"])
+    (tmp_path / "broken.py").write_text("def broken(:\n")
+    (tmp_path / "complex.py").write_text(BODY * 3 + "import os\n")
+    paths = [str(tmp_path / name) for name in ("tiny.py", "generated.py", "broken.py", "complex.py")]
+
+    skipped = asyncio.run(Triage(max_workers=1).triage(paths))
+
+    assert skipped == {paths[0]: TINY, paths[1]: GENERATED}
+
+
+def test_an_open_triage_shares_one_pool_across_calls(tmp_path):
+    (tmp_path / "tiny.py").write_text("x = 1\n")
+    (tmp_path / "generated.py").write_text(GENERATED_SOURCES["banner.py"])
+    triage = Triage(max_workers=1).open()
+    pool = triage.pool
+
+    async def triage_twice():
+        first = await triage.triage([str(tmp_path / "tiny.py")])
+        second = await triage.triage([str(tmp_path / "generated.py")])
+        return first, second
+
+    try:
+        first, second = asyncio.run(triage_twice())
+        assert first == {str(tmp_path / "tiny.py"): TINY}
+        assert second == {str(tmp_path / "generated.py"): GENERATED}
+        assert triage.pool is pool
+    finally:
+        triage.close()
+    assert triage.pool is None
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from config import RefactorConfig
+from refactor import RefactorHandler
+from transport import MockBackend
+from validation import Validator, validate_code
+
+ORIGINAL = '''
+class Store:
+    def get(self, key, default=None):
+        value = self.items.get(key)
+        if value is None:
+            return default
+        return value
+
+
+def helper(a, *args, flag=False):
+    return [a, *args] if flag else a
+'''
+
+
+@pytest.mark.parametrize("refactored, problem", [
+    (ORIGINAL.replace("def helper(a, *args, flag=False)", "def helper(a, *rest, flag=False)"), "signature of helper changed"),
+    (ORIGINAL.replace("def helper", "def other_helper"), "helper is missing"),
+    (ORIGINAL.replace("    def get", "    def fetch"), "Store.get is missing"),
+    (ORIGINAL.replace("        value = self.items.get(key)\n        if value is None:\n            return default\n        return value\n",
+                      "        ...\n"), "body of Store.get was replaced with a placeholder"),
+    (ORIGINAL.replace("return default", "return default)"), "does not compile"),
+    ("  \n", "response is empty"),
+])
+def test_broken_responses_are_caught(refactored, problem):
+    problems = validate_code(ORIGINAL, refactored)
+    assert any(found.startswith(problem) for found in problems), problems
+
+
+def test_acceptable_responses_pass():
+    commented = ORIGINAL.replace("        value = ", "        # Missing keys give the default\n        value = ")
+    refactored = '"""Storage helpers."""\n' + commented
+    assert validate_code(ORIGINAL, refactored + "\n\ndef added():\n    pass\n") == []
+    # Slices that do not parse on their own cannot be judged
+    assert validate_code("    return value\n", "anything") == []
+
+
+def test_validator_runs_in_a_process_pool():
+    validator = Validator(max_workers=1)
+    try:
+        problems = asyncio.run(validator.validate(ORIGINAL, ORIGINAL.replace("def helper", "def renamed")))
+    finally:
+        validator.close()
+    assert problems == ["helper is missing"]
+
+
+def test_only_the_broken_chunk_is_requested_again(tmp_path):
+    (tmp_path / "input").mkdir()
+    source = "".join(f"def f{i}(a=[]):\n    return a + [{i}]\n\n\n" for i in range(200))
+    (tmp_path / "input" / "module.py").write_text(source)
+    broken = []
+
+    def break_first_response(code):
+        if not broken:
+            broken.append(code)
+            return code.replace("def f", "def g", 1)
+        return code
+
+    backend = MockBackend(transform=break_first_response)
+    config = RefactorConfig(str(tmp_path / "input"), str(tmp_path / "output"), backend="mock", use_cache=False,
+                            triage=False, create_output_folder=True, write_metrics=False)
+    result = asyncio.run(RefactorHandler(config, backend=backend).run_refactoring())
+
+    assert result.chunks > 1
+    assert backend.calls == result.chunks + 1
+    assert (tmp_path / "output" / "module.py").read_text() == source
@@ -0,0 +1,114 @@
+import asyncio
+
+from workqueue import COPIED, DONE, FAILED, LEASED, PENDING, SharedTokenBucket, WorkQueue
+
+
+def test_take_tokens_refills_at_the_shared_rate(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("workqueue.time.time", lambda: clock[0])
+    queue = WorkQueue(tmp_path / "queue.sqlite3")
+
+    assert queue.take_tokens("requests", 50, 60) == (50, 0.0)
+    assert queue.take_tokens("requests", 20, 60) == (0, 10.0)
+    clock[0] += 10
+    assert queue.take_tokens("requests", 20, 60) == (20, 0.0)
+    # Extra tokens are only handed out as far as the bucket has them
+    clock[0] += 30
+    assert queue.take_tokens("requests", 10, 60, extra=100) == (30, 0.0)
+    queue.close()
+
+
+def test_shared_bucket_takes_tokens_in_batches(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite3")
+    calls = []
+    take_tokens = queue.take_tokens
+    queue.take_tokens = lambda *args: calls.append(args) or take_tokens(*args)
+    bucket = SharedTokenBucket(queue, "requests", 600)
+
+    async def acquire_all():
+        for _ in range(100):
+            await bucket.acquire(1)
+
+    asyncio.run(acquire_all())
+
+    # 50 requests' worth of quota per batch at 600 a minute
+    assert len(calls) == 2
+    assert queue.open().execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    queue.close()
+
+
+def test_manifest_entries_are_kept_from_the_ack(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite3")
+    files = [("a.py", "in/a.py", 10), ("b.py", "in/b.py", 5), ("c.py", "in/c.py", 1)]
+    queue.populate({}, files)
+    queue.claim("worker")
+    queue.ack("a.py", "worker", DONE, {"sha256": "a", "version": "v1"})
+    queue.ack("b.py", "worker", COPIED)
+    assert queue.manifest_entries() == {"a.py": {"sha256": "a", "version": "v1"}}
+
+    # Resuming the unfinished run keeps the entries of the files it keeps
+    queue.populate({}, files, keep_done=True)
+    assert queue.manifest_entries() == {"a.py": {"sha256": "a", "version": "v1"}}
+    queue.close()
+
+
+def make_queue(tmp_path, monkeypatch, clock):
+    monkeypatch.setattr("workqueue.time.time", lambda: clock[0])
+    queue = WorkQueue(tmp_path / "queue.sqlite3")
+    queue.populate({"model": "m"}, [("small.py", "in/small.py", 1), ("large.py", "in/large.py", 100)])
+    return queue
+
+
+def test_expired_leases_are_taken_over(tmp_path, monkeypatch):
+    clock = [1000.0]
+    queue = make_queue(tmp_path, monkeypatch, clock)
+    assert queue.settings() == {"model": "m"}
+
+    # Largest first
+    assert queue.claim("dead", count=1, lease_seconds=10) == [("large.py", "in/large.py", 100)]
+    assert queue.claim("alive", count=5, lease_seconds=10) == [("small.py", "in/small.py", 1)]
+    assert queue.claim("alive", lease_seconds=10) == []
+    assert queue.has_work("alive")
+
+    # The heartbeat keeps a live worker's lease
+    clock[0] += 8
+    queue.renew("alive", lease_seconds=10)
+    clock[0] += 8
+    assert queue.claim("alive", lease_seconds=10) == [("large.py", "in/large.py", 100)]
+    queue.close()
+
+
+def test_ack_after_a_takeover_is_ignored(tmp_path, monkeypatch):
+    clock = [1000.0]
+    queue = make_queue(tmp_path, monkeypatch, clock)
+    queue.claim("slow", count=2, lease_seconds=10)
+    clock[0] += 11
+    queue.claim("fast", count=1, lease_seconds=10)
+
+    queue.ack("large.py", "slow", DONE, {"sha256": "stale"})
+    assert queue.counts()[LEASED][0] == 2
+    queue.ack("large.py", "fast", DONE, {"sha256": "fresh"})
+    # The slow worker's lease on the other file expired but was not taken yet, so its ack still counts
+    queue.ack("small.py", "slow", COPIED)
+
+    counts = queue.counts()
+    assert (counts[DONE], counts[COPIED], counts[LEASED][0]) == ((1, 100), (1, 1), 0)
+    assert queue.manifest_entries() == {"large.py": {"sha256": "fresh"}}
+    assert not queue.has_work("fast")
+    queue.close()
+
+
+def test_files_fail_after_their_last_attempt_and_release_hands_back(tmp_path, monkeypatch):
+    clock = [1000.0]
+    queue = make_queue(tmp_path, monkeypatch, clock)
+    for _ in range(2):
+        queue.claim("crashing", count=1, lease_seconds=10, max_attempts=2)
+        clock[0] += 11
+    # Two attempts used up: failed instead of handed out again
+    assert queue.claim("next", count=1, lease_seconds=10, max_attempts=2) == [("small.py", "in/small.py", 1)]
+    assert queue.counts()[FAILED][0] == 1
+
+    queue.release("next")
+    assert queue.counts()[PENDING][0] == 1
+    assert queue.claim("other", count=1, lease_seconds=10, max_attempts=2) == [("small.py", "in/small.py", 1)]
+    queue.close()
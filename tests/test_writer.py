@@ -0,0 +1,20 @@
+import os
+import stat
+
+from writer import NEW_FILE_MODE, StreamedOutput, write_atomic
+
+
+def test_atomic_write_gets_a_normal_file_mode(tmp_path):
+    path = tmp_path / "out" / "module.py"
+    write_atomic(path, "x = 1\n")
+
+    assert path.read_text() == "x = 1\n"
+    assert stat.S_IMODE(os.stat(path).st_mode) == NEW_FILE_MODE
+
+
+def test_streamed_output_gets_a_normal_file_mode(tmp_path):
+    output = StreamedOutput(tmp_path, "module.py")
+    output.write("x = 1\n")
+    output.close()
+
+    assert stat.S_IMODE(os.stat(output.path).st_mode) == NEW_FILE_MODE
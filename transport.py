@@ -0,0 +1,267 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import json
+import time
+from ratelimit import parse_retry_after
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_REQUEST_TIMEOUT = 120
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_KEEPALIVE_TIMEOUT = 60
+
+
+class CompletionResult:
+    """Text and metadata of one chat completion."""
+
+    def __init__(self, text, finish_reason="stop", prompt_tokens=0, completion_tokens=0, first_byte_latency=None):
+        self.text = text
+        self.finish_reason = finish_reason
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.first_byte_latency = first_byte_latency
+
+    @property
+    def truncated(self):
+        """True when the model stopped because it ran out of response tokens."""
+        return self.finish_reason == "length"
+
+
+class TransportError(Exception):
+    """
+    A failed completion request.
+    `retryable` tells the retry loop whether trying again can help; `retry_after`
+    carries the server's requested wait in seconds, if it sent one.
+    """
+
+    def __init__(self, message, status=None, retryable=True, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class RateLimitError(TransportError):
+    """The server answered 429 Too Many Requests."""
+
+
+class LLMBackend:
+    """Interface for anything that can answer chat completion requests."""
+
+    requires_api_key = True
+
+    async def complete(self, messages, model, max_tokens):
+        """
+        Run one chat completion.
+        :param messages: Chat messages in OpenAI format.
+        :param model: Model name.
+        :param max_tokens: Response token budget.
+        :return: A CompletionResult.
+        :raises TransportError: If the request failed.
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        """Release connections; the backend must not be used afterwards."""
+
+
+class OpenAIHTTPBackend(LLMBackend):
+    """
+    OpenAI-compatible chat completions over one pooled aiohttp session.
+    The session is opened lazily inside the running event loop and kept for the
+    whole run, so chunks reuse keep-alive connections instead of paying a TLS
+    handshake per request. With `stream` enabled the response is read as
+    server-sent events and appended to a buffer as it arrives.
+    """
+
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, pool_size=16,
+                 request_timeout=DEFAULT_REQUEST_TIMEOUT, connect_timeout=DEFAULT_CONNECT_TIMEOUT, stream=True):
+        self.api_key = api_key
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.stream = stream
+        self.pool_size = pool_size
+        self.request_timeout = request_timeout
+        self.connect_timeout = connect_timeout
+        self.session = None
+
+    def get_session(self):
+        if self.session is None:
+            import aiohttp  # Deferred so that importing the engine stays cheap
+
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300,
+            )
+            timeout = aiohttp.ClientTimeout(total=self.request_timeout, sock_connect=self.connect_timeout)
+            headers = {"Content-Type": "application/json"}
+            if self.api_key:
+                headers["Authorization"] = f"Bearer {self.api_key}"
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers)
+        return self.session
+
+    async def complete(self, messages, model, max_tokens):
+        import aiohttp
+
+        payload = {"model": model, "messages": messages, "max_tokens": max_tokens}
+        if self.stream:
+            payload["stream"] = True
+            # Without this the API reports no token usage for streamed responses
+            payload["stream_options"] = {"include_usage": True}
+        started = time.monotonic()
+        try:
+            async with self.get_session().post(self.url, json=payload) as response:
+                if response.status >= 400:
+                    raise self.error_for(response.status, await response.text(), response.headers)
+                if self.stream:
+                    return await self.read_stream(response, started)
+                data = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise TransportError(f"{type(e).__name__}: {e}") from e
+        except ValueError as e:
+            # A truncated or garbled body, retried like a malformed stream event
+            raise TransportError(f"Malformed response: {e}") from e
+
+        try:
+            choice = data["choices"][0]
+            text = choice["message"]["content"] or ""
+            usage = data.get("usage") or {}
+        except (KeyError, IndexError, TypeError, AttributeError) as e:
+            raise TransportError(f"Malformed response: {type(e).__name__}: {e}") from e
+        return CompletionResult(
+            text,
+            choice.get("finish_reason") or "stop",
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            time.monotonic() - started,
+        )
+
+    @staticmethod
+    async def read_stream(response, started):
+        """
+        Accumulate a streamed completion.
+        Each `data:` event carries a delta; the last content event carries the finish reason,
+        and the usage follows in an event of its own with no choices.
+        """
+        parts = []
+        finish_reason = None
+        first_byte_latency = None
+        usage = {}
+        async for raw_line in response.content:
+            try:
+                line = raw_line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+            except ValueError as e:
+                # A garbled event is a transport fault like a dropped connection, so it is retried
+                raise TransportError(f"Malformed stream event: {e}") from e
+            usage = event.get("usage") or usage
+            for choice in event.get("choices") or []:
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    if first_byte_latency is None:
+                        first_byte_latency = time.monotonic() - started
+                    parts.append(content)
+                finish_reason = choice.get("finish_reason") or finish_reason
+
+        if finish_reason is None:
+            # The stream ended without saying why; treat it like a dropped connection
+            raise TransportError("Stream ended before the completion finished")
+        return CompletionResult(
+            "".join(parts),
+            finish_reason,
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            first_byte_latency,
+        )
+
+    @staticmethod
+    def error_for(status, body, headers):
+        """Map an HTTP error response to a TransportError."""
+        message = f"HTTP {status}: {body[:500]}"
+        if status == 429:
+            return RateLimitError(message, status, retry_after=parse_retry_after(headers))
+        # Server errors and timeouts are worth retrying, bad keys or requests are not
+        retryable = status >= 500 or status in (408, 409)
+        return TransportError(message, status, retryable=retryable, retry_after=parse_retry_after(headers))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class MockBackend(LLMBackend):
+    """
+    In-process stand-in for tests and benchmarks.
+    Answers every request with the code from the first user message unchanged
+    (or passed through `transform`) after `latency` seconds, and counts the calls
+    it served. Answers longer than `max_output_chars` are cut off with
+    finish_reason 'length'; a continuation request (the partial answer sent back
+    as an assistant message) gets the rest.
+    """
+
+    requires_api_key = False
+
+    def __init__(self, latency=0.0, transform=None, max_output_chars=None):
+        self.latency = latency
+        self.transform = transform
+        self.max_output_chars = max_output_chars
+        self.calls = 0
+
+    async def complete(self, messages, model, max_tokens):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        text = next(message["content"] for message in messages if message["role"] == "user")
+        if self.transform:
+            text = self.transform(text)
+
+        # Continue after whatever the assistant already produced
+        written = "".join(message["content"] for message in messages if message["role"] == "assistant")
+        text = text[len(written):]
+        finish_reason = "stop"
+        if self.max_output_chars is not None and len(text) > self.max_output_chars:
+            text = text[:self.max_output_chars]
+            finish_reason = "length"
+        prompt_chars = sum(len(message["content"]) for message in messages)
+        return CompletionResult(text, finish_reason, prompt_chars // 4, len(text) // 4, self.latency)
+
+
+def create_backend(config):
+    """Build the backend selected in a RefactorConfig."""
+    if config.backend == "mock":
+        return MockBackend()
+    return OpenAIHTTPBackend(
+        api_key=config.api_key,
+        base_url=config.base_url,
+        pool_size=config.max_concurrent_requests,
+        request_timeout=config.request_timeout,
+        stream=config.stream,
+    )
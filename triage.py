@@ -0,0 +1,306 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import ast
+import asyncio
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Files with fewer lines of code than this are copied through
+DEFAULT_MIN_LINES = 10
+
+# A file whose most complex function stays at or below this, with no lint issues
+# and at most DEFAULT_CLEAN_LINES lines of code, is considered clean already
+DEFAULT_CLEAN_COMPLEXITY = 4
+DEFAULT_CLEAN_LINES = 150
+
+# Banners code generators leave at the top of a file, matched case-insensitively against
+# each line of the leading comment block (without its '#') and the docstring's first line
+DEFAULT_GENERATED_PATTERNS = [
+    r"@generated\b",
+    r"\bdo not edit\b",
+    r"\bauto-?generated by\b",
+    r"^(this (file|module|code) (is|was|has been) )?(automatically |auto-?)?generated (by|from)\b",
+    r"^code generated\b",
+]
+
+# Generated modules recognisable by name alone
+GENERATED_FILE_PATTERNS = [r"_pb2(_grpc)?\.py$", r"_rc\.py$"]
+
+# Only the head of a file is searched for generated-code banners
+GENERATED_MARKER_BYTES = 2048
+
+# Lint-style limits
+MAX_FUNCTION_LINES = 60
+MAX_ARGUMENTS = 6
+MAX_LINE_LENGTH = 120
+
+# Files sent to one worker process at a time
+TRIAGE_BATCH_SIZE = 32
+
+# Triage reasons
+GENERATED = "generated"
+TINY = "tiny"
+CLEAN = "clean"
+
+
+class FileReport:
+    """Cheap metrics for one file, computed without any API call."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lines = 0
+        self.complexity = 0
+        self.issues = 0
+        self.generated = False
+        self.parses = True
+
+    def __repr__(self):
+        return (f"FileReport({self.path}, {self.lines} lines, complexity {self.complexity}, "
+                f"{self.issues} issues{', generated' if self.generated else ''})")
+
+
+def is_docstring(node):
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+
+
+def count_code_lines(tree):
+    """
+    Lines holding statements; blank lines, comments and docstrings do not count.
+    Compound statements count their header line, their bodies count on their own.
+    """
+    lines = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.stmt) or is_docstring(node):
+            continue
+        if any(isinstance(getattr(node, field, None), list) and getattr(node, field) and isinstance(getattr(node, field)[0], ast.stmt)
+               for field in ("body", "orelse", "finalbody")):
+            lines.add(node.lineno)
+        else:
+            lines.update(range(node.lineno, node.end_lineno + 1))
+    return len(lines)
+
+
+def cyclomatic_complexity(node):
+    """
+    McCabe complexity of a function or module: one plus the number of branch points.
+    Nested functions and classes are not counted, they are measured on their own.
+    """
+    complexity = 1
+    pending = list(ast.iter_child_nodes(node))
+    while pending:
+        child = pending.pop()
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            continue
+        if isinstance(child, (ast.If, ast.IfExp, ast.For, ast.AsyncFor, ast.While, ast.ExceptHandler, ast.Assert)):
+            complexity += 1
+        elif isinstance(child, ast.BoolOp):
+            complexity += len(child.values) - 1
+        elif isinstance(child, ast.comprehension):
+            complexity += 1 + len(child.ifs)
+        elif isinstance(child, ast.match_case):
+            complexity += 1
+        pending.extend(ast.iter_child_nodes(child))
+    return complexity
+
+
+def max_complexity(tree):
+    """Complexity of the most complex function, or of the module-level code if that is higher."""
+    highest = cyclomatic_complexity(tree)
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            highest = max(highest, cyclomatic_complexity(node))
+    return highest
+
+
+def count_issues(tree, code, is_package):
+    """
+    Count lint-style problems a refactoring would fix: bare excepts, mutable defaults,
+    `== None`, wildcard imports, `global`, long functions and argument lists, long
+    lines and unused imports (not checked in `__init__.py`, where imports are re-exports).
+    """
+    issues = sum(1 for line in code.splitlines() if len(line) > MAX_LINE_LENGTH)
+    imported = {}
+    used = set()
+    exported = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ExceptHandler) and node.type is None:
+            issues += 1
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            args = node.args
+            defaults = args.defaults + [default for default in args.kw_defaults if default is not None]
+            issues += sum(1 for default in defaults if isinstance(default, (ast.List, ast.Dict, ast.Set)))
+            if len(args.posonlyargs) + len(args.args) + len(args.kwonlyargs) > MAX_ARGUMENTS:
+                issues += 1
+            if node.end_lineno - node.lineno + 1 > MAX_FUNCTION_LINES:
+                issues += 1
+        elif isinstance(node, ast.Compare):
+            issues += sum(
+                1 for op, comparator in zip(node.ops, node.comparators)
+                if isinstance(op, (ast.Eq, ast.NotEq)) and isinstance(comparator, ast.Constant) and comparator.value is None
+            )
+        elif isinstance(node, ast.Global):
+            issues += 1
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name == "*":
+                    issues += 1
+                elif not (isinstance(node, ast.ImportFrom) and node.module == "__future__"):
+                    imported[(alias.asname or alias.name).split(".")[0]] = node
+        elif isinstance(node, ast.Name):
+            used.add(node.id)
+        elif isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == "__all__" for target in node.targets):
+            exported.update(element.value for element in ast.walk(node.value) if isinstance(element, ast.Constant))
+    if not is_package:
+        issues += sum(1 for name in imported if name not in used and name not in exported)
+    return issues
+
+
+def looks_generated(path, code, docstring, generated_patterns):
+    """
+    Check the file name, the comment block before the first statement and the first
+    line of the module docstring for code generator banners. Comments further down
+    and the rest of the docstring are not searched, so a module that merely talks
+    about generated code is not mistaken for it.
+    """
+    name = Path(path).name
+    if any(re.search(pattern, name) for pattern in GENERATED_FILE_PATTERNS):
+        return True
+    banner = []
+    for line in code[:GENERATED_MARKER_BYTES].splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            break
+        banner.append(line.lstrip("#").strip())
+    docstring_lines = (docstring or "").strip().splitlines()
+    banner.extend(docstring_lines[:1])
+    text = "\n".join(banner)
+    return any(re.search(pattern, text, re.IGNORECASE | re.MULTILINE) for pattern in generated_patterns)
+
+
+def analyze_file(path, generated_patterns=DEFAULT_GENERATED_PATTERNS):
+    """
+    Compute the triage metrics of one file.
+    Runs in a worker process. A file that does not parse keeps `parses` False and
+    is never skipped, so the rest of the pipeline decides what to do with it.
+    """
+    report = FileReport(path)
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        code = f.read()
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        report.parses = False
+        return report
+    report.lines = count_code_lines(tree)
+    report.generated = looks_generated(path, code, ast.get_docstring(tree, clean=False), generated_patterns)
+    report.complexity = max_complexity(tree)
+    report.issues = count_issues(tree, code, Path(path).name == "__init__.py")
+    return report
+
+
+def analyze_files(paths, generated_patterns=DEFAULT_GENERATED_PATTERNS):
+    """Analyze a batch of files in one worker call; unreadable files get no report."""
+    reports = []
+    for path in paths:
+        try:
+            reports.append(analyze_file(path, generated_patterns))
+        except OSError:
+            reports.append(None)
+    return reports
+
+
+class Triage:
+    """
+    Decides which files are worth an API call before any request is made.
+    Generated files, tiny files and small files that are simple and lint-clean
+    already are skipped; the metrics are computed in a process pool, in batches.
+    Each `triage` call starts a pool of its own unless `open` started one that
+    every call shares until `close`.
+    """
+
+    def __init__(self, min_lines=DEFAULT_MIN_LINES, clean_complexity=DEFAULT_CLEAN_COMPLEXITY,
+                 clean_lines=DEFAULT_CLEAN_LINES, generated_patterns=None, max_workers=None):
+        self.min_lines = min_lines
+        self.clean_complexity = clean_complexity
+        self.clean_lines = clean_lines
+        self.generated_patterns = list(DEFAULT_GENERATED_PATTERNS if generated_patterns is None else generated_patterns)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pool = None
+
+    def open(self):
+        """Start the pool every `triage` call shares, for callers that triage files in many rounds."""
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self
+
+    def close(self, wait=True):
+        if self.pool is not None:
+            self.pool.shutdown(wait=wait, cancel_futures=not wait)
+            self.pool = None
+
+    def skip_reason(self, report):
+        """
+        Why a file can be copied through unchanged.
+        :return: GENERATED, TINY or CLEAN, or None if the file should be refactored.
+        """
+        if report is None or not report.parses:
+            return None
+        if report.generated:
+            return GENERATED
+        if report.lines < self.min_lines:
+            return TINY
+        if report.lines <= self.clean_lines and report.complexity <= self.clean_complexity and not report.issues:
+            return CLEAN
+        return None
+
+    async def triage(self, paths):
+        """
+        Analyze files in parallel across cores.
+        :param paths: Paths of the files to triage.
+        :return: A dict mapping each skipped path to its reason.
+        """
+        paths = list(paths)
+        if not paths:
+            return {}
+        batches = [paths[i:i + TRIAGE_BATCH_SIZE] for i in range(0, len(paths), TRIAGE_BATCH_SIZE)]
+        loop = asyncio.get_running_loop()
+        pool = self.pool or ProcessPoolExecutor(max_workers=min(self.max_workers, len(batches)))
+        try:
+            results = await asyncio.gather(*(
+                loop.run_in_executor(pool, analyze_files, batch, self.generated_patterns) for batch in batches
+            ))
+        finally:
+            if pool is not self.pool:
+                # A stopped run does not wait for the remaining batches
+                pool.shutdown(wait=False, cancel_futures=True)
+        skipped = {}
+        for batch, reports in zip(batches, results):
+            for path, report in zip(batch, reports):
+                reason = self.skip_reason(report)
+                if reason is not None:
+                    skipped[path] = reason
+        return skipped
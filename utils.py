@@ -22,11 +22,82 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import json
 import queue
+import threading
+import time
 
 # Initialize logging queue
 log_queue = queue.Queue()
 
+# Severity levels, lowest first
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+# Default structured log file for the GUI and the --log-file option
+DEFAULT_LOG_FILE = "refactor_log.jsonl"
+
+# Extra destinations that receive every record with its level
+log_sinks = []
+
+
+class JSONLogSink:
+    """
+    Appends log records to a file, one JSON object per line.
+    Each record has the time, level, thread name and message. Records below
+    `level` are dropped; warnings and errors are flushed immediately.
+    """
+
+    def __init__(self, path, level="DEBUG"):
+        self.path = path
+        self.min_level = LOG_LEVELS.index(level)
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, level, message):
+        if LOG_LEVELS.index(level) < self.min_level:
+            return
+        record = json.dumps({
+            "time": round(time.time(), 3),
+            "level": level,
+            "thread": threading.current_thread().name,
+            "message": message,
+        })
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(record + "\n")
+            if level in ("WARNING", "ERROR"):
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def add_log_sink(sink):
+    """Start sending log records to `sink`."""
+    log_sinks.append(sink)
+    return sink
+
+
+def remove_log_sink(sink):
+    """Stop sending log records to `sink` and close it."""
+    if sink in log_sinks:
+        log_sinks.remove(sink)
+    sink.close()
+
+
+def drain_log_queue():
+    """Take every message currently waiting in the log queue."""
+    messages = []
+    try:
+        while True:
+            messages.append(log_queue.get_nowait())
+    except queue.Empty:
+        pass
+    return messages
+
+
 def save_api_key(api_key, file_path):
     """Save the API key to a file"""
     try:
@@ -43,6 +114,12 @@ def load_api_key(file_path):
     except FileNotFoundError:
         return ""
 
-def log(message):
-    """Thread-safe logging function"""
-    log_queue.put(message)
+def log(message, level="INFO"):
+    """
+    Thread-safe logging function.
+    Every record goes to the registered sinks; INFO and above also go to the log queue shown to the user.
+    """
+    for sink in list(log_sinks):
+        sink.write(level, message)
+    if level != "DEBUG":
+        log_queue.put(message)
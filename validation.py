@@ -0,0 +1,152 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import ast
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Re-requests allowed per chunk after its response fails validation
+DEFAULT_VALIDATION_RETRIES = 2
+
+# A body may shrink when it is refactored, but not below this share of its AST nodes
+MIN_BODY_RATIO = 0.3
+
+# Bodies smaller than this are too short for the size comparison to mean anything
+MIN_COMPARED_BODY_NODES = 8
+
+
+def body_size(body):
+    """Number of AST nodes in a list of statements."""
+    return sum(1 for statement in body for _ in ast.walk(statement))
+
+
+def is_placeholder(body):
+    """True for a body that is only a docstring, `pass` or `...`."""
+    for statement in body:
+        if isinstance(statement, ast.Pass):
+            continue
+        if isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant):
+            continue  # Docstring or Ellipsis
+        return False
+    return True
+
+
+def signature(node):
+    """Argument names of a function, in order and grouped by kind."""
+    args = node.args
+    return (
+        tuple(arg.arg for arg in args.posonlyargs),
+        tuple(arg.arg for arg in args.args),
+        args.vararg.arg if args.vararg else None,
+        tuple(arg.arg for arg in args.kwonlyargs),
+        args.kwarg.arg if args.kwarg else None,
+    )
+
+
+def summarize_definitions(tree):
+    """
+    Map the top-level functions and classes of a module, and the methods of those
+    classes, to their signature and body size.
+    """
+    summary = {}
+
+    def visit(body, prefix):
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                summary[prefix + node.name] = (signature(node), body_size(node.body), is_placeholder(node.body))
+            elif isinstance(node, ast.ClassDef):
+                summary[prefix + node.name] = (None, body_size(node.body), is_placeholder(node.body))
+                if not prefix:
+                    visit(node.body, node.name + ".")
+
+    visit(tree.body, "")
+    return summary
+
+
+def compare_definitions(original, refactored):
+    """
+    Problems found by comparing two definition summaries.
+    Definitions may be added, but not lost, renamed, re-signed or hollowed out.
+    """
+    problems = []
+    for name, (original_signature, original_size, original_placeholder) in original.items():
+        if name not in refactored:
+            problems.append(f"{name} is missing")
+            continue
+        new_signature, new_size, new_placeholder = refactored[name]
+        if original_signature != new_signature:
+            problems.append(f"signature of {name} changed")
+        elif new_placeholder and not original_placeholder:
+            problems.append(f"body of {name} was replaced with a placeholder")
+        elif original_size >= MIN_COMPARED_BODY_NODES and new_size < original_size * MIN_BODY_RATIO:
+            problems.append(f"body of {name} shrank from {original_size} to {new_size} nodes")
+    return problems
+
+
+def validate_code(original, refactored, filename="<chunk>"):
+    """
+    Check refactored code against the code it replaces.
+    Runs in a worker process. Code whose original does not parse (a slice cut at
+    line boundaries, or a broken input) cannot be judged and is accepted.
+    :return: A list of problems; empty when the code is acceptable.
+    """
+    try:
+        original_tree = ast.parse(original)
+    except SyntaxError:
+        return []
+    if original.strip() and not refactored.strip():
+        return ["response is empty"]
+    try:
+        refactored_tree = ast.parse(refactored, filename)
+        compile(refactored_tree, filename, "exec")
+    except (SyntaxError, ValueError) as e:
+        return [f"does not compile: {e}"]
+    return compare_definitions(summarize_definitions(original_tree), summarize_definitions(refactored_tree))
+
+
+class Validator:
+    """
+    Runs `validate_code` in a process pool, so parsing large responses never
+    stalls the event loop. The pool starts on first use.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.pool = None
+
+    async def validate(self, original, refactored, filename="<chunk>"):
+        """
+        Validate refactored code off the event loop.
+        :return: A list of problems; empty when the code is acceptable.
+        """
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, validate_code, original, refactored, filename)
+
+    def close(self, wait=True):
+        if self.pool is not None:
+            self.pool.shutdown(wait=wait, cancel_futures=not wait)
+            self.pool = None
@@ -0,0 +1,312 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from ratelimit import RateLimiter
+
+# Seconds a claimed file stays leased without a heartbeat before other workers may take it
+DEFAULT_LEASE_SECONDS = 120
+
+# Times a file is handed out before it is given up as failed
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Files claimed per round trip to the queue
+DEFAULT_CLAIM_BATCH = 8
+
+# Seconds of a shared quota a worker takes from the queue at once, so that not every request is a write
+TOKEN_BATCH_SECONDS = 5.0
+
+# Task states
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+COPIED = "copied"  # Triaged and copied through unchanged; finished, but never recorded as refactored
+FAILED = "failed"
+
+# States of a file that needs no more work
+FINISHED_STATES = (DONE, COPIED)
+
+
+class WorkQueue:
+    """
+    Durable queue of files to refactor, shared by every worker of a sharded run.
+    A SQLite database with lease/ack semantics: a worker claims files for a limited
+    time, keeps the lease alive with heartbeats and acknowledges each file once its
+    output is on disk. Leases of a worker that died expire and the files go back to
+    other workers. The same database holds the run's settings and the buckets of
+    the global rate limit. Workers on other machines can share it over a network
+    filesystem, provided that filesystem supports SQLite's file locking; the queue
+    keeps SQLite's rollback journal for that, as WAL needs shared memory on one host.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def open(self):
+        """Open the database, creating the tables on first use."""
+        if self.connection is None:
+            # Transactions are managed explicitly, so that claims take the write lock up front
+            self.connection = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            # Also turns back queues an earlier version left in WAL mode
+            self.connection.execute("PRAGMA journal_mode=DELETE")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, "
+                "state TEXT NOT NULL, owner TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+                "manifest_entry TEXT)"
+            )
+            columns = {row[1] for row in self.connection.execute("PRAGMA table_info(tasks)")}
+            if "manifest_entry" not in columns:
+                # A queue created by an earlier version
+                self.connection.execute("ALTER TABLE tasks ADD COLUMN manifest_entry TEXT")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, size)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+        return self.connection
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    @contextmanager
+    def transaction(self):
+        """Run statements under the database's write lock, committed together."""
+        with self.lock:
+            connection = self.open()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def populate(self, settings, files, keep_done=False):
+        """
+        Fill the queue for a run.
+        :param settings: JSON-serialisable dict the workers read back with `settings`.
+        :param files: (key, path, size) tuples, one per file.
+        :param keep_done: Keep the files an unfinished earlier run of this queue already did.
+        :return: The number of files kept, by state: DONE and COPIED.
+        """
+        files = list(files)
+        keys = {key for key, _, _ in files}
+        with self.transaction() as connection:
+            done = {}
+            unfinished = connection.execute(
+                "SELECT 1 FROM tasks WHERE state NOT IN (?, ?) LIMIT 1", FINISHED_STATES
+            ).fetchone()
+            if keep_done and unfinished:
+                done = {
+                    key: (state, entry) for key, state, entry in connection.execute(
+                        "SELECT key, state, manifest_entry FROM tasks WHERE state IN (?, ?)", FINISHED_STATES
+                    )
+                    if key in keys
+                }
+            connection.execute("DELETE FROM tasks")
+            connection.execute("DELETE FROM settings")
+            connection.execute("DELETE FROM buckets")
+            connection.execute("INSERT INTO settings (name, value) VALUES ('run', ?)", (json.dumps(settings),))
+            connection.executemany(
+                "INSERT INTO tasks (key, path, size, state, manifest_entry) VALUES (?, ?, ?, ?, ?)",
+                [(key, str(path), size) + done.get(key, (PENDING, None)) for key, path, size in files],
+            )
+        return {state: sum(1 for kept, _ in done.values() if kept == state) for state in FINISHED_STATES}
+
+    def settings(self):
+        """The settings stored by `populate`, or None for an empty queue."""
+        with self.lock:
+            row = self.open().execute("SELECT value FROM settings WHERE name = 'run'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def claim(self, owner, count=DEFAULT_CLAIM_BATCH, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Lease up to `count` files, largest first: pending ones and ones whose lease expired.
+        Expired files that used up their attempts are marked failed instead.
+        :return: A list of (key, path, size) tuples; empty when nothing is claimable right now.
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE tasks SET state = ?, owner = NULL WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, LEASED, now, max_attempts),
+            )
+            rows = connection.execute(
+                "SELECT key, path, size FROM tasks WHERE state = ? OR (state = ? AND lease_expires < ?) "
+                "ORDER BY size DESC LIMIT ?",
+                (PENDING, LEASED, now, count),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE tasks SET state = ?, owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE key = ?",
+                [(LEASED, owner, now + lease_seconds, key) for key, _, _ in rows],
+            )
+        return rows
+
+    def renew(self, owner, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Extend every lease `owner` holds; the worker's heartbeat."""
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE state = ? AND owner = ?",
+                (time.time() + lease_seconds, LEASED, owner),
+            )
+
+    def ack(self, key, owner, state=DONE, manifest_entry=None):
+        """
+        Finish a leased file. A worker whose lease was taken over in the meantime
+        no longer owns the file, and its acknowledgement is ignored.
+        :param state: DONE, COPIED or FAILED.
+        :param manifest_entry: The manifest entry of a refactored file, recorded when its output was written.
+        """
+        entry = None if manifest_entry is None else json.dumps(manifest_entry)
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE tasks SET state = ?, lease_expires = NULL, manifest_entry = ? "
+                "WHERE key = ? AND owner = ? AND state = ?",
+                (state, entry, key, owner, LEASED),
+            )
+
+    def release(self, owner):
+        """Hand back every file `owner` still holds, for a worker that stops early."""
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE tasks SET state = ?, owner = NULL, lease_expires = NULL, attempts = MAX(attempts - 1, 0) "
+                "WHERE state = ? AND owner = ?",
+                (PENDING, LEASED, owner),
+            )
+
+    def counts(self):
+        """Number of files and bytes in each state."""
+        with self.lock:
+            rows = self.open().execute("SELECT state, COUNT(*), SUM(size) FROM tasks GROUP BY state").fetchall()
+        counts = {state: (0, 0) for state in (PENDING, LEASED, DONE, COPIED, FAILED)}
+        counts.update({state: (files, size or 0) for state, files, size in rows})
+        return counts
+
+    def has_work(self, owner):
+        """True while files are pending or leased by workers other than `owner`."""
+        with self.lock:
+            row = self.open().execute(
+                "SELECT 1 FROM tasks WHERE state = ? OR (state = ? AND owner != ?) LIMIT 1", (PENDING, LEASED, owner)
+            ).fetchone()
+        return row is not None
+
+    def manifest_entries(self):
+        """The manifest entries the workers recorded for the files they refactored, by key."""
+        with self.lock:
+            rows = self.open().execute(
+                "SELECT key, manifest_entry FROM tasks WHERE state = ? AND manifest_entry IS NOT NULL", (DONE,)
+            ).fetchall()
+        return {key: json.loads(entry) for key, entry in rows}
+
+    def take_tokens(self, name, amount, per_minute, extra=0):
+        """
+        Take `amount` tokens from a shared bucket refilled at `per_minute`.
+        :param extra: Tokens to take on top of `amount` if the bucket has them, to keep for later requests.
+        :return: A (taken, wait) tuple: the tokens taken, or 0 and the seconds to wait before trying again.
+        """
+        rate = per_minute / 60.0
+        amount = min(amount, per_minute)
+        now = time.time()
+        with self.transaction() as connection:
+            row = connection.execute("SELECT value FROM settings WHERE name = 'paused_until'").fetchone()
+            if row and float(row[0]) > now:
+                return 0, float(row[0]) - now
+            row = connection.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens = per_minute if row is None else min(per_minute, row[0] + max(0.0, now - row[1]) * rate)
+            if tokens >= amount:
+                taken, wait = amount + min(extra, tokens - amount), 0.0
+            else:
+                taken, wait = 0, (amount - tokens) / rate
+            connection.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (name, tokens - taken, now)
+            )
+        return taken, wait
+
+    def pause(self, seconds):
+        """Hold back every worker's requests, as asked by the server's Retry-After."""
+        until = time.time() + seconds
+        with self.transaction() as connection:
+            row = connection.execute("SELECT value FROM settings WHERE name = 'paused_until'").fetchone()
+            if row is None or float(row[0]) < until:
+                connection.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('paused_until', ?)", (str(until),))
+
+
+class SharedTokenBucket:
+    """
+    A TokenBucket whose tokens live in the work queue, shared by every worker.
+    Tokens are taken from the queue TOKEN_BATCH_SECONDS of quota at a time and
+    spent locally, so a worker writes to the queue about once per batch rather
+    than once per request. The batch a worker holds is still spent after another
+    worker's Retry-After pause starts.
+    """
+
+    def __init__(self, work_queue, name, per_minute):
+        self.work_queue = work_queue
+        self.name = name
+        self.per_minute = per_minute
+        self.batch = per_minute / 60.0 * TOKEN_BATCH_SECONDS
+        self.reserve = 0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.per_minute)
+        # Requests of this worker queue up locally, so only one of them polls the database
+        async with self.lock:
+            while self.reserve < amount:
+                taken, wait = await asyncio.to_thread(
+                    self.work_queue.take_tokens, self.name, amount - self.reserve, self.per_minute, self.batch
+                )
+                self.reserve += taken
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            self.reserve -= amount
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    RateLimiter whose per-minute quotas and Retry-After pauses hold across all workers.
+    The concurrency limit stays per worker.
+    """
+
+    def __init__(self, work_queue, requests_per_minute, tokens_per_minute, max_concurrent_requests):
+        super().__init__(requests_per_minute, tokens_per_minute, max_concurrent_requests)
+        self.work_queue = work_queue
+        self.request_bucket = SharedTokenBucket(work_queue, "requests", requests_per_minute)
+        self.token_bucket = SharedTokenBucket(work_queue, "tokens", tokens_per_minute)
+
+    def pause(self, seconds):
+        super().pause(seconds)
+        # Shared in the background; this worker is already paused locally
+        asyncio.ensure_future(asyncio.to_thread(self.work_queue.pause, seconds))
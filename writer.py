@@ -0,0 +1,356 @@
+"""
+MIT License
+
+Copyright (c) 2024 StarChild
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from utils import log
+
+# Refactored files waiting for the writer before producers have to wait
+DEFAULT_WRITE_QUEUE_SIZE = 64
+
+# Out-of-order bundle entries kept in memory before they are spilled to disk
+DEFAULT_BUNDLE_BUFFER_BYTES = 16 * 1024 * 1024
+
+
+def default_file_mode():
+    """The mode a plain open() gives a new file: 0o666 without the process umask."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+# Read once at import, because reading the umask briefly changes it for every thread.
+# Temporary files are created 0600 and keep that mode when renamed, so outputs get this one.
+NEW_FILE_MODE = default_file_mode()
+
+
+def create_temp_file(folder, prefix, suffix=".tmp"):
+    """
+    Create a temporary file that will be renamed into place, with the mode of a normal new file.
+    :return: The open file descriptor and the file's path.
+    """
+    fd, path = tempfile.mkstemp(dir=folder, prefix=prefix, suffix=suffix)
+    try:
+        os.chmod(path, NEW_FILE_MODE)
+    except BaseException:
+        os.close(fd)
+        os.unlink(path)
+        raise
+    return fd, path
+
+
+def write_atomic(path, text):
+    """
+    Write a file so that readers only ever see the old or the complete new content.
+    The text goes to a temporary file in the same folder, which is then renamed over the target.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = create_temp_file(path.parent, f".{path.name}.")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class StreamedOutput:
+    """
+    A refactored file written piece by piece to a temporary file, for files too large
+    to hold in memory. Once complete it is submitted to the writer like text, which
+    then moves or copies the file instead of writing a string.
+    """
+
+    def __init__(self, folder, name):
+        Path(folder).mkdir(parents=True, exist_ok=True)
+        fd, path = create_temp_file(folder, f".{name}.")
+        self.path = Path(path)
+        self.file = os.fdopen(fd, 'w', encoding='utf-8')
+        self.ends_with_newline = False
+
+    def write(self, text):
+        if text:
+            self.file.write(text)
+            self.ends_with_newline = text.endswith("\n")
+
+    def close(self):
+        """Flush the file to disk; it stays in place until the writer takes it."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def bundle_header(key):
+    """Header line that starts each module in a single-file bundle."""
+    return f"# ===== module: {key} =====\n"
+
+
+class OutputWriter:
+    """
+    Dedicated writer stage fed by a queue.
+    Refactor workers hand finished files to `submit` and move on; one writer task
+    does all disk work in a thread, so workers only wait when the queue is full.
+    Subclasses decide where the text ends up.
+    """
+
+    def __init__(self, queue_size=DEFAULT_WRITE_QUEUE_SIZE, write_seconds=None):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task = None
+        self.failed = set()
+        self.write_seconds = write_seconds  # Optional metrics.Histogram
+
+    def start(self):
+        """Start the writer task in the running event loop."""
+        self.task = asyncio.create_task(self.run())
+        return self
+
+    def open_output(self, key):
+        """Start a StreamedOutput for `key`, in a folder from which the writer can take it cheaply."""
+        raise NotImplementedError
+
+    async def submit(self, key, text, after_write=None):
+        """
+        Queue a refactored file.
+        :param key: Path of the file relative to the input directory, in POSIX form.
+        :param text: Refactored source, or a closed StreamedOutput holding it.
+        :param after_write: Optional callable run in the writer thread once the text is safely on disk.
+        """
+        await self.queue.put((key, text, after_write))
+
+    async def skip(self, key):
+        """Tell the writer that `key` will not be submitted."""
+        await self.queue.put((key, None, None))
+
+    async def close(self):
+        """Write everything still queued and finish the output."""
+        await self.queue.put(None)
+        await self.task
+        await asyncio.to_thread(self.finish)
+
+    async def abort(self):
+        """Stop without finishing the output; files already renamed into place stay."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        await asyncio.to_thread(self.discard)
+
+    async def run(self):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            key, text, after_write = item
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.handle, key, text, after_write)
+                if self.write_seconds is not None and text is not None:
+                    self.write_seconds.observe(time.perf_counter() - started)
+            except Exception as e:
+                log(f"Error writing output for {key}: {e}", "ERROR")
+                self.failed.add(key)
+
+    def handle(self, key, text, after_write):
+        raise NotImplementedError
+
+    def finish(self):
+        """Called once after the last item; nothing to do by default."""
+
+    def discard(self):
+        """Remove temporary files after an aborted run; nothing to do by default."""
+
+
+class FolderWriter(OutputWriter):
+    """Mirrors the input tree under an output folder, one atomic write per file."""
+
+    def __init__(self, output_dir, queue_size=DEFAULT_WRITE_QUEUE_SIZE, write_seconds=None):
+        super().__init__(queue_size, write_seconds)
+        self.output_dir = Path(output_dir)
+
+    def output_path(self, key):
+        return self.output_dir / key
+
+    def open_output(self, key):
+        # Next to the target, so that finishing it is a rename
+        path = self.output_path(key)
+        return StreamedOutput(path.parent, path.name)
+
+    async def abort(self):
+        # Every queued file is complete, so it is still worth writing
+        await self.close()
+
+    def handle(self, key, text, after_write):
+        if text is None:
+            return
+        if isinstance(text, StreamedOutput):
+            os.replace(text.path, self.output_path(key))
+        else:
+            write_atomic(self.output_path(key), text)
+        if after_write:
+            after_write()
+
+
+class BundleWriter(OutputWriter):
+    """
+    Streams every module into one output file, in a fixed order.
+    Modules appear in the order given by `keys` no matter when they finish, each
+    under a header naming it (a bundle of one module has no header, so refactoring a
+    single file gives just that file). Modules that finish early are held in memory up to
+    `buffer_bytes` and spilled to temporary files beyond that. The bundle is built
+    in a temporary file and renamed into place when complete.
+    """
+
+    def __init__(self, output_path, keys, queue_size=DEFAULT_WRITE_QUEUE_SIZE, buffer_bytes=DEFAULT_BUNDLE_BUFFER_BYTES,
+                 write_seconds=None):
+        super().__init__(queue_size, write_seconds)
+        self.output_path = Path(output_path)
+        self.order = sorted(keys)
+        self.headers = len(self.order) > 1
+        self.buffer_bytes = buffer_bytes
+        self.position = 0
+        self.pending = {}
+        self.pending_bytes = 0
+        self.spill_dir = None
+        self.emitted = 0
+        self.bundle = None
+        self.temp_path = None
+
+    def open_bundle(self):
+        if self.bundle is None:
+            self.output_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, self.temp_path = create_temp_file(self.output_path.parent, f".{self.output_path.name}.")
+            self.bundle = os.fdopen(fd, 'w', encoding='utf-8')
+        return self.bundle
+
+    def open_output(self, key):
+        return StreamedOutput(self.open_spill_dir(), "module")
+
+    def open_spill_dir(self):
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="refactor-bundle-")
+        return self.spill_dir
+
+    def handle(self, key, text, after_write):
+        self.open_bundle()
+        self.hold(key, text)
+        # Write every module whose turn has come
+        while self.position < len(self.order) and self.order[self.position] in self.pending:
+            next_key = self.order[self.position]
+            self.emit(next_key, self.release(next_key))
+            self.position += 1
+
+    def hold(self, key, text):
+        """Keep an entry until its turn, spilling it to disk when the buffer is full."""
+        if isinstance(text, StreamedOutput):
+            self.pending[key] = text.path
+            return
+        is_next = self.position < len(self.order) and key == self.order[self.position]
+        if text is None or is_next or self.pending_bytes + len(text) <= self.buffer_bytes:
+            self.pending[key] = text
+            self.pending_bytes += len(text or "")
+            return
+        fd, spill_path = tempfile.mkstemp(dir=self.open_spill_dir(), suffix=".py")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        self.pending[key] = Path(spill_path)
+
+    def release(self, key):
+        entry = self.pending.pop(key)
+        if not isinstance(entry, Path):
+            self.pending_bytes -= len(entry or "")
+        return entry
+
+    def emit(self, key, text):
+        """Write one module; spilled and streamed modules are copied over in blocks."""
+        if text is None:
+            return
+        if self.headers:
+            if self.emitted:
+                self.bundle.write("\n\n")
+            self.bundle.write(bundle_header(key))
+        if isinstance(text, Path):
+            with open(text, 'r', encoding='utf-8') as f:
+                shutil.copyfileobj(f, self.bundle)
+            ends_with_newline = os.path.getsize(text) > 0 and self.last_char(text) == "\n"
+            text.unlink()
+        else:
+            self.bundle.write(text)
+            ends_with_newline = text.endswith("\n")
+        if self.headers and not ends_with_newline:
+            self.bundle.write("\n")
+        self.emitted += 1
+
+    @staticmethod
+    def last_char(path):
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1).decode('latin-1')
+
+    def finish(self):
+        # Keys never submitted (failed or cancelled files) are left out
+        for key in self.order[self.position:]:
+            if key in self.pending:
+                self.emit(key, self.release(key))
+        self.position = len(self.order)
+
+        self.open_bundle()
+        self.bundle.flush()
+        os.fsync(self.bundle.fileno())
+        self.bundle.close()
+        os.replace(self.temp_path, self.output_path)
+        self.remove_spill_dir()
+
+    def discard(self):
+        if self.bundle is not None:
+            self.bundle.close()
+            try:
+                os.unlink(self.temp_path)
+            except OSError:
+                pass
+        self.remove_spill_dir()
+
+    def remove_spill_dir(self):
+        if self.spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None